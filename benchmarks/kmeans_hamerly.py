@@ -0,0 +1,62 @@
+"""
+Compares the plain Lloyd iteration of :class:`sktime.clustering.kmeans.KmeansClustering` with the iteration
+accelerated by Hamerly's bounds. Both start from the same initial centers and iterate until no frame changes its
+assignment anymore, the script reports the run times and checks that both yield the same centers.
+
+Usage::
+
+    python benchmarks/kmeans_hamerly.py [--n-samples N] [--dim D] [--n-jobs J] [--dtype float32|float64]
+"""
+import argparse
+import time
+import warnings
+
+import numpy as np
+
+from sktime.clustering.kmeans import KmeansClustering
+
+
+def make_data(n_samples, dim, n_blobs, seed=42):
+    state = np.random.RandomState(seed)
+    blob_centers = state.uniform(-20, 20, size=(n_blobs, dim))
+    labels = state.randint(0, n_blobs, size=n_samples)
+    return blob_centers[labels] + state.randn(n_samples, dim) * 2.
+
+
+def run(data, initial_centers, algorithm, n_jobs):
+    est = KmeansClustering(n_clusters=len(initial_centers), max_iter=10000, tolerance=0, n_jobs=n_jobs,
+                           initial_centers=initial_centers, algorithm=algorithm)
+    iterations = [0]
+
+    def callback_loop():
+        iterations[0] += 1
+
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        model = est.fit(data, callback_loop=callback_loop).fetch_model()
+    return time.perf_counter() - start, iterations[0], model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--n-samples', type=int, default=200000)
+    parser.add_argument('--dim', type=int, default=10)
+    parser.add_argument('--n-jobs', type=int, default=1)
+    parser.add_argument('--dtype', default='float32', choices=('float32', 'float64'))
+    parser.add_argument('--n-clusters', type=int, nargs='+', default=[100, 500, 1000, 2000])
+    args = parser.parse_args()
+
+    data = make_data(args.n_samples, args.dim, n_blobs=200).astype(args.dtype)
+    print(f"{'k':>6} {'lloyd [s]':>10} {'hamerly [s]':>12} {'speedup':>8} {'iterations':>11} {'same centers':>13}")
+    for k in args.n_clusters:
+        initial_centers = KmeansClustering(n_clusters=k, fixed_seed=7, n_jobs=args.n_jobs) \
+            ._pick_initial_centers(data, 'kmeans++', args.n_jobs)
+        t_lloyd, it_lloyd, lloyd = run(data, initial_centers, 'lloyd', args.n_jobs)
+        t_hamerly, _, hamerly = run(data, initial_centers, 'hamerly', args.n_jobs)
+        same = np.array_equal(lloyd.cluster_centers, hamerly.cluster_centers)
+        print(f"{k:>6} {t_lloyd:>10.2f} {t_hamerly:>12.2f} {t_lloyd / t_hamerly:>8.2f} {it_lloyd:>11} {same!s:>13}")
+
+
+if __name__ == '__main__':
+    main()
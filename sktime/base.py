@@ -137,7 +137,9 @@ class _ImmutableInputData(object):
 
     @data.setter
     def data(self, value_):
+        import os
         import numpy as np
+        import scipy.sparse
         args, kwargs = value_
         # store data as a list of ndarrays
         # handle optional y for supervised learning
@@ -156,16 +158,28 @@ class _ImmutableInputData(object):
         value = args[0]
         if isinstance(value, np.ndarray):
             self._data.append(value)
+        elif scipy.sparse.issparse(value):
+            # the stored values of sparse matrices are protected like arrays
+            self._data.append(value.data)
         elif isinstance(value, (list, tuple)):
             for i, x in enumerate(value):
                 if isinstance(x, np.ndarray):
                     self._data.append(x)
+                elif scipy.sparse.issparse(x):
+                    self._data.append(x.data)
+                elif isinstance(x, (str, os.PathLike)):
+                    # files are only read from
+                    pass
                 else:
-                    raise InputFormatError(f'Invalid input element in position {i}, only numpy.ndarrays allowed.')
+                    raise InputFormatError(f'Invalid input element in position {i}, only numpy.ndarrays, '
+                                           f'scipy.sparse matrices or paths to files allowed.')
         elif isinstance(value, Model):
             self._data.append(value)
+        elif callable(value):
+            # callables generating the data are responsible for their output themselves
+            pass
         else:
-            raise InputFormatError(f'Only model, ndarray or list/tuple of ndarray allowed. '
+            raise InputFormatError(f'Only model, ndarray, scipy.sparse matrix or list/tuple of ndarray allowed. '
                                    f'But was of type {type(value)}: {value}.')
 
     def __enter__(self):
@@ -28,9 +28,14 @@ clustering - Algorithms (:mod:`pyemma.coordinates.clustering`)
     :toctree: generated/
 
     KmeansClustering
+    MiniBatchKmeansClustering
+    HierarchicalKmeansClustering
+    KmeansCoreset
     RegularSpaceClustering
 """
 
 from .kmeans import KmeansClustering
 from .kmeans import MiniBatchKmeansClustering
+from .kmeans import HierarchicalKmeansClustering
+from .coreset import KmeansCoreset
 from .regspace import RegularSpaceClustering
@@ -1,16 +1,23 @@
+import os
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from sktime.base import Model, Transformer
 
-from sktime.clustering._clustering_bindings import assign as _assign
+from sktime.clustering._clustering_bindings import assign as _assign, EuclideanMetric, KDTree32, KDTree64
 
 
 class ClusterModel(Model, Transformer):
 
-    def __init__(self, n_clusters, cluster_centers, metric, converged=False):
+    def __init__(self, n_clusters, cluster_centers, metric, converged=False, use_spatial_index='auto'):
         self._n_clusters = n_clusters
         self._cluster_centers = cluster_centers
         self._metric = metric
         self._converged = converged
+        self._spatial_index = None
+        self._spatial_index_fingerprint = None
+        self.use_spatial_index = use_spatial_index
 
     @property
     def cluster_centers(self):
@@ -24,6 +31,89 @@ class ClusterModel(Model, Transformer):
         """
         return self._cluster_centers
 
+    @cluster_centers.setter
+    def cluster_centers(self, value):
+        self._cluster_centers = value
+        self._spatial_index = None
+
+    @property
+    def use_spatial_index(self):
+        """
+        Whether nearest center queries in :meth:`transform` are answered by a KD-tree over the cluster centers.
+        With 'auto' the tree is used for the euclidean metric, at most 5 dimensions and at least 1000 centers, where it
+        is much faster than comparing each point to all centers. In higher dimensions, the tree has to visit too many
+        nodes to pay off.
+
+        Returns
+        -------
+        bool or str
+            one of True, False or 'auto'
+        """
+        return self._use_spatial_index
+
+    @use_spatial_index.setter
+    def use_spatial_index(self, value):
+        valid = (True, False, 'auto')
+        if value not in valid:
+            raise ValueError('invalid parameter "{}" for use_spatial_index. Should be one of {}'.format(value, valid))
+        if value is True and not isinstance(self.metric, EuclideanMetric):
+            raise ValueError('A spatial index can only be used with the euclidean metric.')
+        self._use_spatial_index = value
+
+    @property
+    def spatial_index(self):
+        """
+        The cached KD-tree over the cluster centers. It is built by :meth:`build_spatial_index` or lazily by the
+        first :meth:`transform` which makes use of it and invalidated once new cluster centers are set. The tree keeps
+        a checksum of the centers it was built from, so it is also invalidated if the centers are modified in place,
+        e.g., by ``model.cluster_centers[0] += d``. The tree is pickled together with the model.
+
+        Returns
+        -------
+        KDTree32 or KDTree64 or None
+            the tree or None if it has not been built yet.
+        """
+        if self._spatial_index is not None and self._spatial_index_fingerprint != self._centers_fingerprint():
+            self._spatial_index = None
+        return self._spatial_index
+
+    def _centers_fingerprint(self):
+        centers = np.ascontiguousarray(self.cluster_centers)
+        return centers.shape, centers.dtype.str, zlib.crc32(centers.view(np.uint8))
+
+    def build_spatial_index(self, leaf_size=16):
+        """
+        Builds a KD-tree over the cluster centers, which is subsequently used by :meth:`transform` unless
+        `use_spatial_index` is False.
+
+        Parameters
+        ----------
+        leaf_size : int, default 16
+            maximum number of centers in the leaves of the tree
+
+        Returns
+        -------
+        KDTree32 or KDTree64
+            the tree
+        """
+        if not isinstance(self.metric, EuclideanMetric):
+            raise ValueError('A spatial index can only be used with the euclidean metric.')
+        if self.cluster_centers is None:
+            raise ValueError('There are no cluster centers to build a spatial index for.')
+        centers = np.atleast_2d(self.cluster_centers)
+        tree_type = KDTree32 if centers.dtype == np.float32 else KDTree64
+        self._spatial_index = tree_type(np.ascontiguousarray(centers, dtype=centers.dtype), leaf_size)
+        self._spatial_index_fingerprint = self._centers_fingerprint()
+        return self._spatial_index
+
+    def _query_spatial_index(self):
+        if self.use_spatial_index is False or not isinstance(self.metric, EuclideanMetric):
+            return False
+        if self._spatial_index is not None or self.use_spatial_index is True:
+            return True
+        centers = np.atleast_2d(self.cluster_centers)
+        return centers.shape[1] <= 5 and centers.shape[0] >= 1000
+
     @property
     def n_clusters(self):
         """
@@ -49,5 +139,134 @@ class ClusterModel(Model, Transformer):
 
         if n_jobs is None:
             n_jobs = 0
+        if self._query_spatial_index():
+            index = self.spatial_index
+            if index is None:
+                index = self.build_spatial_index()
+            return index.query(data, n_jobs)
         dtraj = _assign(data, self.cluster_centers, n_jobs, self.metric)
         return dtraj
+
+    def transform_many(self, trajectories, n_jobs=None):
+        """
+        Assigns several trajectories to their closest cluster centers. The assignment runs outside of the GIL, hence
+        the trajectories are processed concurrently, the n_jobs threads being split among them.
+
+        Parameters
+        ----------
+        trajectories : list of np.ndarray
+            trajectories of the same dtype as :attr:`cluster_centers`
+        n_jobs : int or None, default None
+            total number of threads, None uses a single thread
+
+        Returns
+        -------
+        list of np.ndarray
+            the discrete trajectories, in the order of the input trajectories
+        """
+        if n_jobs is None:
+            n_jobs = 1
+        trajectories = list(trajectories)
+        if len(trajectories) == 0:
+            return []
+        # build the spatial index once, before the trajectories are assigned concurrently
+        if self._query_spatial_index() and self.spatial_index is None:
+            self.build_spatial_index()
+        n_workers = min(len(trajectories), max(n_jobs, 1))
+        n_threads = max(n_jobs // n_workers, 1)
+        if n_workers == 1:
+            return [self.transform(traj, n_jobs=n_threads) for traj in trajectories]
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            return list(executor.map(lambda traj: self.transform(traj, n_jobs=n_threads), trajectories))
+
+    def transform_to_disk(self, sources, out_dir, chunksize=100000, n_jobs=None, dtype=np.int32):
+        """
+        Assigns trajectories chunk by chunk and writes the discrete trajectories to .npy files, so that the memory
+        consumption does not depend on the length of the trajectories. Reading the next chunk and writing the labels
+        of the previous one happen on background threads while the current chunk is assigned.
+
+        Parameters
+        ----------
+        sources : list of np.ndarray, np.memmap or paths to .npy files
+            the trajectories of shape (n, d), files are memory mapped. A single trajectory can be given as well.
+        out_dir : str or os.PathLike
+            directory receiving one .npy file per trajectory, it is created if it does not exist. Files are named
+            after the stem of the source file, or after the index of the trajectory for arrays.
+        chunksize : int, default 100000
+            number of frames which are read and assigned at once
+        n_jobs : int or None, default None
+            number of threads used for the assignment, None uses a single thread
+        dtype : numpy integer type, default np.int32
+            type of the written labels, narrower types like np.uint16 save space for fewer clusters
+
+        Returns
+        -------
+        list of str
+            the paths of the written discrete trajectories, in the order of the sources
+        """
+        from numpy.lib.format import open_memmap
+        if n_jobs is None:
+            n_jobs = 1
+        if int(chunksize) <= 0:
+            raise ValueError('chunksize has to be positive')
+        dtype = np.dtype(dtype)
+        if dtype.kind not in 'iu' or np.iinfo(dtype).max < self.n_clusters - 1:
+            raise ValueError(f'labels of {self.n_clusters} clusters do not fit into {dtype}.')
+        if isinstance(sources, (str, os.PathLike, np.ndarray)):
+            sources = [sources]
+
+        trajectories, paths = [], []
+        for i, source in enumerate(sources):
+            if isinstance(source, (str, os.PathLike)):
+                name = os.path.splitext(os.path.basename(source))[0]
+                source = np.load(source, mmap_mode='r')
+            else:
+                name = str(i)
+            trajectories.append(source)
+            paths.append(os.path.join(out_dir, name + '.npy'))
+        if len(set(paths)) != len(paths):
+            raise ValueError('The sources have to result in distinct output files.')
+        os.makedirs(out_dir, exist_ok=True)
+        # allocate all outputs up front, so that also empty trajectories get their file
+        for traj, path in zip(trajectories, paths):
+            if len(traj) == 0:
+                np.save(path, np.empty(0, dtype=dtype))
+            else:
+                output = open_memmap(path, mode='w+', dtype=dtype, shape=(len(traj),))
+                del output
+
+        dim = np.atleast_2d(self.cluster_centers).shape[1]
+
+        def read(item):
+            index, start = item
+            chunk = np.asarray(trajectories[index][start:start + chunksize], dtype=self.cluster_centers.dtype)
+            return index, start, np.ascontiguousarray(chunk.reshape(len(chunk), dim))
+
+        outputs = {}
+
+        def write(index, start, labels):
+            if index not in outputs:
+                # trajectories are processed in order, the previous output is complete
+                for previous in list(outputs):
+                    outputs.pop(previous).flush()
+                outputs[index] = np.load(paths[index], mmap_mode='r+')
+            outputs[index][start:start + len(labels)] = labels
+
+        items = iter([(index, start) for index, traj in enumerate(trajectories)
+                      for start in range(0, len(traj), chunksize)])
+        with ThreadPoolExecutor(max_workers=1) as reader, ThreadPoolExecutor(max_workers=1) as writer:
+            next_chunk = next((reader.submit(read, item) for item in items), None)
+            pending_write = None
+            while next_chunk is not None:
+                index, start, chunk = next_chunk.result()
+                next_chunk = next((reader.submit(read, item) for item in items), None)
+                labels = self.transform(chunk, n_jobs=n_jobs).astype(dtype, copy=False)
+                if pending_write is not None:
+                    # at most one chunk of labels is waiting to be written
+                    pending_write.result()
+                pending_write = writer.submit(write, index, start, labels)
+            if pending_write is not None:
+                pending_write.result()
+            for output in outputs.values():
+                output.flush()
+        return paths
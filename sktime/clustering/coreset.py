@@ -0,0 +1,249 @@
+import numpy as np
+
+from sktime.clustering._clustering_bindings import EuclideanMetric
+from sktime.clustering._clustering_bindings import kmeans as _kmeans_ext
+
+from sktime.base import Estimator, Model
+from sktime.clustering.kmeans import _resolve_fixed_seed
+from sktime.data.util import is_chunked_source, iter_chunks
+
+__all__ = ['KmeansCoreset', 'CoresetModel']
+
+
+class CoresetModel(Model):
+    r""" A small set of weighted data points, whose weighted k-means cost approximates the cost of the full data
+    set for any choice of centers. """
+
+    def __init__(self, data, weights, n_frames):
+        self._data = data
+        self._weights = weights
+        self._n_frames = n_frames
+
+    @property
+    def data(self):
+        """
+        The points of the coreset.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (m, D).
+        """
+        return self._data
+
+    @property
+    def weights(self):
+        """
+        The weights of the points of the coreset, which can be passed to `KmeansClustering.fit`.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (m,), in expectation the weights sum up to the total weight of the summarized data.
+        """
+        return self._weights
+
+    @property
+    def n_frames(self):
+        """
+        The number of data points which have been summarized.
+
+        Returns
+        -------
+        int
+        """
+        return self._n_frames
+
+
+class KmeansCoreset(Estimator):
+    r"""Coreset construction for k-means
+
+    Reduces a stream of chunks to a small weighted set of data points by sensitivity sampling [1]_: A k-means++
+    seeding serves as a rough solution, which bounds the influence (sensitivity) of each data point on the k-means
+    cost. Data points are sampled proportional to their weighted sensitivity and reweighted by the inverse of their
+    sampling probability, so that the weighted cost of the coreset is an unbiased estimate of the cost of the data
+    for any set of centers. Clustering the coreset with `KmeansClustering` and its `weights` argument then
+    approximates clustering the full data.
+
+    The chunks are summarized by a merge-and-reduce tree [2]_: Each chunk is reduced to a coreset, and whenever two
+    coresets of the same level exist, their union is reduced to a coreset of the next level. Hence, in one pass over
+    the data, only a logarithmic number of coresets of size `coreset_size` is held in memory at any time.
+
+    References
+    ----------
+    .. [1] Bachem, O., Lucic, M. and Krause, A. 2017. Practical coreset constructions for machine learning.
+       arXiv:1703.06476.
+    .. [2] Har-Peled, S. and Mazumdar, S. 2004. On coresets for k-means and k-median clustering. Proceedings of the
+       36th annual ACM symposium on Theory of computing, 291-300.
+    """
+
+    def __init__(self, n_clusters, coreset_size=10000, metric=None, fixed_seed=False, n_jobs=None, chunksize=None,
+                 random_state=None):
+        r"""
+        Parameters
+        ----------
+        n_clusters : int
+            number of cluster centers of the rough k-means++ solution, this should match the number of clusters the
+            coreset is going to be clustered with.
+
+        coreset_size : int, default 10000
+            number of sampled data points per coreset. Data points which are sampled several times are merged, so the
+            coresets might be smaller.
+
+        metric : subclass of `sktime.clustering._bindings.Metric`
+            metric to use, default None evaluates to euclidean metric.
+
+        fixed_seed : bool or int
+            if True, the seed gets set to 42. Use time based seeding otherwise. If an integer is given, use this to
+            initialize the random generator.
+
+        n_jobs : int or None, default None
+            Number of threads to use for the seeding and assignment of each chunk. If None, a single thread is used.
+
+        chunksize : int or None, default None
+            maximum number of data points per chunk in :meth:`fit`. If None, each array or file of the source is
+            processed as a whole.
+
+        random_state : np.random.RandomState or None
+            random state used for the sampling. By default, it is seeded with fixed_seed at the start of every
+            :meth:`fit`, so that fitting the same data yields the same coreset.
+        """
+        super(KmeansCoreset, self).__init__()
+        if n_jobs is None:
+            n_jobs = 1
+        if metric is None:
+            metric = EuclideanMetric()
+        self.n_clusters = n_clusters
+        self.coreset_size = coreset_size
+        self.metric = metric
+        self.fixed_seed = fixed_seed
+        # a random state of the caller is used as it is, otherwise every fit starts from fixed_seed
+        self._reseed = random_state is None
+        if random_state is None:
+            random_state = np.random.RandomState(self.fixed_seed)
+        self.random_state = random_state
+        self.n_jobs = n_jobs
+        self.chunksize = chunksize
+        self._levels = []
+        self._n_frames = 0
+
+    @property
+    def coreset_size(self):
+        """Number of sampled data points per coreset."""
+        return self._coreset_size
+
+    @coreset_size.setter
+    def coreset_size(self, value: int):
+        if value < self.n_clusters:
+            raise ValueError("coreset_size has to be at least n_clusters")
+        self._coreset_size = value
+
+    @property
+    def fixed_seed(self):
+        """ seed of the random generator, which draws the seeds of the k-means++ seedings and the samples. """
+        return self._fixed_seed
+
+    @fixed_seed.setter
+    def fixed_seed(self, value: [bool, int, None]):
+        self._fixed_seed = _resolve_fixed_seed(value)
+
+    def fit(self, data, weights=None, n_jobs=None):
+        """ summarizes the data by a coreset in one pass
+
+        Parameters
+        ----------
+        data: np.ndarray, list or callable
+            data to be summarized, shape should be (N, D), where N is the number of data points, D the dimension.
+            Data which does not fit into memory can be given as a list of arrays, memory maps or paths to .npy files,
+            or as a callable returning an iterable over arrays, see `KmeansClustering.fit`. The data is processed in
+            chunks according to `chunksize`.
+        weights: np.ndarray or None
+            optional non-negative weights of the data points of shape (N,), only supported for data given as a single
+            array.
+        n_jobs: None or int
+            if not None, supersedes the n_jobs attribute of the estimator instance
+        """
+        if weights is not None:
+            if is_chunked_source(data):
+                raise ValueError('Weights are only supported for data given as a single array.')
+            weights = np.asarray(weights)
+            if weights.shape != (len(data),):
+                raise ValueError(f"weights must have shape ({len(data)},) to match the data, got {weights.shape}.")
+        if self._reseed:
+            self.random_state = np.random.RandomState(self.fixed_seed)
+        self._levels = []
+        self._n_frames = 0
+        self._model = None
+        offset = 0
+        for chunk in iter_chunks(data, self.chunksize):
+            chunk_weights = weights[offset:offset + len(chunk)] if weights is not None else None
+            offset += len(chunk)
+            self.partial_fit(np.asarray(chunk), weights=chunk_weights, n_jobs=n_jobs)
+        return self
+
+    def partial_fit(self, data, weights=None, n_jobs=None):
+        """ adds one chunk to the merge-and-reduce tree
+
+        Parameters
+        ----------
+        data: np.ndarray
+            the chunk, shape should be (N, D), where N is the number of data points, D the dimension.
+            In case of one-dimensional data, a shape of (N,) also works.
+        weights: np.ndarray or None
+            optional non-negative weights of the data points of shape (N,)
+        n_jobs: None or int
+            if not None, supersedes the n_jobs attribute of the estimator instance
+        """
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        if weights is None:
+            weights = np.ones(len(data), dtype=data.dtype)
+        else:
+            weights = np.asarray(weights, dtype=data.dtype)
+            if weights.shape != (len(data),):
+                raise ValueError(f"weights must have shape ({len(data)},) to match the data, got {weights.shape}.")
+            if not np.all(np.isfinite(weights)) or np.any(weights < 0):
+                raise ValueError("weights must be finite and non-negative.")
+        self._n_frames += len(data)
+        self._model = None
+        positive = weights > 0
+        coreset = self._reduce(np.ascontiguousarray(data[positive]), np.ascontiguousarray(weights[positive]), n_jobs)
+
+        # merge coresets of equal level like the digits of a binary counter
+        level = 0
+        while level < len(self._levels) and self._levels[level] is not None:
+            other = self._levels[level]
+            self._levels[level] = None
+            coreset = self._reduce(np.concatenate((other[0], coreset[0])), np.concatenate((other[1], coreset[1])),
+                                   n_jobs)
+            level += 1
+        if level == len(self._levels):
+            self._levels.append(None)
+        self._levels[level] = coreset
+        return self
+
+    def fetch_model(self) -> CoresetModel:
+        """ reduces the union of the coresets of all levels to the final coreset """
+        if self._model is None:
+            coresets = [c for c in self._levels if c is not None]
+            if len(coresets) == 0:
+                return None
+            data, weights = self._reduce(np.concatenate([c[0] for c in coresets]),
+                                         np.concatenate([c[1] for c in coresets]), self.n_jobs)
+            self._model = CoresetModel(data, weights, self._n_frames)
+        return self._model
+
+    def _reduce(self, data, weights, n_jobs):
+        if len(data) <= self.coreset_size:
+            return data, weights
+        seed = self.random_state.randint(0, 2 ** 32 - 1)
+        n_centers = min(self.n_clusters, len(data))
+        centers = _kmeans_ext.init_centers_kmpp(data, n_centers, seed, n_jobs, None, self.metric, weights=weights)
+        sensitivities = _kmeans_ext.coreset_sensitivities(data, centers, n_jobs, self.metric, weights)
+        p = weights * sensitivities
+        p /= p.sum()
+        indices, multiplicities = np.unique(self.random_state.choice(len(data), size=self.coreset_size, p=p),
+                                            return_counts=True)
+        new_weights = weights[indices] * multiplicities / (self.coreset_size * p[indices])
+        return data[indices], new_weights.astype(data.dtype)
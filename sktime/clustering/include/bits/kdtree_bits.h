@@ -0,0 +1,183 @@
+//
+// Implementation of the KD-tree over cluster centers.
+//
+
+#pragma once
+
+#include <algorithm>
+#include <limits>
+#include <numeric>
+#include <stdexcept>
+
+#include "../kdtree.h"
+#include "threading_utils.h"
+
+namespace clustering {
+namespace spatial {
+
+template<typename T>
+inline KDTree<T>::KDTree(const T* centers, std::size_t n_centers, std::size_t dim, std::size_t leaf_size)
+        : _dim(dim), _leaf_size(std::max(leaf_size, static_cast<std::size_t>(1))) {
+    if (n_centers == 0) {
+        throw std::invalid_argument("cannot build a tree without any centers.");
+    }
+    if (dim == 0) {
+        throw std::invalid_argument("center dimension must be larger than zero.");
+    }
+    _points.assign(centers, centers + n_centers * dim);
+    std::vector<std::size_t> order(n_centers);
+    std::iota(order.begin(), order.end(), 0);
+    build(order, 0, n_centers);
+
+    /* store the centers in tree order, so that the leaves can be scanned contiguously */
+    std::vector<T> points(n_centers * dim);
+    for (std::size_t i = 0; i < n_centers; ++i) {
+        std::copy(centers + order[i] * dim, centers + (order[i] + 1) * dim, points.begin() + i * dim);
+    }
+    _points = std::move(points);
+    _indices = std::move(order);
+}
+
+template<typename T>
+inline std::size_t KDTree<T>::build(std::vector<std::size_t> &order, std::size_t begin, std::size_t end) {
+    auto node = _nodes.size();
+    _nodes.push_back({begin, end, 0, 0, 0, 0});
+    _lower.resize((node + 1) * _dim, std::numeric_limits<T>::max());
+    _upper.resize((node + 1) * _dim, std::numeric_limits<T>::lowest());
+
+    T* lower = &_lower[node * _dim];
+    T* upper = &_upper[node * _dim];
+    for (auto i = begin; i < end; ++i) {
+        const T* point = &_points[order[i] * _dim];
+        for (std::size_t d = 0; d < _dim; ++d) {
+            lower[d] = std::min(lower[d], point[d]);
+            upper[d] = std::max(upper[d], point[d]);
+        }
+    }
+
+    std::size_t split_dim = 0;
+    for (std::size_t d = 1; d < _dim; ++d) {
+        if (upper[d] - lower[d] > upper[split_dim] - lower[split_dim]) {
+            split_dim = d;
+        }
+    }
+    /* leaves either contain few centers or only identical ones */
+    if (end - begin <= _leaf_size || upper[split_dim] == lower[split_dim]) {
+        return node;
+    }
+
+    auto mid = begin + (end - begin) / 2;
+    std::nth_element(order.begin() + begin, order.begin() + mid, order.begin() + end,
+                     [&](std::size_t a, std::size_t b) {
+                         auto xa = _points[a * _dim + split_dim];
+                         auto xb = _points[b * _dim + split_dim];
+                         return xa < xb || (xa == xb && a < b);
+                     });
+    auto split = _points[order[mid] * _dim + split_dim];
+    /* build() may reallocate the node vector, hence no references are kept across the recursion */
+    auto left = build(order, begin, mid);
+    auto right = build(order, mid, end);
+    _nodes[node].split_dim = split_dim;
+    _nodes[node].split = split;
+    _nodes[node].left = left;
+    _nodes[node].right = right;
+    return node;
+}
+
+template<typename T>
+inline T KDTree<T>::box_distance(std::size_t node, const T* frame) const {
+    const T* lower = &_lower[node * _dim];
+    const T* upper = &_upper[node * _dim];
+    T sum = 0;
+    for (std::size_t d = 0; d < _dim; ++d) {
+        T diff = 0;
+        if (frame[d] < lower[d]) {
+            diff = lower[d] - frame[d];
+        } else if (frame[d] > upper[d]) {
+            diff = frame[d] - upper[d];
+        }
+        sum += diff * diff;
+    }
+    return sum;
+}
+
+template<typename T>
+inline void KDTree<T>::search(std::size_t node, const T* frame, T &best, std::size_t &best_ix) const {
+    const auto &n = _nodes[node];
+    if (n.left == n.right) {
+        for (auto i = n.begin; i < n.end; ++i) {
+            const T* point = &_points[i * _dim];
+            T sum = 0;
+            for (std::size_t d = 0; d < _dim; ++d) {
+                auto diff = frame[d] - point[d];
+                sum += diff * diff;
+            }
+            if (sum < best || (sum == best && _indices[i] < best_ix)) {
+                best = sum;
+                best_ix = _indices[i];
+            }
+        }
+        return;
+    }
+    auto near = frame[n.split_dim] < n.split ? n.left : n.right;
+    auto far = near == n.left ? n.right : n.left;
+    /* nodes at the same distance as the best center might still contain a center with smaller index */
+    if (box_distance(near, frame) <= best) {
+        search(near, frame, best, best_ix);
+    }
+    if (box_distance(far, frame) <= best) {
+        search(far, frame, best, best_ix);
+    }
+}
+
+template<typename T>
+inline void KDTree<T>::query(const T* chunk, std::size_t n_frames, int* assignments, T* sq_dists) const {
+    for (std::size_t i = 0; i < n_frames; ++i) {
+        auto best = std::numeric_limits<T>::infinity();
+        auto best_ix = std::numeric_limits<std::size_t>::max();
+        search(0, chunk + i * _dim, best, best_ix);
+        assignments[i] = static_cast<int>(best_ix);
+        if (sq_dists) {
+            sq_dists[i] = best;
+        }
+    }
+}
+
+template<typename T>
+inline std::vector<T> KDTree<T>::centers() const {
+    std::vector<T> result(_points.size());
+    for (std::size_t i = 0; i < _indices.size(); ++i) {
+        std::copy(_points.begin() + i * _dim, _points.begin() + (i + 1) * _dim, result.begin() + _indices[i] * _dim);
+    }
+    return result;
+}
+
+template<typename T>
+inline np_array<int> query_nearest(const KDTree<T> &tree, const np_array<T> &chunk, int n_threads) {
+    if (chunk.ndim() != 2) {
+        throw std::invalid_argument("provided chunk does not have two dimensions.");
+    }
+    if (static_cast<std::size_t>(chunk.shape(1)) != tree.dim()) {
+        throw std::invalid_argument("dimension mismatch centers and provided data to assign.");
+    }
+    auto n_frames = static_cast<std::size_t>(chunk.shape(0));
+    auto dim = tree.dim();
+
+    np_array<int> dtraj(n_frames);
+    const T* chunkPtr = chunk.data();
+    int* dtrajPtr = dtraj.mutable_data();
+
+    py::gil_scoped_release release;
+    /* the cost of a query depends on the location of the frame, hence small blocks are balanced by work stealing */
+    constexpr std::size_t block = 64;
+    auto n_blocks = (n_frames + block - 1) / block;
+    parallel_for(n_blocks, n_threads, [&](std::size_t b) {
+        auto begin = b * block;
+        auto n = std::min(block, n_frames - begin);
+        tree.query(chunkPtr + begin * dim, n, dtrajPtr + begin);
+    });
+    return dtraj;
+}
+
+}
+}
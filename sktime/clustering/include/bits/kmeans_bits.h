@@ -9,17 +9,265 @@
 #include "threading_utils.h"
 
 #include <random>
-#include <atomic>
+#include <memory>
+#include <numeric>
+#include <cstdint>
 
 #include <pybind11/pytypes.h>
-#include <mutex>
 
 namespace clustering {
 namespace kmeans {
 
+namespace detail {
+
+/** number of frames per leaf of the ordered reductions, this must not depend on the number of threads */
+static constexpr std::size_t leaf_size = 4096;
+
+/**
+ * Partial (weighted) sums of the frames assigned to each center, the number and total weight of these frames and the
+ * weighted sum of their squared distances to the center they were assigned to. Without weights, every frame has
+ * weight one.
+ */
+template<typename T>
+struct CentroidSums {
+    CentroidSums(std::size_t n_centers, std::size_t dim)
+            : sums(n_centers * dim, 0), counts(n_centers, 0), weights(n_centers, 0) {}
+
+    void reset() {
+        std::fill(sums.begin(), sums.end(), static_cast<T>(0));
+        std::fill(counts.begin(), counts.end(), 0);
+        std::fill(weights.begin(), weights.end(), 0.);
+        inertia = 0;
+    }
+
+    void add(const CentroidSums &other) {
+        for (std::size_t i = 0; i < sums.size(); ++i) {
+            sums[i] += other.sums[i];
+        }
+        for (std::size_t j = 0; j < counts.size(); ++j) {
+            counts[j] += other.counts[j];
+            weights[j] += other.weights[j];
+        }
+        inertia += other.inertia;
+    }
+
+    std::vector<T> sums;
+    std::vector<std::size_t> counts;
+    std::vector<double> weights;
+    double inertia {0};
+};
+
+/**
+ * Pairwise reduction of leaf results in a fixed order. The leaves are pushed in order and merged like the digits of
+ * a binary counter, hence the shape of the reduction tree only depends on the number of leaves. As long as the
+ * leaves themselves do not depend on the number of threads, neither does the result.
+ */
+template<typename Partial>
+class OrderedReduction {
+public:
+    void push(const Partial &leaf) {
+        _stack.push_back(leaf);
+        _sizes.push_back(1);
+        while (_stack.size() > 1 && _sizes[_sizes.size() - 2] == _sizes.back()) {
+            merge_top();
+        }
+    }
+
+    bool empty() const {
+        return _stack.empty();
+    }
+
+    Partial result() {
+        while (_stack.size() > 1) {
+            merge_top();
+        }
+        return _stack.front();
+    }
+
+private:
+    void merge_top() {
+        _stack[_stack.size() - 2].add(_stack.back());
+        _sizes[_sizes.size() - 2] += _sizes.back();
+        _stack.pop_back();
+        _sizes.pop_back();
+    }
+
+    std::vector<Partial> _stack;
+    std::vector<std::size_t> _sizes;
+};
+
+/**
+ * Sums the frames assigned to each center together with their squared distances, so that a Lloyd step and its
+ * inertia only require a single pass over the data. The frames are divided into leaves of fixed size, which are
+ * assigned and accumulated independently on the available threads and then merged in a fixed order. This requires
+ * neither locks nor atomics and gives bit-identical results for any number of threads.
+ * @param assign callable with signature (begin, n, int* assignments, T* sq_dists), writing the center indices of the
+ * frames [begin, begin + n) to assignments and their squared distances to sq_dists. Negative indices mark frames which
+ * are skipped.
+ * @param labels optional output of length n_frames receiving the assignments
+ * @param weights optional non-negative weights of the frames, the sums, weights and inertia are weighted accordingly
+ */
+template<typename T, typename Assign>
+inline CentroidSums<T> accumulate_centroids(const T* data, std::size_t n_frames, std::size_t n_centers,
+                                            std::size_t dim, int n_threads, Assign &&assign,
+                                            int* labels = nullptr, const T* weights = nullptr) {
+    auto n_leaves = (n_frames + leaf_size - 1) / leaf_size;
+    auto window = std::min(static_cast<std::size_t>(std::max(n_threads, 1)), n_leaves);
+
+    std::vector<CentroidSums<T>> partials(window, CentroidSums<T>(n_centers, dim));
+    std::vector<std::vector<int>> assignments(window, std::vector<int>(leaf_size));
+    std::vector<std::vector<T>> sq_dists(window, std::vector<T>(leaf_size));
+    OrderedReduction<CentroidSums<T>> reduction;
+
+    for (std::size_t first = 0; first < n_leaves; first += window) {
+        auto n_window = std::min(window, n_leaves - first);
+        parallel_for(n_window, n_threads, [&](std::size_t w) {
+            auto begin = (first + w) * leaf_size;
+            auto n = std::min(leaf_size, n_frames - begin);
+            auto &partial = partials[w];
+            auto leaf_assignments = assignments[w].data();
+            auto leaf_sq_dists = sq_dists[w].data();
+            partial.reset();
+            assign(begin, n, leaf_assignments, leaf_sq_dists);
+            if (labels) {
+                std::copy(leaf_assignments, leaf_assignments + n, labels + begin);
+            }
+            for (std::size_t i = 0; i < n; ++i) {
+                if (leaf_assignments[i] < 0) continue;
+                auto c = static_cast<std::size_t>(leaf_assignments[i]);
+                const T* frame = data + (begin + i) * dim;
+                ++partial.counts[c];
+                if (weights) {
+                    auto w = weights[begin + i];
+                    partial.weights[c] += static_cast<double>(w);
+                    partial.inertia += static_cast<double>(w) * static_cast<double>(leaf_sq_dists[i]);
+                    for (std::size_t d = 0; d < dim; ++d) {
+                        partial.sums[c * dim + d] += w * frame[d];
+                    }
+                } else {
+                    partial.weights[c] += 1.;
+                    partial.inertia += static_cast<double>(leaf_sq_dists[i]);
+                    for (std::size_t d = 0; d < dim; ++d) {
+                        partial.sums[c * dim + d] += frame[d];
+                    }
+                }
+            }
+        });
+        for (std::size_t w = 0; w < n_window; ++w) {
+            reduction.push(partials[w]);
+        }
+    }
+    return reduction.empty() ? CentroidSums<T>(n_centers, dim) : reduction.result();
+}
+
+/**
+ * Sums up width-dimensional values over frames in a fixed order, independent of the number of threads.
+ * @param fun callable with signature (begin, end, T* out), adding the contributions of the frames [begin, end) to out
+ */
+template<typename T, typename Function>
+inline std::vector<T> ordered_sum(std::size_t n_frames, std::size_t width, int n_threads, Function &&fun) {
+    auto n_leaves = (n_frames + leaf_size - 1) / leaf_size;
+    std::vector<T> leaves(n_leaves * width, static_cast<T>(0));
+    parallel_for(n_leaves, n_threads, [&](std::size_t leaf) {
+        fun(leaf * leaf_size, std::min((leaf + 1) * leaf_size, n_frames), leaves.data() + leaf * width);
+    });
+    std::vector<T> result(width, static_cast<T>(0));
+    for (std::size_t leaf = 0; leaf < n_leaves; ++leaf) {
+        for (std::size_t k = 0; k < width; ++k) {
+            result[k] += leaves[leaf * width + k];
+        }
+    }
+    return result;
+}
+
+/**
+ * Draws a frame index with probability proportional to the non-negative weights of the frames.
+ */
+template<typename T, typename Generator>
+inline std::size_t sample_index(const T* weights, std::size_t n_frames, Generator &generator) {
+    double total = 0;
+    for (std::size_t i = 0; i < n_frames; ++i) {
+        total += static_cast<double>(weights[i]);
+    }
+    auto threshold = std::uniform_real_distribution<double>(0., total)(generator);
+    double cumsum = 0;
+    std::size_t last_positive = 0;
+    for (std::size_t i = 0; i < n_frames; ++i) {
+        if (weights[i] > 0) {
+            cumsum += static_cast<double>(weights[i]);
+            last_positive = i;
+            if (cumsum > threshold) return i;
+        }
+    }
+    return last_positive;
+}
+
+/**
+ * Divides the sums by the weights, centers without any assigned weight are kept at their previous position.
+ */
+template<typename T>
+inline void update_centers(const CentroidSums<T> &accumulated, const T* old_centers, std::size_t n_centers,
+                           std::size_t dim, T* new_centers) {
+    for (std::size_t j = 0; j < n_centers; ++j) {
+        if (accumulated.weights[j] <= 0) {
+            std::copy(old_centers + j * dim, old_centers + (j + 1) * dim, new_centers + j * dim);
+        } else {
+            for (std::size_t d = 0; d < dim; ++d) {
+                new_centers[j * dim + d] = accumulated.sums[j * dim + d] / static_cast<T>(accumulated.weights[j]);
+            }
+        }
+    }
+}
+
+/**
+ * One fused Lloyd step: assigns every frame to its closest center and accumulates the new centers as well as the
+ * inertia of the given centers in the same pass.
+ * @param labels optional output of length n_frames receiving the assignments
+ * @param weights optional weights of the frames
+ * @return the inertia, i.e., the (weighted) sum of squared distances of the frames to their closest center
+ */
 template<typename T>
-inline np_array<T> cluster(const np_array<T> &np_chunk, const np_array<T> &np_centers, int n_threads,
-                           const Metric *metric) {
+inline double lloyd_step(const T* data, std::size_t n_frames, const T* centers, std::size_t n_centers,
+                         std::size_t dim, const Metric *metric, int n_threads, T* new_centers,
+                         int* labels = nullptr, const T* weights = nullptr) {
+    CenterAssigner<T> assigner(centers, n_centers, dim, metric);
+    auto accumulated = accumulate_centroids(
+            data, n_frames, n_centers, dim, n_threads,
+            [&](std::size_t begin, std::size_t n, int* assignments, T* sq_dists) {
+                assigner.assign(data + begin * dim, n, assignments, sq_dists);
+            }, labels, weights);
+    update_centers(accumulated, centers, n_centers, dim, new_centers);
+    return accumulated.inertia;
+}
+
+/**
+ * (Weighted) sum of squared distances of the frames to their closest center, without updating the centers.
+ * @param labels optional output of length n_frames receiving the assignments
+ * @param weights optional weights of the frames
+ */
+template<typename T>
+inline double inertia(const T* data, std::size_t n_frames, const T* centers, std::size_t n_centers, std::size_t dim,
+                      const Metric *metric, int n_threads, int* labels = nullptr, const T* weights = nullptr) {
+    CenterAssigner<T> assigner(centers, n_centers, dim, metric);
+    return ordered_sum<double>(n_frames, 1, n_threads, [&](std::size_t begin, std::size_t end, double* out) {
+        std::vector<int> assignments(end - begin);
+        std::vector<T> sq_dists(end - begin);
+        assigner.assign(data + begin * dim, end - begin, assignments.data(), sq_dists.data());
+        if (labels) {
+            std::copy(assignments.begin(), assignments.end(), labels + begin);
+        }
+        for (std::size_t i = 0; i < sq_dists.size(); ++i) {
+            *out += weights ? static_cast<double>(weights[begin + i]) * static_cast<double>(sq_dists[i])
+                            : static_cast<double>(sq_dists[i]);
+        }
+    })[0];
+}
+
+}
+
+template<typename T>
+inline std::tuple<np_array<T>, T> cluster(const np_array<T> &np_chunk, const np_array<T> &np_centers, int n_threads,
+                                          const Metric *metric, const T* weights) {
 
     if (np_chunk.ndim() != 2) {
         throw std::runtime_error(R"(Number of dimensions of "chunk" ain't 2.)");
@@ -35,181 +283,404 @@ inline np_array<T> cluster(const np_array<T> &np_chunk, const np_array<T> &np_ce
         throw std::invalid_argument("chunk dimension must be larger than zero.");
     }
 
-    auto chunk = np_chunk.template unchecked<2>();
     auto n_centers = static_cast<size_t>(np_centers.shape(0));
-    auto centers = np_centers.template unchecked<2>();
 
-    /* initialize centers_counter and new_centers with zeros */
+    /* do the clustering */
     std::vector<std::size_t> shape = {n_centers, dim};
     py::array_t <T> return_new_centers(shape);
-    auto new_centers = return_new_centers.mutable_unchecked();
-    std::fill(return_new_centers.mutable_data(), return_new_centers.mutable_data() + return_new_centers.size(), 0.0);
-    std::vector<std::size_t> centers_counter(n_centers, 0);
+    double inertia;
+    {
+        py::gil_scoped_release release;
+        inertia = detail::lloyd_step(np_chunk.data(), n_frames, np_centers.data(), n_centers, dim, metric, n_threads,
+                                     return_new_centers.mutable_data(), nullptr, weights);
+    }
+    return std::make_tuple(return_new_centers, static_cast<T>(inertia));
+}
 
-    /* do the clustering */
-    if (n_threads == 0) {
-        for (std::size_t i = 0; i < n_frames; ++i) {
-            std::size_t argMinDist = 0;
-            {
-                T minDist = metric->compute(&chunk(i, 0), &centers(0, 0), dim);
-                for (std::size_t j = 1; j < n_centers; ++j) {
-                    auto dist = metric->compute(&chunk(i, 0), &centers(j, 0), dim);
-                    if(dist < minDist) {
-                        minDist = dist;
-                        argMinDist = j;
-                    }
-                }
-            }
+template<typename T>
+inline std::tuple<np_array<T>, int, int, T, np_array<int>> cluster_loop(
+        const np_array<T>& np_chunk, const np_array<T>& np_centers,
+        std::size_t k, const Metric *metric,
+        int n_threads, int max_iter, T tolerance, py::object& callback, bool return_assignments,
+        const T* weights) {
+    if (np_chunk.ndim() != 2) {
+        throw std::runtime_error(R"(Number of dimensions of "chunk" ain't 2.)");
+    }
+    if (np_centers.ndim() != 2) {
+        throw std::runtime_error(R"(Number of dimensions of "centers" ain't 2.)");
+    }
+    if (np_chunk.shape(1) != np_centers.shape(1)) {
+        throw std::invalid_argument("dimension mismatch centers and provided data.");
+    }
+
+    auto n_frames = static_cast<std::size_t>(np_chunk.shape(0));
+    auto n_centers = static_cast<std::size_t>(np_centers.shape(0));
+    auto dim = static_cast<std::size_t>(np_chunk.shape(1));
+    if (dim == 0) {
+        throw std::invalid_argument("chunk dimension must be larger than zero.");
+    }
+    const T* data = np_chunk.data();
+    std::vector<T> centers(np_centers.data(), np_centers.data() + n_centers * dim);
+    std::vector<T> new_centers(n_centers * dim);
 
-            {
-                centers_counter.at(argMinDist)++;
-                for (std::size_t j = 0; j < dim; j++) {
-                    new_centers(argMinDist, j) += chunk(i, j);
+    np_array<int> labels(return_assignments ? n_frames : 0);
+    int* labelsPtr = return_assignments ? labels.mutable_data() : nullptr;
+
+    /* Each pass assigns the frames to the current centers, which yields their inertia for the convergence check and
+     * the assignments in the same sweep that accumulates the next centers. Hence, once the iteration stops, inertia
+     * and assignments belong to the returned centers without an additional pass over the data. */
+    int it = 0;
+    bool converged = false;
+    double cost, prev_cost = 0;
+    {
+        /* the iteration only works on raw buffers, so other Python threads (e.g. further restarts) may run */
+        py::gil_scoped_release release;
+        while (true) {
+            cost = detail::lloyd_step(data, n_frames, centers.data(), n_centers, dim, metric, n_threads,
+                                      new_centers.data(), labelsPtr, weights);
+            if (it > 0) {
+                auto rel_change = (cost != 0.0) ? std::abs(cost - prev_cost) / cost : 0;
+                if (rel_change <= tolerance) {
+                    converged = true;
+                } else if (!callback.is_none()) {
+                    /* Acquire GIL before calling Python code */
+                    py::gil_scoped_acquire acquire;
+                    callback();
                 }
             }
+            if (converged || it >= std::max(max_iter, 1)) {
+                break;
+            }
+            std::swap(centers, new_centers);
+            prev_cost = cost;
+            it += 1;
         }
-    } else {
-#if defined(USE_OPENMP)
-        omp_set_num_threads(n_threads);
+    }
+    int res = converged ? 0 : 1;
 
-#pragma omp parallel for schedule(static, 1)
-        for (std::size_t i = 0; i < n_frames; ++i) {
-            std::vector<T> dists(n_centers);
-            for (std::size_t j = 0; j < n_centers; ++j) {
-                dists[j] = metric->compute(&chunk(i, 0), &centers(j, 0), dim);
-            }
-#pragma omp flush(dists)
-
-#pragma omp critical(centers_counter)
-            {
-                auto closest_center_index = std::distance(dists.begin(), std::min_element(dists.begin(), dists.end()));
-                {
-                    centers_counter.at(static_cast<std::size_t>(closest_center_index))++;
-                    for (std::size_t j = 0; j < dim; j++) {
-                        new_centers(closest_center_index, j) += chunk(i, j);
-                    }
-                }
-            }
+    std::vector<std::size_t> shape = {n_centers, dim};
+    np_array<T> result(shape);
+    std::copy(centers.begin(), centers.end(), result.mutable_data());
+    return std::make_tuple(result, res, it, static_cast<T>(cost), labels);
+}
+
+namespace detail {
+/**
+ * Distances of the Hamerly iteration. Euclidean distances of single precision data are evaluated in double precision,
+ * so that frames which are almost equally far from two centers are assigned like by the blocked euclidean search,
+ * which resolves such near ties with exact distances.
+ */
+template<typename T>
+class HamerlyDistance {
+public:
+    explicit HamerlyDistance(const Metric* metric)
+            : _metric(metric),
+              _double_precision(std::is_same<T, float>::value && dynamic_cast<const EuclideanMetric*>(metric)) {}
+
+    double operator()(const T* xs, const T* ys, std::size_t dim) const {
+        if (!_double_precision) {
+            return static_cast<double>(_metric->compute(xs, ys, dim));
+        }
+        double sum = 0;
+        #pragma omp simd reduction(+:sum)
+        for (std::size_t d = 0; d < dim; ++d) {
+            auto diff = static_cast<double>(xs[d]) - static_cast<double>(ys[d]);
+            sum += diff * diff;
+        }
+        return std::sqrt(sum);
+    }
+
+private:
+    const Metric* _metric;
+    bool _double_precision;
+};
+
+/**
+ * Scans all centers for the closest and second closest one to a frame.
+ * @return tuple of (index of closest center, distance to closest center, distance to second closest center)
+ */
+template<typename T>
+inline std::tuple<std::size_t, double, double> closest_two(const T* frame, const T* centers, std::size_t n_centers,
+                                                           std::size_t dim, const HamerlyDistance<T> &distance) {
+    std::size_t argmin = 0;
+    double d1 = std::numeric_limits<double>::infinity();
+    double d2 = std::numeric_limits<double>::infinity();
+    for (std::size_t j = 0; j < n_centers; ++j) {
+        auto d = distance(frame, centers + j * dim, dim);
+        if (d < d1) {
+            d2 = d1;
+            d1 = d;
+            argmin = j;
+        } else if (d < d2) {
+            d2 = d;
         }
-#else
-        {
-            std::mutex mutex;
+    }
+    return std::make_tuple(argmin, d1, d2);
+}
+}
 
-            std::vector<scoped_thread> threads;
-            threads.reserve(static_cast<std::size_t>(n_threads));
+/**
+ * Lloyd iterations accelerated by Hamerly's bounds. For every frame an upper bound on the distance to its assigned
+ * center and a lower bound on the distance to the second closest center are maintained. Together with the distance of
+ * each center to its closest neighbor center, these bounds allow to skip most of the frame-center distance evaluations
+ * once the centers only drift slightly. The metric has to fulfill the triangle inequality. The iteration yields the
+ * same centers as the plain Lloyd iteration and stops once no frame changes its assignment anymore.
+ */
+template<typename T>
+inline std::tuple<np_array<T>, int, int, T, np_array<int>> cluster_loop_hamerly(
+        const np_array<T>& np_chunk, const np_array<T>& np_centers, const Metric *metric,
+        int n_threads, int max_iter, py::object& callback, bool return_assignments, const T* weights) {
+    if (np_chunk.ndim() != 2) {
+        throw std::runtime_error(R"(Number of dimensions of "chunk" ain't 2.)");
+    }
+    if (np_centers.ndim() != 2) {
+        throw std::runtime_error(R"(Number of dimensions of "centers" ain't 2.)");
+    }
+    if (np_chunk.shape(1) != np_centers.shape(1)) {
+        throw std::invalid_argument("dimension mismatch centers and provided data.");
+    }
 
-            std::size_t grainSize = n_frames / n_threads;
+    auto n_frames = static_cast<std::size_t>(np_chunk.shape(0));
+    auto n_centers = static_cast<std::size_t>(np_centers.shape(0));
+    auto dim = static_cast<std::size_t>(np_chunk.shape(1));
 
-            auto worker = [&](std::size_t tid, std::size_t begin, std::size_t end, std::mutex& m) {
-                for (auto i = begin; i < end; ++i) {
-                    std::size_t argMinDist = 0;
-                    {
-                        T minDist = metric->compute(&chunk(i, 0), &centers(0, 0), dim);
-                        for (std::size_t j = 1; j < n_centers; ++j) {
-                            auto dist = metric->compute(&chunk(i, 0), &centers(j, 0), dim);
-                            if(dist < minDist) {
-                                minDist = dist;
-                                argMinDist = j;
-                            }
-                        }
+    if (dim == 0) {
+        throw std::invalid_argument("chunk dimension must be larger than zero.");
+    }
+
+    const T* data = np_chunk.data();
+    std::vector<T> centers(np_centers.data(), np_centers.data() + n_centers * dim);
+    std::vector<T> new_centers(n_centers * dim);
+
+    std::vector<int> assignments(n_frames);
+    std::vector<double> upper(n_frames);
+    std::vector<double> lower(n_frames);
+    std::vector<double> drift(n_centers);
+    std::vector<double> half_separation(n_centers);
+    detail::HamerlyDistance<T> distance(metric);
+
+    int it = 0;
+    bool converged = false;
+    double cost;
+    {
+        /* the iteration only works on raw buffers, so other Python threads (e.g. further restarts) may run */
+        py::gil_scoped_release release;
+        auto n_leaves = (n_frames + detail::leaf_size - 1) / detail::leaf_size;
+
+        /* initial assignment, this requires the distances to all centers */
+        parallel_for(n_leaves, n_threads, [&](std::size_t leaf) {
+            for (auto i = leaf * detail::leaf_size; i < std::min((leaf + 1) * detail::leaf_size, n_frames); ++i) {
+                std::size_t a;
+                std::tie(a, upper[i], lower[i]) = detail::closest_two(data + i * dim, centers.data(), n_centers, dim,
+                                                                      distance);
+                assignments[i] = static_cast<int>(a);
+            }
+        });
+
+        do {
+            /* move centers to the mean of their assigned frames, empty clusters keep their center */
+            auto accumulated = detail::accumulate_centroids(
+                    data, n_frames, n_centers, dim, n_threads,
+                    [&](std::size_t begin, std::size_t n, int* out, T* sq_dists) {
+                        std::copy(assignments.begin() + begin, assignments.begin() + begin + n, out);
+                        std::fill(sq_dists, sq_dists + n, static_cast<T>(0));
+                    }, nullptr, weights);
+            detail::update_centers(accumulated, centers.data(), n_centers, dim, new_centers.data());
+
+            /* track how far each center moved as well as the two largest drifts */
+            std::size_t max_drift_ix = 0;
+            double max_drift = 0, second_max_drift = 0;
+            for (std::size_t j = 0; j < n_centers; ++j) {
+                drift[j] = distance(&centers[j * dim], &new_centers[j * dim], dim);
+                if (drift[j] > max_drift) {
+                    second_max_drift = max_drift;
+                    max_drift = drift[j];
+                    max_drift_ix = j;
+                } else if (drift[j] > second_max_drift) {
+                    second_max_drift = drift[j];
+                }
+            }
+            std::swap(centers, new_centers);
+
+            /* half the distance of each center to its closest neighbor center */
+            parallel_for(n_centers, n_threads, [&](std::size_t j) {
+                auto closest = std::numeric_limits<double>::infinity();
+                for (std::size_t jj = 0; jj < n_centers; ++jj) {
+                    if (jj != j) {
+                        closest = std::min(closest, distance(&centers[j * dim], &centers[jj * dim], dim));
                     }
+                }
+                half_separation[j] = .5 * closest;
+            });
 
-                    {
-                        std::unique_lock<std::mutex> lock(m);
+            /* update bounds and only evaluate distances for frames whose bounds do not rule out a reassignment */
+            auto n_changed = detail::ordered_sum<std::size_t>(
+                    n_frames, 1, n_threads, [&](std::size_t begin, std::size_t end, std::size_t* changed) {
+                for (auto i = begin; i < end; ++i) {
+                    auto a = static_cast<std::size_t>(assignments[i]);
+                    upper[i] += drift[a];
+                    lower[i] -= a == max_drift_ix ? second_max_drift : max_drift;
 
-                        centers_counter.at(argMinDist)++;
-                        for (std::size_t j = 0; j < dim; j++) {
-                            new_centers(argMinDist, j) += chunk(i, j);
+                    auto bound = std::max(half_separation[a], lower[i]);
+                    if (upper[i] > bound) {
+                        upper[i] = distance(data + i * dim, &centers[a * dim], dim);
+                        if (upper[i] > bound) {
+                            std::size_t new_a;
+                            std::tie(new_a, upper[i], lower[i]) = detail::closest_two(data + i * dim, centers.data(),
+                                                                                      n_centers, dim, distance);
+                            if (new_a != a) {
+                                assignments[i] = static_cast<int>(new_a);
+                                ++*changed;
+                            }
                         }
                     }
                 }
-            };
+            })[0];
 
-            for(std::uint8_t i = 0; i < n_threads - 1; ++i) {
-                threads.emplace_back(worker, i, i*grainSize, (i+1)*grainSize, std::ref(mutex));
+            it += 1;
+            if (n_changed == 0) {
+                converged = true;
+            } else if (!callback.is_none()) {
+                /* Acquire GIL before calling Python code */
+                py::gil_scoped_acquire acquire;
+                callback();
             }
-            threads.emplace_back(worker, n_threads, (n_threads - 1) * grainSize, n_frames, std::ref(mutex));
-        }
-#endif
-    }
+        } while (it < max_iter && !converged);
 
-    auto centers_counter_it = centers_counter.begin();
-    for (std::size_t i = 0; i < n_centers; ++i, ++centers_counter_it) {
-        if (*centers_counter_it == 0) {
-            for (std::size_t j = 0; j < dim; ++j) {
-                new_centers(i, j) = centers(i, j);
+        /* every iteration ends with assigning the frames to the updated centers, hence the assignments are exact and
+         * the inertia only requires the distance of each frame to its own center */
+        cost = detail::ordered_sum<double>(n_frames, 1, n_threads, [&](std::size_t begin, std::size_t end,
+                                                                       double* out) {
+            for (auto i = begin; i < end; ++i) {
+                auto d = distance(data + i * dim, &centers[assignments[i] * dim], dim);
+                *out += weights ? static_cast<double>(weights[i]) * d * d : d * d;
             }
-        } else {
-            for (std::size_t j = 0; j < dim; ++j) {
-                new_centers(i, j) /= static_cast<T>(*centers_counter_it);
-            }
-        }
+        })[0];
+    }
+    np_array<int> labels(return_assignments ? n_frames : 0);
+    if (return_assignments) {
+        std::copy(assignments.begin(), assignments.end(), labels.mutable_data());
     }
 
-    return return_new_centers;
+    std::vector<std::size_t> shape = {n_centers, dim};
+    np_array<T> result(shape);
+    std::copy(centers.begin(), centers.end(), result.mutable_data());
+    return std::make_tuple(result, converged ? 0 : 1, it, static_cast<T>(cost), labels);
 }
 
+/**
+ * Assigns a chunk of frames to the closest centers and sums up the frames per center, such that the centroids of a
+ * dataset which does not fit into memory can be accumulated over its chunks in one streaming pass.
+ * @return tuple of the sums of the frames per center of shape (n_centers, dim), the number of frames per center and
+ * the inertia of the chunk with respect to the given centers
+ */
 template<typename T>
-inline std::tuple<np_array<T>, int, int, T> cluster_loop(
-        const np_array<T>& np_chunk, const np_array<T>& np_centers,
-        std::size_t k, const Metric *metric,
-        int n_threads, int max_iter, T tolerance, py::object& callback) {
-    int it = 0;
-    bool converged = false;
-    T rel_change;
-    auto prev_cost = static_cast<T>(0);
-    auto currentCenters = np_centers;
-
-    do {
-        currentCenters = cluster<T>(np_chunk, currentCenters, n_threads, metric);
-        auto cost = costFunction(np_chunk, currentCenters, metric, n_threads);
-        rel_change = (cost != 0.0) ? std::abs(cost - prev_cost) / cost : 0;
-        prev_cost = cost;
-        if(rel_change <= tolerance) {
-            converged = true;
-        } else {
-            if(! callback.is_none()) {
-                /* Acquire GIL before calling Python code */
-                py::gil_scoped_acquire acquire;
-                callback();
-            }
-        }
+inline std::tuple<np_array<T>, np_array<std::int64_t>, double> accumulate(const np_array<T>& np_chunk,
+                                                                         const np_array<T>& np_centers,
+                                                                         int n_threads, const Metric *metric) {
+    if (np_chunk.ndim() != 2 || np_centers.ndim() != 2 || np_chunk.shape(1) != np_centers.shape(1)) {
+        throw std::invalid_argument("chunk and centers must be two-dimensional with the same number of columns.");
+    }
+    auto n_frames = static_cast<std::size_t>(np_chunk.shape(0));
+    auto n_centers = static_cast<std::size_t>(np_centers.shape(0));
+    auto dim = static_cast<std::size_t>(np_chunk.shape(1));
+    const T* data = np_chunk.data();
 
-        it += 1;
-    } while(it < max_iter && ! converged);
-    int res = converged ? 0 : 1;
-    return std::make_tuple(currentCenters, res, it, prev_cost);
+    detail::CentroidSums<T> accumulated(n_centers, dim);
+    {
+        py::gil_scoped_release release;
+        CenterAssigner<T> assigner(np_centers.data(), n_centers, dim, metric);
+        accumulated = detail::accumulate_centroids(
+                data, n_frames, n_centers, dim, n_threads,
+                [&](std::size_t begin, std::size_t n, int* assignments, T* sq_dists) {
+                    assigner.assign(data + begin * dim, n, assignments, sq_dists);
+                });
+    }
+
+    std::vector<std::size_t> shape = {n_centers, dim};
+    np_array<T> sums(shape);
+    std::copy(accumulated.sums.begin(), accumulated.sums.end(), sums.mutable_data());
+    np_array<std::int64_t> counts(n_centers);
+    std::copy(accumulated.counts.begin(), accumulated.counts.end(), counts.mutable_data());
+    return std::make_tuple(sums, counts, accumulated.inertia);
 }
 
+/**
+ * One step of Sculley's mini-batch k-means. All frames of the batch are assigned to the centers first, then each
+ * frame moves its center towards itself with the per-center learning rate w / (total weight seen by the center).
+ * Processed in batch order, these updates turn each center into the running weighted mean of its frames, hence a
+ * center c which has seen the weight v before and receives frames of total weight n and weighted sum s in this batch
+ * moves to c + (s - n c) / (v + n). Without weights, every frame has weight one and v, n are plain counts.
+ * @return tuple of the new centers, the new per-center total weights and the (weighted) inertia of the batch with
+ * respect to the given centers
+ */
 template<typename T>
-inline T costFunction(const np_array<T>& np_data, const np_array<T>& np_centers, const Metric *metric,
-                      int n_threads) {
-    auto data = np_data.template unchecked<2>();
-    auto centers = np_centers.template unchecked<2>();
+inline std::tuple<np_array<T>, np_array<double>, T> minibatchStep(const np_array<T>& np_batch,
+                                                                  const np_array<T>& np_centers,
+                                                                  const np_array<double>& np_counts,
+                                                                  int n_threads, const Metric *metric,
+                                                                  const T* weights) {
+    if (np_batch.ndim() != 2 || np_centers.ndim() != 2 || np_batch.shape(1) != np_centers.shape(1)) {
+        throw std::invalid_argument("batch and centers must be two-dimensional with the same number of columns.");
+    }
+    if (np_counts.ndim() != 1 || np_counts.shape(0) != np_centers.shape(0)) {
+        throw std::invalid_argument("there has to be one count per center.");
+    }
+    auto n_frames = static_cast<std::size_t>(np_batch.shape(0));
+    auto n_centers = static_cast<std::size_t>(np_centers.shape(0));
+    auto dim = static_cast<std::size_t>(np_batch.shape(1));
+    const T* data = np_batch.data();
+    const T* centers = np_centers.data();
 
-    T value = static_cast<T>(0);
-    auto n_frames = static_cast<std::size_t>(np_data.shape(0));
-    auto dim = static_cast<std::size_t>(np_data.shape(1));
-#ifdef USE_OPENMP
-    omp_set_num_threads(n_threads);
-#endif
-
-#pragma omp parallel for reduction(+:value)
-    for (std::size_t i = 0; i < n_frames; i++) {
-        for (std::size_t r = 0; r < static_cast<std::size_t>(np_centers.shape(0)); r++) {
-            auto l = metric->compute(&data(i, 0), &centers(r, 0), dim);
-            {
-                value += l;
+    detail::CentroidSums<T> accumulated(n_centers, dim);
+    {
+        py::gil_scoped_release release;
+        CenterAssigner<T> assigner(centers, n_centers, dim, metric);
+        accumulated = detail::accumulate_centroids(
+                data, n_frames, n_centers, dim, n_threads,
+                [&](std::size_t begin, std::size_t n, int* assignments, T* sq_dists) {
+                    assigner.assign(data + begin * dim, n, assignments, sq_dists);
+                }, nullptr, weights);
+    }
+
+    std::vector<std::size_t> shape = {n_centers, dim};
+    np_array<T> new_centers(shape);
+    np_array<double> new_counts(n_centers);
+    T* newCentersPtr = new_centers.mutable_data();
+    double* newCountsPtr = new_counts.mutable_data();
+    for (std::size_t j = 0; j < n_centers; ++j) {
+        auto n = accumulated.weights[j];
+        auto total = np_counts.data()[j] + n;
+        newCountsPtr[j] = total;
+        for (std::size_t d = 0; d < dim; ++d) {
+            auto c = static_cast<double>(centers[j * dim + d]);
+            if (n > 0) {
+                c += (static_cast<double>(accumulated.sums[j * dim + d]) - n * c) / total;
             }
+            newCentersPtr[j * dim + d] = static_cast<T>(c);
         }
     }
-    return value;
+    return std::make_tuple(new_centers, new_counts, static_cast<T>(accumulated.inertia));
+}
+
+template<typename T>
+inline T costFunction(const np_array<T>& np_data, const np_array<T>& np_centers, const Metric *metric,
+                      int n_threads, const T* weights) {
+    if (np_data.ndim() != 2 || np_centers.ndim() != 2 || np_data.shape(1) != np_centers.shape(1)) {
+        throw std::invalid_argument("data and centers must be two-dimensional with the same number of columns.");
+    }
+    auto n_frames = static_cast<std::size_t>(np_data.shape(0));
+    auto n_centers = static_cast<std::size_t>(np_centers.shape(0));
+    auto dim = static_cast<std::size_t>(np_data.shape(1));
+    py::gil_scoped_release release;
+    return static_cast<T>(detail::inertia(np_data.data(), n_frames, np_centers.data(), n_centers, dim, metric,
+                                          n_threads, nullptr, weights));
 }
 
 template<typename T>
 inline np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k,
                                    const Metric *metric, unsigned int random_seed,
-                                   int n_threads, py::object& callback) {
+                                   int n_threads, py::object& callback, const T* weights) {
     if (static_cast<std::size_t>(np_data.shape(0)) < k) {
         std::stringstream ss;
         ss << "not enough data to initialize desired number of centers.";
@@ -248,10 +719,16 @@ inline np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k,
                 static_cast<std::size_t>(init_centers.size() * init_centers.itemsize()));
 
     const auto data = np_data.template unchecked<2>();
-    /* initialize random device and pick first center randomly */
+    /* the seeding only works on raw buffers, so other Python threads (e.g. further restarts) may run */
+    py::gil_scoped_release release;
+    /* weighted frames enter all D^2 sums with their weight */
+    auto weight = [weights](std::size_t i) { return weights ? weights[i] : static_cast<T>(1); };
+    /* frames without weight can not be drawn */
+    auto eligible = [&](std::size_t i) { return taken_points[i] == 0 && (!weights || weights[i] > 0); };
+    /* initialize random device and pick first center randomly, proportional to the weights if there are any */
     std::default_random_engine generator(random_seed);
     std::uniform_int_distribution<size_t> uniform_dist(0, n_frames - 1);
-    auto first_center_index = uniform_dist(generator);
+    auto first_center_index = weights ? detail::sample_index(weights, n_frames, generator) : uniform_dist(generator);
     /* and mark it as assigned */
     taken_points[first_center_index] = 1;
     /* write its coordinates into the init_centers array */
@@ -265,28 +742,32 @@ inline np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k,
         py::gil_scoped_acquire acquire;
         callback();
     }
-#ifdef USE_OPENMP
-    omp_set_num_threads(n_threads);
-#endif
-
     /* iterate over all data points j, measuring the squared distance between j and the initial center i: */
     /* squared_distances[i] = distance(x_j, x_i)*distance(x_j, x_i) */
-    T dist_sum = static_cast<T>(0);
-#pragma omp parallel for reduction(+:dist_sum)
-    for (std::size_t i = 0; i < n_frames; i++) {
-        if (i != first_center_index) {
-            auto value = metric->compute(&data(i, 0), &data(first_center_index, 0), dim);
-            value = value * value;
-            squared_distances[i] = value;
-            /* build up dist_sum which keeps the sum of all squared distances */
-            dist_sum += value;
+    /* all sums over the frames are carried out in a fixed order, so that the chosen centers do not depend on */
+    /* the number of threads. */
+    auto sum_squared_distances = [&]() {
+        return detail::ordered_sum<T>(n_frames, 1, n_threads, [&](std::size_t begin, std::size_t end, T* out) {
+            for (std::size_t i = begin; i < end; ++i) {
+                if (taken_points[i] == 0) {
+                    *out += weight(i) * squared_distances[i];
+                }
+            }
+        })[0];
+    };
+    parallel_for((n_frames + detail::leaf_size - 1) / detail::leaf_size, n_threads, [&](std::size_t leaf) {
+        for (auto i = leaf * detail::leaf_size; i < std::min((leaf + 1) * detail::leaf_size, n_frames); ++i) {
+            if (i != first_center_index) {
+                auto value = metric->compute(&data(i, 0), &data(first_center_index, 0), dim);
+                squared_distances[i] = value * value;
+            }
         }
-    }
+    });
+    /* build up dist_sum which keeps the sum of all squared distances */
+    T dist_sum = sum_squared_distances();
 
     /* keep picking centers while we do not have enough of them... */
     while (centers_found < k) {
-        py::gil_scoped_release release;
-
         /* initialize the trials random values by the D^2-weighted distribution */
         for (std::size_t j = 0; j < n_trials; j++) {
             next_center_candidates[j] = size_t_max;
@@ -298,8 +779,8 @@ inline np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k,
         /* pick candidate data points corresponding to their random value */
         T sum = static_cast<T>(0);
         for (std::size_t i = 0; i < n_frames; i++) {
-            if (taken_points[i] == 0) {
-                sum += squared_distances[i];
+            if (eligible(i)) {
+                sum += weight(i) * squared_distances[i];
                 bool some_not_done{false};
                 for (std::size_t j = 0; j < n_trials; j++) {
                     if (next_center_candidates[j] == size_t_max) {
@@ -316,32 +797,23 @@ inline np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k,
         }
 
         /* now find the maximum squared distance for each trial... */
-        std::atomic_bool terminate(false);
-#pragma omp parallel for
-        for (std::size_t i = 0; i < n_frames; i++) {
-            if (terminate.load()) {
-                continue;
-            }
-            if (taken_points.at(i) == 0) {
-                for (std::size_t j = 0; j < n_trials; ++j) {
-                    if (next_center_candidates.at(j) == size_t_max) {
-                        terminate.store(true);
-                        break;
-                    }
-#pragma omp critical
-                    {
-                        if (next_center_candidates.at(j) != i) {
-                            auto value = metric->compute(&data(i, 0), &data(next_center_candidates.at(j), 0), dim);
-                            auto d = value * value;
-                            if (d < squared_distances.at(i)) {
-                                next_center_candidates_potential[j] += d;
-                            } else {
-                                next_center_candidates_potential[j] += squared_distances[i];
+        auto all_candidates_found = std::none_of(next_center_candidates.begin(), next_center_candidates.end(),
+                                                 [](std::size_t c) { return c == size_t_max; });
+        if (all_candidates_found) {
+            next_center_candidates_potential = detail::ordered_sum<T>(
+                    n_frames, n_trials, n_threads, [&](std::size_t begin, std::size_t end, T* potentials) {
+                for (std::size_t i = begin; i < end; ++i) {
+                    if (taken_points[i] == 0) {
+                        for (std::size_t j = 0; j < n_trials; ++j) {
+                            if (next_center_candidates[j] != i) {
+                                auto value = metric->compute(&data(i, 0), &data(next_center_candidates[j], 0), dim);
+                                auto d = value * value;
+                                potentials[j] += weight(i) * std::min(d, squared_distances[i]);
                             }
                         }
                     }
                 }
-            }
+            });
         }
 
         /* ... and select the best candidate by the minimum value of the maximum squared distances */
@@ -357,7 +829,7 @@ inline np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k,
         /* if for some reason we did not find a best candidate, just take the next available point */
         if (best_candidate == -1) {
             for (std::size_t i = 0; i < n_frames; i++) {
-                if (taken_points[i] == 0) {
+                if (eligible(i)) {
                     best_candidate = i;
                     break;
                 }
@@ -379,29 +851,25 @@ inline np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k,
             }
             /* mark the data point as assigned center */
             taken_points[best_candidate] = 1;
-            /* update the sum of squared distances by removing the assigned center */
-            dist_sum -= squared_distances[best_candidate];
 
             /* if we still have centers to assign, the squared distances array has to be updated */
             if (centers_found < k) {
                 /* Check for each data point if its squared distance to the freshly added center is smaller than */
                 /* the squared distance to the previously picked centers. If so, update the squared_distances */
-                /* array by the new value and also update the dist_sum value by removing the old value and adding */
-                /* the new one. */
-#pragma omp parallel for
-                for (std::size_t i = 0; i < n_frames; ++i) {
-                    if (taken_points[i] == 0) {
-                        auto value = metric->compute(&data(i, 0), &data(best_candidate, 0), dim);
-                        auto d = value * value;
-#pragma omp critical
-                        {
+                /* array by the new value. Afterwards the sum over all remaining points is updated. */
+                parallel_for((n_frames + detail::leaf_size - 1) / detail::leaf_size, n_threads, [&](std::size_t leaf) {
+                    for (auto i = leaf * detail::leaf_size; i < std::min((leaf + 1) * detail::leaf_size, n_frames);
+                         ++i) {
+                        if (taken_points[i] == 0) {
+                            auto value = metric->compute(&data(i, 0), &data(best_candidate, 0), dim);
+                            auto d = value * value;
                             if (d < squared_distances[i]) {
-                                dist_sum += d - squared_distances[i];
                                 squared_distances[i] = d;
                             }
                         }
                     }
-                }
+                });
+                dist_sum = sum_squared_distances();
             }
         } else {
             break;
@@ -411,5 +879,305 @@ inline np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k,
     return ret_init_centers;
 }
 
+/**
+ * Scalable k-means++ initialization, also known as k-means||. Instead of one pass over the data per center, each of
+ * the few oversampling rounds samples every frame independently with a probability proportional to its (weighted)
+ * squared distance to the current candidates. The candidates are weighted by the (total weight of the) frames closest
+ * to them and reduced to k centers by a weighted k-means++ seeding, which only operates on the small candidate set.
+ * The sampling uses one random generator per leaf of frames, so the result does not depend on the number of threads.
+ */
+template<typename T>
+inline np_array<T> initCentersKMeansParallel(const np_array<T>& np_data, std::size_t k, const Metric *metric,
+                                             unsigned int random_seed, int n_threads, py::object& callback,
+                                             double oversampling_factor, std::size_t n_rounds, const T* weights) {
+    if (np_data.ndim() != 2) {
+        throw std::invalid_argument("input data does not have two dimensions.");
+    }
+    if (static_cast<std::size_t>(np_data.shape(0)) < k) {
+        std::stringstream ss;
+        ss << "not enough data to initialize desired number of centers.";
+        ss << "Provided frames (" << np_data.shape(0) << ") < n_centers (" << k << ").";
+        throw std::invalid_argument(ss.str());
+    }
+    if (k == 0) {
+        throw std::invalid_argument("the number of centers must be larger than zero.");
+    }
+
+    auto n_frames = static_cast<std::size_t>(np_data.shape(0));
+    auto dim = static_cast<std::size_t>(np_data.shape(1));
+    auto n_leaves = (n_frames + detail::leaf_size - 1) / detail::leaf_size;
+    const T* data = np_data.data();
+
+    std::vector<std::size_t> shape = {k, dim};
+    np_array<T> ret_init_centers(shape);
+    T* init_centers = ret_init_centers.mutable_data();
+
+    /* the seeding only works on raw buffers, so other Python threads (e.g. further restarts) may run */
+    py::gil_scoped_release release;
+
+    std::vector<T> candidates;
+    std::vector<T> squared_distances(n_frames, std::numeric_limits<T>::infinity());
+
+    /* lowers the squared distances of all frames by taking the candidates [first_new, end) into account */
+    auto update_squared_distances = [&](std::size_t first_new) {
+        auto n_new = candidates.size() / dim - first_new;
+        CenterAssigner<T> assigner(candidates.data() + first_new * dim, n_new, dim, metric);
+        parallel_for(n_leaves, n_threads, [&](std::size_t leaf) {
+            auto begin = leaf * detail::leaf_size;
+            auto n = std::min(detail::leaf_size, n_frames - begin);
+            std::vector<int> assignments(n);
+            std::vector<T> dists(n);
+            assigner.assign(data + begin * dim, n, assignments.data(), dists.data());
+            for (std::size_t i = 0; i < n; ++i) {
+                squared_distances[begin + i] = std::min(squared_distances[begin + i], dists[i]);
+            }
+        });
+    };
+    auto potential = [&]() {
+        return detail::ordered_sum<double>(n_frames, 1, n_threads, [&](std::size_t begin, std::size_t end,
+                                                                         double* out) {
+            for (auto i = begin; i < end; ++i) {
+                *out += weights ? static_cast<double>(weights[i]) * squared_distances[i] : squared_distances[i];
+            }
+        })[0];
+    };
+
+    /* pick first candidate uniformly, or proportional to the weights if there are any */
+    std::mt19937 generator(random_seed);
+    auto first = weights ? detail::sample_index(weights, n_frames, generator)
+                         : std::uniform_int_distribution<std::size_t>(0, n_frames - 1)(generator);
+    candidates.insert(candidates.end(), data + first * dim, data + (first + 1) * dim);
+    update_squared_distances(0);
+    auto phi = potential();
+
+    /* oversampling rounds */
+    auto ell = oversampling_factor * static_cast<double>(k);
+    for (std::size_t round = 0; round < n_rounds && phi > 0; ++round) {
+        std::vector<std::vector<std::size_t>> picked(n_leaves);
+        parallel_for(n_leaves, n_threads, [&](std::size_t leaf) {
+            std::seed_seq seed{random_seed, static_cast<unsigned int>(round), static_cast<unsigned int>(leaf),
+                               static_cast<unsigned int>(static_cast<std::uint64_t>(leaf) >> 32u)};
+            std::mt19937 leaf_generator(seed);
+            std::uniform_real_distribution<double> uniform(0., 1.);
+            auto end = std::min((leaf + 1) * detail::leaf_size, n_frames);
+            for (auto i = leaf * detail::leaf_size; i < end; ++i) {
+                auto d = weights ? static_cast<double>(weights[i]) * squared_distances[i] : squared_distances[i];
+                if (uniform(leaf_generator) < ell * d / phi) {
+                    picked[leaf].push_back(i);
+                }
+            }
+        });
+        auto first_new = candidates.size() / dim;
+        for (const auto &leaf_picks : picked) {
+            for (auto i : leaf_picks) {
+                candidates.insert(candidates.end(), data + i * dim, data + (i + 1) * dim);
+            }
+        }
+        if (candidates.size() / dim > first_new) {
+            update_squared_distances(first_new);
+            phi = potential();
+        }
+    }
+
+    /* in the unlikely case of too few candidates, add the frames which are farthest away */
+    if (candidates.size() / dim < k) {
+        std::vector<std::size_t> order(n_frames);
+        std::iota(order.begin(), order.end(), 0);
+        auto missing = k - candidates.size() / dim;
+        auto value = [&](std::size_t i) {
+            return weights ? static_cast<double>(weights[i]) * squared_distances[i] : squared_distances[i];
+        };
+        std::partial_sort(order.begin(), order.begin() + missing, order.end(), [&](std::size_t a, std::size_t b) {
+            return value(a) > value(b) || (value(a) == value(b) && a < b);
+        });
+        for (std::size_t m = 0; m < missing; ++m) {
+            candidates.insert(candidates.end(), data + order[m] * dim, data + (order[m] + 1) * dim);
+        }
+    }
+    auto n_candidates = candidates.size() / dim;
+
+    /* weight the candidates by the (total weight of the) frames which are closest to them, only the weights are needed */
+    CenterAssigner<T> candidate_assigner(candidates.data(), n_candidates, dim, metric);
+    auto candidate_weights = detail::accumulate_centroids(
+            data, n_frames, n_candidates, 0, n_threads,
+            [&](std::size_t begin, std::size_t n, int* assignments, T* sq_dists) {
+                candidate_assigner.assign(data + begin * dim, n, assignments, sq_dists);
+            }, nullptr, weights).weights;
+
+    /* weighted kmeans++ on the candidates */
+    std::vector<double> candidate_sq_dists(n_candidates, std::numeric_limits<double>::infinity());
+    std::vector<char> taken(n_candidates, 0);
+    std::uniform_real_distribution<double> uniform(0., 1.);
+    for (std::size_t found = 0; found < k; ++found) {
+        double total = 0;
+        for (std::size_t c = 0; c < n_candidates; ++c) {
+            if (!taken[c]) {
+                total += candidate_weights[c] * (found == 0 ? 1. : candidate_sq_dists[c]);
+            }
+        }
+        std::size_t chosen = n_candidates;
+        if (total > 0) {
+            auto threshold = uniform(generator) * total;
+            double cumsum = 0;
+            for (std::size_t c = 0; c < n_candidates; ++c) {
+                if (!taken[c]) {
+                    cumsum += candidate_weights[c] * (found == 0 ? 1. : candidate_sq_dists[c]);
+                    chosen = c;
+                    if (cumsum >= threshold && cumsum > 0) break;
+                }
+            }
+        } else {
+            /* all remaining candidates coincide with chosen centers or have no weight, take the next one */
+            chosen = static_cast<std::size_t>(std::distance(taken.begin(), std::find(taken.begin(), taken.end(), 0)));
+        }
+        taken[chosen] = 1;
+        std::copy(candidates.begin() + chosen * dim, candidates.begin() + (chosen + 1) * dim,
+                  init_centers + found * dim);
+        if (!callback.is_none()) {
+            py::gil_scoped_acquire acquire;
+            callback();
+        }
+        if (found + 1 < k) {
+            parallel_for(n_candidates, n_threads, [&](std::size_t c) {
+                if (!taken[c]) {
+                    auto d = static_cast<double>(metric->compute(&candidates[c * dim], &candidates[chosen * dim], dim));
+                    candidate_sq_dists[c] = std::min(candidate_sq_dists[c], d * d);
+                }
+            });
+        }
+    }
+    return ret_init_centers;
+}
+
+/**
+ * Assigns frames by descending a binary tree of centers, as built by bisecting k-means. Starting at the root, each
+ * frame moves on to the closer of the two children of the current node until it reaches a leaf, hence a tree of
+ * depth h requires 2 h distance evaluations per frame instead of one per leaf.
+ * @param np_children array of shape (n_nodes, 2) with the indices of the children of each node, -1 for leaves
+ * @param np_leaf_labels array of shape (n_nodes,) with the label of each leaf
+ */
+template<typename T>
+inline np_array<int> assignTree(const np_array<T>& np_chunk, const np_array<T>& np_node_centers,
+                                const np_array<int>& np_children, const np_array<int>& np_leaf_labels,
+                                int n_threads, const Metric *metric) {
+    if (np_chunk.ndim() != 2 || np_node_centers.ndim() != 2 || np_chunk.shape(1) != np_node_centers.shape(1)) {
+        throw std::invalid_argument("chunk and node centers must be two-dimensional with the same number of columns.");
+    }
+    auto n_nodes = static_cast<std::size_t>(np_node_centers.shape(0));
+    if (n_nodes == 0 || np_children.ndim() != 2 || np_children.shape(1) != 2
+        || static_cast<std::size_t>(np_children.shape(0)) != n_nodes || np_leaf_labels.ndim() != 1
+        || static_cast<std::size_t>(np_leaf_labels.shape(0)) != n_nodes) {
+        throw std::invalid_argument("the tree needs at least one node, two children and a leaf label per node.");
+    }
+    const int* children = np_children.data();
+    for (std::size_t node = 0; node < n_nodes; ++node) {
+        for (std::size_t c = 0; c < 2; ++c) {
+            /* children are created after their parents, hence the descent always terminates */
+            auto child = children[2 * node + c];
+            if (child >= static_cast<int>(n_nodes) || (child >= 0 && static_cast<std::size_t>(child) <= node)
+                || (child < 0) != (children[2 * node] < 0)) {
+                throw std::invalid_argument("invalid tree, each node needs zero or two children with larger index.");
+            }
+        }
+    }
+
+    auto n_frames = static_cast<std::size_t>(np_chunk.shape(0));
+    auto dim = static_cast<std::size_t>(np_chunk.shape(1));
+    const T* data = np_chunk.data();
+    const T* node_centers = np_node_centers.data();
+    const int* leaf_labels = np_leaf_labels.data();
+
+    np_array<int> labels(n_frames);
+    int* labelsPtr = labels.mutable_data();
+    {
+        py::gil_scoped_release release;
+        auto n_leaves = (n_frames + detail::leaf_size - 1) / detail::leaf_size;
+        parallel_for(n_leaves, n_threads, [&](std::size_t leaf) {
+            for (auto i = leaf * detail::leaf_size; i < std::min((leaf + 1) * detail::leaf_size, n_frames); ++i) {
+                const T* frame = data + i * dim;
+                std::size_t node = 0;
+                while (children[2 * node] >= 0) {
+                    auto left = static_cast<std::size_t>(children[2 * node]);
+                    auto right = static_cast<std::size_t>(children[2 * node + 1]);
+                    auto d_left = metric->compare(frame, node_centers + left * dim, dim);
+                    auto d_right = metric->compare(frame, node_centers + right * dim, dim);
+                    node = d_right < d_left ? right : left;
+                }
+                labelsPtr[i] = leaf_labels[node];
+            }
+        });
+    }
+    return labels;
+}
+
+/**
+ * Sensitivities of the frames with respect to the k-means objective, bounded by means of a rough solution given by
+ * the centers B, usually obtained by k-means++ seeding (Bachem, Lucic and Krause, 2017). With d(x) the distance of a
+ * frame to its closest center b, P_b the frames closest to b, W_b their total weight, W the total weight and
+ * c = sum_x w(x) d(x)^2 / W the average cost, the sensitivity of x is bounded by
+ * s(x) = a d(x)^2 / c + 2 a sum_{x' in P_b} w(x') d(x')^2 / (W_b c) + 4 W / W_b, where a = 16 (log k + 2).
+ * Sampling frames proportional to w(x) s(x) yields a coreset with provable error bounds for the k-means objective.
+ * @return the sensitivities per unit weight of shape (n_frames,)
+ */
+template<typename T>
+inline np_array<double> coresetSensitivities(const np_array<T>& np_data, const np_array<T>& np_centers,
+                                             const Metric *metric, int n_threads, const T* weights) {
+    if (np_data.ndim() != 2 || np_centers.ndim() != 2 || np_data.shape(1) != np_centers.shape(1)) {
+        throw std::invalid_argument("data and centers must be two-dimensional with the same number of columns.");
+    }
+    if (np_centers.shape(0) == 0) {
+        throw std::invalid_argument("the number of centers must be larger than zero.");
+    }
+    auto n_frames = static_cast<std::size_t>(np_data.shape(0));
+    auto n_centers = static_cast<std::size_t>(np_centers.shape(0));
+    auto dim = static_cast<std::size_t>(np_data.shape(1));
+    const T* data = np_data.data();
+
+    np_array<double> result(n_frames);
+    double* sensitivities = result.mutable_data();
+    {
+        py::gil_scoped_release release;
+        std::vector<int> assignments(n_frames);
+        std::vector<T> sq_dists(n_frames);
+        CenterAssigner<T> assigner(np_centers.data(), n_centers, dim, metric);
+        auto n_leaves = (n_frames + detail::leaf_size - 1) / detail::leaf_size;
+        parallel_for(n_leaves, n_threads, [&](std::size_t leaf) {
+            auto begin = leaf * detail::leaf_size;
+            auto n = std::min(detail::leaf_size, n_frames - begin);
+            assigner.assign(data + begin * dim, n, assignments.data() + begin, sq_dists.data() + begin);
+        });
+
+        /* per-center weights and costs, summed sequentially in frame order */
+        std::vector<double> center_weights(n_centers, 0.), center_costs(n_centers, 0.);
+        for (std::size_t i = 0; i < n_frames; ++i) {
+            auto w = weights ? static_cast<double>(weights[i]) : 1.;
+            center_weights[assignments[i]] += w;
+            center_costs[assignments[i]] += w * static_cast<double>(sq_dists[i]);
+        }
+        auto total_weight = std::accumulate(center_weights.begin(), center_weights.end(), 0.);
+        auto total_cost = std::accumulate(center_costs.begin(), center_costs.end(), 0.);
+        auto alpha = 16. * (std::log(static_cast<double>(n_centers)) + 2.);
+        auto average_cost = total_weight > 0 ? total_cost / total_weight : 0.;
+
+        parallel_for(n_leaves, n_threads, [&](std::size_t leaf) {
+            for (auto i = leaf * detail::leaf_size; i < std::min((leaf + 1) * detail::leaf_size, n_frames); ++i) {
+                auto b = static_cast<std::size_t>(assignments[i]);
+                double s = 0;
+                if (center_weights[b] > 0) {
+                    s += 4. * total_weight / center_weights[b];
+                    if (average_cost > 0) {
+                        s += 2. * alpha * center_costs[b] / (center_weights[b] * average_cost);
+                    }
+                }
+                if (average_cost > 0) {
+                    s += alpha * static_cast<double>(sq_dists[i]) / average_cost;
+                }
+                sensitivities[i] = s;
+            }
+        });
+    }
+    return result;
+}
+
 }
 }
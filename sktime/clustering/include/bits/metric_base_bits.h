@@ -5,16 +5,371 @@
 #pragma once
 
 #include "metric.h"
-
-#ifdef USE_OPENMP
-#include <omp.h>
-#endif
+#include "threading_utils.h"
 
 template<>
 inline float Metric::compute<float>(const float* xs, const float* ys, std::size_t dim) const {
     return this->compute_f(xs, ys, dim);
 }
 
+template<>
+inline float Metric::compare<float>(const float* xs, const float* ys, std::size_t dim) const {
+    return this->compare_f(xs, ys, dim);
+}
+
+template<typename T>
+inline EuclideanCenters<T>::EuclideanCenters(const T* centers, std::size_t n_centers, std::size_t dim)
+        : _centers(centers), _n_centers(n_centers), _dim(dim), _n_tiles((n_centers + tile_width - 1) / tile_width),
+          _packed(_n_tiles * dim * tile_width, 0), _norms(_n_tiles * tile_width, std::numeric_limits<T>::infinity()),
+          _reference(dim, 0), _max_norm(0) {
+    /* tiles of one group should roughly fit into the L2 cache */
+    _tiles_per_group = std::max(static_cast<std::size_t>(1),
+                                (128 * 1024) / (sizeof(T) * tile_width * std::max(dim, static_cast<std::size_t>(1))));
+    /* Frames and centers are expressed relative to the mean of the centers. Otherwise a constant offset of the data
+     * dominates ||x||^2, x.c and ||c||^2 and their difference cancels catastrophically in single precision. */
+    for (std::size_t d = 0; d < dim; ++d) {
+        double sum = 0;
+        for (std::size_t j = 0; j < n_centers; ++j) {
+            sum += centers[j * dim + d];
+        }
+        _reference[d] = n_centers > 0 ? static_cast<T>(sum / n_centers) : static_cast<T>(0);
+    }
+    for (std::size_t j = 0; j < n_centers; ++j) {
+        auto tile = j / tile_width;
+        auto col = j % tile_width;
+        double norm = 0;
+        for (std::size_t d = 0; d < dim; ++d) {
+            auto c = centers[j * dim + d] - _reference[d];
+            _packed[(tile * dim + d) * tile_width + col] = c;
+            norm += static_cast<double>(c) * c;
+        }
+        _norms[j] = static_cast<T>(norm);
+        _max_norm = std::max(_max_norm, std::sqrt(norm));
+    }
+    /* Bound on the rounding error of ||c||^2 - 2 x.c relative to (||x|| + max ||c||)^2, which covers the shifts, the
+     * inner product of length dim, the squared norm and the difference. The machine epsilon is twice the unit
+     * roundoff, which leaves a safety factor of two. */
+    _error_scale = (static_cast<double>(dim) + 4.) * std::numeric_limits<T>::epsilon();
+}
+
+template<typename T>
+inline void EuclideanCenters<T>::assign_rows(const T* rows, std::size_t tile_begin, std::size_t tile_end,
+                                             T* best, T* second, int* argbest) const {
+    for (std::size_t tile = tile_begin; tile < tile_end; ++tile) {
+        const T* packed = _packed.data() + tile * _dim * tile_width;
+        T acc[n_rows][tile_width] = {};
+        clustering::simd::tile_products(rows, packed, _dim, &acc[0][0]);
+        /* fused argmin over ||c||^2 - 2 x.c, the frame's norm is a constant offset */
+        const T* norms = _norms.data() + tile * tile_width;
+        for (std::size_t r = 0; r < n_rows; ++r) {
+            for (std::size_t j = 0; j < tile_width; ++j) {
+                auto v = norms[j] - 2 * acc[r][j];
+                if (v < second[r]) {
+                    if (v < best[r]) {
+                        second[r] = best[r];
+                        best[r] = v;
+                        argbest[r] = static_cast<int>(tile * tile_width + j);
+                    } else {
+                        second[r] = v;
+                    }
+                }
+            }
+        }
+    }
+}
+
+template<typename T>
+inline void EuclideanCenters<T>::assign(const T* chunk, std::size_t n_frames, int* assignments, T* sq_dists) const {
+    std::vector<T> best(frame_block), second(frame_block);
+    std::vector<int> argbest(frame_block);
+    /* frames of the current block relative to the reference point, zero padded to a multiple of n_rows */
+    std::vector<T> shifted(((frame_block + n_rows - 1) / n_rows) * n_rows * _dim);
+
+    for (std::size_t block_begin = 0; block_begin < n_frames; block_begin += frame_block) {
+        auto block_size = std::min(frame_block, n_frames - block_begin);
+        std::fill(best.begin(), best.end(), std::numeric_limits<T>::infinity());
+        std::fill(second.begin(), second.end(), std::numeric_limits<T>::infinity());
+        std::fill(argbest.begin(), argbest.end(), 0);
+        std::fill(shifted.begin(), shifted.end(), static_cast<T>(0));
+        for (std::size_t i = 0; i < block_size; ++i) {
+            const T* frame = chunk + (block_begin + i) * _dim;
+            for (std::size_t d = 0; d < _dim; ++d) {
+                shifted[i * _dim + d] = frame[d] - _reference[d];
+            }
+        }
+
+        for (std::size_t group = 0; group < _n_tiles; group += _tiles_per_group) {
+            auto group_end = std::min(group + _tiles_per_group, _n_tiles);
+            for (std::size_t i = 0; i < block_size; i += n_rows) {
+                assign_rows(shifted.data() + i * _dim, group, group_end, best.data() + i, second.data() + i,
+                            argbest.data() + i);
+            }
+        }
+
+        for (std::size_t i = 0; i < block_size; ++i) {
+            const T* frame = chunk + (block_begin + i) * _dim;
+            double norm = 0;
+            #pragma omp simd reduction(+:norm)
+            for (std::size_t d = 0; d < _dim; ++d) {
+                norm += static_cast<double>(shifted[i * _dim + d]) * shifted[i * _dim + d];
+            }
+            auto scale = std::sqrt(norm) + _max_norm;
+            auto sq_dist = static_cast<double>(best[i]) + norm;
+            if (static_cast<double>(second[i]) - best[i] <= 2 * _error_scale * scale * scale) {
+                /* the runner-up is within the rounding error, compare the distances to all centers exactly */
+                sq_dist = std::numeric_limits<double>::infinity();
+                for (std::size_t j = 0; j < _n_centers; ++j) {
+                    double dist = 0;
+                    #pragma omp simd reduction(+:dist)
+                    for (std::size_t d = 0; d < _dim; ++d) {
+                        auto diff = static_cast<double>(frame[d]) - static_cast<double>(_centers[j * _dim + d]);
+                        dist += diff * diff;
+                    }
+                    if (dist < sq_dist) {
+                        sq_dist = dist;
+                        argbest[i] = static_cast<int>(j);
+                    }
+                }
+            }
+            assignments[block_begin + i] = argbest[i];
+            if (sq_dists) {
+                sq_dists[block_begin + i] = static_cast<T>(std::max(0., sq_dist));
+            }
+        }
+    }
+}
+
+inline double MinRMSDMetric::rmsd(const double* m, double g_x, double g_y, std::size_t n_atoms) {
+    if (n_atoms == 0) {
+        return 0;
+    }
+    const double sxx = m[0], sxy = m[1], sxz = m[2];
+    const double syx = m[3], syy = m[4], syz = m[5];
+    const double szx = m[6], szy = m[7], szz = m[8];
+
+    const double sxx2 = sxx * sxx, syy2 = syy * syy, szz2 = szz * szz;
+    const double sxy2 = sxy * sxy, syz2 = syz * syz, sxz2 = sxz * sxz;
+    const double syx2 = syx * syx, szy2 = szy * szy, szx2 = szx * szx;
+
+    const double syzszymsyyszz2 = 2. * (syz * szy - syy * szz);
+    const double sxx2syy2szz2syz2szy2 = syy2 + szz2 - sxx2 + syz2 + szy2;
+
+    /* coefficients of the characteristic polynomial lambda^4 + c2 lambda^2 + c1 lambda + c0 of the key matrix */
+    const double c2 = -2. * (sxx2 + syy2 + szz2 + sxy2 + syx2 + sxz2 + szx2 + syz2 + szy2);
+    const double c1 = 8. * (sxx * syz * szy + syy * szx * sxz + szz * sxy * syx
+                            - sxx * syy * szz - syz * szx * sxy - szy * syx * sxz);
+
+    const double sxzpszx = sxz + szx, syzpszy = syz + szy, sxypsyx = sxy + syx;
+    const double syzmszy = syz - szy, sxzmszx = sxz - szx, sxymsyx = sxy - syx;
+    const double sxxpsyy = sxx + syy, sxxmsyy = sxx - syy;
+    const double sxy2sxz2syx2szx2 = sxy2 + sxz2 - syx2 - szx2;
+
+    const double c0 = sxy2sxz2syx2szx2 * sxy2sxz2syx2szx2
+            + (sxx2syy2szz2syz2szy2 + syzszymsyyszz2) * (sxx2syy2szz2syz2szy2 - syzszymsyyszz2)
+            + (-sxzpszx * syzmszy + sxymsyx * (sxxmsyy - szz)) * (-sxzmszx * syzpszy + sxymsyx * (sxxmsyy + szz))
+            + (-sxzpszx * syzpszy - sxypsyx * (sxxpsyy - szz)) * (-sxzmszx * syzmszy - sxypsyx * (sxxpsyy + szz))
+            + (sxypsyx * syzpszy + sxzpszx * (sxxmsyy + szz)) * (-sxymsyx * syzmszy + sxzpszx * (sxxpsyy + szz))
+            + (sxypsyx * syzmszy + sxzmszx * (sxxmsyy - szz)) * (-sxymsyx * syzpszy + sxzmszx * (sxxpsyy - szz));
+
+    /* Newton-Raphson for the largest eigenvalue, which is bounded from above by (g_x + g_y) / 2 */
+    const double e0 = .5 * (g_x + g_y);
+    double lambda = e0;
+    for (int i = 0; i < 50; ++i) {
+        const double previous = lambda;
+        const double x2 = lambda * lambda;
+        const double b = (x2 + c2) * lambda;
+        const double a = b + c1;
+        const double denominator = 2. * x2 * lambda + b + a;
+        if (denominator == 0) {
+            break;
+        }
+        lambda -= (a * lambda + c0) / denominator;
+        if (std::abs(lambda - previous) < std::abs(1e-11 * lambda)) {
+            break;
+        }
+    }
+    return std::sqrt(std::max(0., 2. * (e0 - lambda) / static_cast<double>(n_atoms)));
+}
+
+inline void MinRMSDMetric::check_dim(std::size_t dim) {
+    if (dim % 3 != 0) {
+        throw std::invalid_argument("the minRMSD metric requires flattened cartesian coordinates, i.e., the "
+                                    "dimension must be a multiple of 3.");
+    }
+}
+
+template<typename T>
+inline double MinRMSDMetric::_compute(const T* xs, const T* ys, std::size_t dim) const {
+    check_dim(dim);
+    /* single pass over both conformations, the centering is applied to the accumulated moments afterwards */
+    auto n_atoms = dim / 3;
+    double sum_x[3] = {}, sum_y[3] = {}, m[9] = {}, g_x = 0, g_y = 0;
+    for (std::size_t i = 0; i < n_atoms; ++i) {
+        const T* x = xs + 3 * i;
+        const T* y = ys + 3 * i;
+        for (std::size_t a = 0; a < 3; ++a) {
+            sum_x[a] += x[a];
+            sum_y[a] += y[a];
+            g_x += static_cast<double>(x[a]) * x[a];
+            g_y += static_cast<double>(y[a]) * y[a];
+            for (std::size_t b = 0; b < 3; ++b) {
+                m[3 * a + b] += static_cast<double>(x[a]) * y[b];
+            }
+        }
+    }
+    if (n_atoms == 0) {
+        return 0;
+    }
+    auto n = static_cast<double>(n_atoms);
+    for (std::size_t a = 0; a < 3; ++a) {
+        g_x -= sum_x[a] * sum_x[a] / n;
+        g_y -= sum_y[a] * sum_y[a] / n;
+        for (std::size_t b = 0; b < 3; ++b) {
+            m[3 * a + b] -= sum_x[a] * sum_y[b] / n;
+        }
+    }
+    return rmsd(m, g_x, g_y, n_atoms);
+}
+
+namespace detail {
+/**
+ * Translates the coordinates of n_atoms atoms to their centroid.
+ * @return the sum of squared norms of the centered coordinates
+ */
+template<typename T>
+inline double center_coordinates(const T* xs, std::size_t n_atoms, T* out) {
+    double centroid[3] = {};
+    for (std::size_t i = 0; i < n_atoms; ++i) {
+        for (std::size_t a = 0; a < 3; ++a) {
+            centroid[a] += xs[3 * i + a];
+        }
+    }
+    for (auto &c : centroid) {
+        c /= static_cast<double>(std::max(n_atoms, static_cast<std::size_t>(1)));
+    }
+    double g = 0;
+    for (std::size_t i = 0; i < n_atoms; ++i) {
+        for (std::size_t a = 0; a < 3; ++a) {
+            out[3 * i + a] = static_cast<T>(xs[3 * i + a] - centroid[a]);
+            g += static_cast<double>(out[3 * i + a]) * out[3 * i + a];
+        }
+    }
+    return g;
+}
+}
+
+template<typename T>
+inline MinRMSDCenters<T>::MinRMSDCenters(const T* centers, std::size_t n_centers, std::size_t dim)
+        : _n_centers(0), _dim(dim), _n_atoms(dim / 3) {
+    MinRMSDMetric::check_dim(dim);
+    _centered.reserve(n_centers * dim);
+    _inner_products.reserve(n_centers);
+    for (std::size_t j = 0; j < n_centers; ++j) {
+        add(centers + j * dim);
+    }
+}
+
+template<typename T>
+inline void MinRMSDCenters<T>::add(const T* center) {
+    _centered.resize(_centered.size() + _dim);
+    _inner_products.push_back(center_frame(center, _centered.data() + _n_centers * _dim));
+    ++_n_centers;
+}
+
+template<typename T>
+inline double MinRMSDCenters<T>::center_frame(const T* frame, T* out) const {
+    return detail::center_coordinates(frame, _n_atoms, out);
+}
+
+template<typename T>
+inline double MinRMSDCenters<T>::distance(const T* centered_frame, double g_frame, std::size_t j) const {
+    const T* center = _centered.data() + j * _dim;
+    double m[9] = {};
+    for (std::size_t k = 0; k < _n_atoms; ++k) {
+        const T* x = centered_frame + 3 * k;
+        const T* y = center + 3 * k;
+        for (std::size_t a = 0; a < 3; ++a) {
+            for (std::size_t b = 0; b < 3; ++b) {
+                m[3 * a + b] += static_cast<double>(x[a]) * y[b];
+            }
+        }
+    }
+    return MinRMSDMetric::rmsd(m, g_frame, _inner_products[j], _n_atoms);
+}
+
+template<typename T>
+inline void MinRMSDCenters<T>::assign(const T* chunk, std::size_t n_frames, int* assignments, T* sq_dists) const {
+    std::vector<T> frame(_dim);
+    for (std::size_t i = 0; i < n_frames; ++i) {
+        auto g_x = center_frame(chunk + i * _dim, frame.data());
+        auto best = std::numeric_limits<double>::infinity();
+        int argbest = 0;
+        for (std::size_t j = 0; j < _n_centers; ++j) {
+            auto d = distance(frame.data(), g_x, j);
+            if (d < best) {
+                best = d;
+                argbest = static_cast<int>(j);
+            }
+        }
+        assignments[i] = argbest;
+        if (sq_dists) {
+            sq_dists[i] = static_cast<T>(best * best);
+        }
+    }
+}
+
+template<typename T>
+inline void assign_block(const T* chunk, std::size_t n_frames, const T* centers, std::size_t n_centers,
+                         std::size_t dim, const Metric* metric, int* assignments, T* dists) {
+    std::vector<T> mindist(n_frames, std::numeric_limits<T>::max());
+    std::fill(assignments, assignments + n_frames, -1);
+    /* loop over the frames for each center, so that the center stays in cache for the whole block */
+    for (std::size_t j = 0; j < n_centers; ++j) {
+        for (std::size_t i = 0; i < n_frames; ++i) {
+            auto d = metric->compare(chunk + i * dim, centers + j * dim, dim);
+            if (d < mindist[i]) {
+                mindist[i] = d;
+                assignments[i] = static_cast<int>(j);
+            }
+        }
+    }
+    if (dists) {
+        /* the search only used comparable distances, evaluate the actual distance to the closest center */
+        for (std::size_t i = 0; i < n_frames; ++i) {
+            dists[i] = assignments[i] < 0 ? mindist[i]
+                                          : metric->compute(chunk + i * dim, centers + assignments[i] * dim, dim);
+        }
+    }
+}
+
+template<typename T>
+inline CenterAssigner<T>::CenterAssigner(const T* centers, std::size_t n_centers, std::size_t dim,
+                                         const Metric* metric)
+        : _centers(centers), _n_centers(n_centers), _dim(dim), _metric(metric) {
+    if (dynamic_cast<const EuclideanMetric*>(metric)) {
+        _euclidean = std::unique_ptr<EuclideanCenters<T>>(
+                new EuclideanCenters<T>(centers, n_centers, dim));
+    } else if (dynamic_cast<const MinRMSDMetric*>(metric)) {
+        _min_rmsd = std::unique_ptr<MinRMSDCenters<T>>(new MinRMSDCenters<T>(centers, n_centers, dim));
+    }
+}
+
+template<typename T>
+inline void CenterAssigner<T>::assign(const T* chunk, std::size_t n_frames, int* assignments, T* sq_dists) const {
+    if (_euclidean) {
+        _euclidean->assign(chunk, n_frames, assignments, sq_dists);
+    } else if (_min_rmsd) {
+        _min_rmsd->assign(chunk, n_frames, assignments, sq_dists);
+    } else {
+        assign_block(chunk, n_frames, _centers, _n_centers, _dim, _metric, assignments, sq_dists);
+        if (sq_dists) {
+            for (std::size_t i = 0; i < n_frames; ++i) {
+                sq_dists[i] *= sq_dists[i];
+            }
+        }
+    }
+}
+
 template<typename T>
 inline py::array_t<int> assign_chunk_to_centers(const np_array<T>& chunk,
                                                 const np_array<T>& centers,
@@ -36,45 +391,24 @@ inline py::array_t<int> assign_chunk_to_centers(const np_array<T>& chunk,
     auto N_frames = static_cast<size_t>(chunk.shape(0));
     auto input_dim = static_cast<size_t>(chunk.shape(1));
 
-    std::vector<T> dists(N_centers);
     std::vector<size_t> shape = {N_frames};
     py::array_t<int> dtraj(shape);
 
-    auto dtraj_buff = dtraj.template mutable_unchecked<1>();
-    auto chunk_buff = chunk.template unchecked<2>();
-    auto centers_buff = centers.template unchecked<2>();
-
-#ifdef USE_OPENMP
-    /* Create a parallel thread block. */
-    omp_set_num_threads(n_threads);
-    assert(omp_get_num_threads() == n_threads);
-#endif
-#pragma omp parallel
-    {
-        for(size_t i = 0; i < N_frames; ++i) {
-            /* Parallelize distance calculations to cluster centers to avoid cache misses */
-#pragma omp for
-            for(size_t j = 0; j < N_centers; ++j) {
-                dists[j] = metric->compute(&chunk_buff(i, 0), &centers_buff(j, 0), input_dim);
-            }
-#pragma omp flush(dists)
-
-            /* Only one thread can make actual assignment */
-#pragma omp single
-            {
-                T mindist = std::numeric_limits<T>::max();
-                int argmin = -1;
-                for (size_t j = 0; j < N_centers; ++j) {
-                    if (dists[j] < mindist) {
-                        mindist = dists[j];
-                        argmin = static_cast<int>(j);
-                    }
-                }
-                dtraj_buff(i) = argmin;
-            }
-            /* Have all threads synchronize in progress through cluster assignments */
-#pragma omp barrier
-        }
-    }
+    const T* chunkPtr = chunk.data();
+    int* dtrajPtr = dtraj.mutable_data();
+
+    /* the buffers are kept alive by the caller's references, hence other Python threads may run meanwhile */
+    py::gil_scoped_release release;
+    CenterAssigner<T> assigner(centers.data(), N_centers, input_dim, metric);
+    auto block = EuclideanCenters<T>::frame_block;
+    auto n_blocks = (N_frames + block - 1) / block;
+
+    /* Every thread processes whole frame blocks and writes its own slice of the discrete trajectory without any
+     * further synchronization. */
+    parallel_for(n_blocks, static_cast<int>(n_threads), [&](std::size_t b) {
+        auto begin = b * block;
+        auto n = std::min(block, N_frames - begin);
+        assigner.assign(chunkPtr + begin * input_dim, n, dtrajPtr + begin);
+    });
     return dtraj;
 }
@@ -0,0 +1,261 @@
+//
+// Implementation of regular space clustering.
+//
+
+#pragma once
+
+#include <atomic>
+#include <cmath>
+#include <limits>
+
+#include "../regspace.h"
+
+namespace clustering {
+namespace regspace {
+
+template<typename T>
+inline Centers<T>::Centers(std::size_t dim, T dmin, const Metric *metric, unsigned int n_threads)
+        : _dim(dim), _dmin(dmin), _metric(metric), _n_threads(std::max(n_threads, 1u)),
+          _comparable_dmin(static_cast<T>(metric->comparable(dmin))),
+          _grid_dim(std::min(dim, static_cast<std::size_t>(3))) {
+    /* The cells are slightly wider than dmin, so that rounding of the cell coordinates cannot push a center within
+     * distance dmin two cells away. */
+    _cell_width = dmin * static_cast<T>(1 + 1e-5);
+    _use_grid = dynamic_cast<const EuclideanMetric*>(metric) != nullptr && dmin > 0 && _grid_dim > 0;
+    if (dynamic_cast<const MinRMSDMetric*>(metric)) {
+        _min_rmsd = std::unique_ptr<MinRMSDCenters<T>>(new MinRMSDCenters<T>(nullptr, 0, dim));
+    }
+}
+
+template<typename T>
+inline typename Centers<T>::CellKey Centers<T>::cell(const T* frame) const {
+    CellKey key {{0, 0, 0}};
+    for (std::size_t d = 0; d < _grid_dim; ++d) {
+        key[d] = static_cast<std::int64_t>(std::floor(frame[d] / _cell_width));
+    }
+    return key;
+}
+
+template<typename T>
+inline bool Centers<T>::has_neighbor_in(const std::vector<std::size_t> &candidates, const T* frame) const {
+    for (auto j : candidates) {
+        if (_metric->compare(frame, &_centers[j * _dim], _dim) <= _comparable_dmin) {
+            return true;
+        }
+    }
+    return false;
+}
+
+template<typename T>
+inline bool Centers<T>::within(const T* frame, const T* centered, double g_frame, std::size_t j) const {
+    if (_min_rmsd) {
+        return _min_rmsd->distance(centered, g_frame, j) <= _comparable_dmin;
+    }
+    return _metric->compare(frame, &_centers[j * _dim], _dim) <= _comparable_dmin;
+}
+
+template<typename T>
+inline bool Centers<T>::has_neighbor(const T* frame, bool parallel) const {
+    if (_use_grid) {
+        auto key = cell(frame);
+        CellKey offset {{-1, -1, -1}};
+        for (std::size_t d = _grid_dim; d < 3; ++d) {
+            offset[d] = 0;
+        }
+        /* iterate over the 3^grid_dim neighboring cells like an odometer */
+        while (true) {
+            CellKey neighbor {{key[0] + offset[0], key[1] + offset[1], key[2] + offset[2]}};
+            auto it = _cells.find(neighbor);
+            if (it != _cells.end() && has_neighbor_in(it->second, frame)) {
+                return true;
+            }
+            std::size_t d = 0;
+            while (d < _grid_dim && offset[d] == 1) {
+                offset[d] = -1;
+                ++d;
+            }
+            if (d == _grid_dim) {
+                return false;
+            }
+            ++offset[d];
+        }
+    }
+
+    auto n_centers = size();
+    /* for minRMSD, the frame is centered once for all centers */
+    std::vector<T> centered(_min_rmsd ? _dim : 0);
+    double g_frame = _min_rmsd ? _min_rmsd->center_frame(frame, centered.data()) : 0;
+    if (!parallel || _n_threads == 1) {
+        for (std::size_t j = 0; j < n_centers; ++j) {
+            if (within(frame, centered.data(), g_frame, j)) {
+                return true;
+            }
+        }
+        return false;
+    }
+    /* blocks of centers amortize the dispatch to the thread pool, every block stops once any center was found */
+    constexpr std::size_t block = 256;
+    std::atomic<bool> found {false};
+    parallel_for((n_centers + block - 1) / block, static_cast<int>(_n_threads), [&](std::size_t b) {
+        for (auto j = b * block; j < std::min((b + 1) * block, n_centers) && !found.load(std::memory_order_relaxed);
+             ++j) {
+            if (within(frame, centered.data(), g_frame, j)) {
+                found.store(true, std::memory_order_relaxed);
+            }
+        }
+    });
+    return found.load();
+}
+
+template<typename T>
+inline void Centers<T>::add(const T* center) {
+    if (_use_grid) {
+        _cells[cell(center)].push_back(size());
+    }
+    if (_min_rmsd) {
+        _min_rmsd->add(center);
+    }
+    _centers.insert(_centers.end(), center, center + _dim);
+}
+
+template<typename T>
+inline std::tuple<np_array<T>, bool> cluster(const np_array<T> &chunk, const np_array<T> &initial_centers, T dmin,
+                                             std::size_t maxClusters, const Metric *metric,
+                                             unsigned int n_threads) {
+    if (chunk.ndim() != 2) {
+        throw std::invalid_argument("provided chunk does not have two dimensions.");
+    }
+    auto N_frames = static_cast<std::size_t>(chunk.shape(0));
+    auto dim = static_cast<std::size_t>(chunk.shape(1));
+
+    Centers<T> centers(dim, dmin, metric, n_threads);
+    if (initial_centers.size() > 0) {
+        if (initial_centers.ndim() != 2 || static_cast<std::size_t>(initial_centers.shape(1)) != dim) {
+            throw std::invalid_argument("dimension mismatch centers and provided data.");
+        }
+        for (py::ssize_t j = 0; j < initial_centers.shape(0); ++j) {
+            centers.add(initial_centers.data(j, 0));
+        }
+    }
+
+    // do the clustering
+    bool max_reached = false;
+    const T* data = chunk.data();
+    {
+        py::gil_scoped_release release;
+        for (std::size_t i = 0; i < N_frames; ++i) {
+            if (!centers.has_neighbor(data + i * dim)) {
+                if (centers.size() + 1 > maxClusters) {
+                    max_reached = true;
+                    break;
+                }
+                // add newly found center
+                centers.add(data + i * dim);
+            }
+        }
+    }
+
+    std::vector<std::size_t> shape = {centers.size(), dim};
+    np_array<T> result(shape);
+    std::copy(centers.data().begin(), centers.data().end(), result.mutable_data());
+    return std::make_tuple(result, max_reached);
+}
+
+namespace detail {
+/** the partitioning only depends on the number of frames, which keeps the centers independent of the threads */
+static constexpr std::size_t max_partitions = 64;
+static constexpr std::size_t min_partition_size = 4096;
+}
+
+template<typename T>
+inline std::tuple<np_array<T>, bool> cluster_two_phase(const np_array<T> &chunk, const np_array<T> &initial_centers,
+                                                       T dmin, std::size_t maxClusters, const Metric *metric,
+                                                       unsigned int n_threads) {
+    if (chunk.ndim() != 2) {
+        throw std::invalid_argument("provided chunk does not have two dimensions.");
+    }
+    auto N_frames = static_cast<std::size_t>(chunk.shape(0));
+    auto dim = static_cast<std::size_t>(chunk.shape(1));
+
+    Centers<T> centers(dim, dmin, metric, n_threads);
+    if (initial_centers.size() > 0) {
+        if (initial_centers.ndim() != 2 || static_cast<std::size_t>(initial_centers.shape(1)) != dim) {
+            throw std::invalid_argument("dimension mismatch centers and provided data.");
+        }
+        for (py::ssize_t j = 0; j < initial_centers.shape(0); ++j) {
+            centers.add(initial_centers.data(j, 0));
+        }
+    }
+
+    bool max_reached = false;
+    const T* data = chunk.data();
+    {
+        py::gil_scoped_release release;
+        auto n_partitions = std::max(static_cast<std::size_t>(1),
+                                     std::min(detail::max_partitions, N_frames / detail::min_partition_size));
+        auto partition_size = (N_frames + n_partitions - 1) / n_partitions;
+
+        /* phase one: leader algorithm on each partition, skipping frames which are covered by the initial centers.
+         * A partition stops after max_clusters candidates, the remaining frames are covered by the last phase. */
+        std::vector<std::vector<std::size_t>> candidates(n_partitions);
+        parallel_for(n_partitions, static_cast<int>(n_threads), [&](std::size_t p) {
+            Centers<T> local(dim, dmin, metric, 1);
+            for (auto i = p * partition_size; i < std::min((p + 1) * partition_size, N_frames); ++i) {
+                const T* frame = data + i * dim;
+                if (local.has_neighbor(frame) || centers.has_neighbor(frame, false)) {
+                    continue;
+                }
+                if (local.size() >= maxClusters) {
+                    break;
+                }
+                local.add(frame);
+                candidates[p].push_back(i);
+            }
+        });
+
+        /* phase two: merge the candidates in the order of the frames */
+        auto add_if_uncovered = [&](std::size_t i) {
+            const T* frame = data + i * dim;
+            if (!centers.has_neighbor(frame)) {
+                if (centers.size() + 1 > maxClusters) {
+                    max_reached = true;
+                } else {
+                    centers.add(frame);
+                }
+            }
+            return !max_reached;
+        };
+        for (std::size_t p = 0; p < n_partitions && !max_reached; ++p) {
+            for (auto i : candidates[p]) {
+                if (!add_if_uncovered(i)) break;
+            }
+        }
+
+        /* phase three: run the leader algorithm on the frames which are not covered by any center */
+        if (!max_reached) {
+            auto n_blocks = (N_frames + detail::min_partition_size - 1) / detail::min_partition_size;
+            std::vector<std::vector<std::size_t>> uncovered(n_blocks);
+            parallel_for(n_blocks, static_cast<int>(n_threads), [&](std::size_t b) {
+                auto end = std::min((b + 1) * detail::min_partition_size, N_frames);
+                for (auto i = b * detail::min_partition_size; i < end; ++i) {
+                    if (!centers.has_neighbor(data + i * dim, false)) {
+                        uncovered[b].push_back(i);
+                    }
+                }
+            });
+            for (std::size_t b = 0; b < n_blocks && !max_reached; ++b) {
+                for (auto i : uncovered[b]) {
+                    if (!add_if_uncovered(i)) break;
+                }
+            }
+        }
+    }
+
+    std::vector<std::size_t> shape = {centers.size(), dim};
+    np_array<T> result(shape);
+    std::copy(centers.data().begin(), centers.data().end(), result.mutable_data());
+    return std::make_tuple(result, max_reached);
+}
+
+}
+}
@@ -0,0 +1,387 @@
+//
+// Implementation of the vectorized distance kernels and their runtime dispatch.
+//
+
+#pragma once
+
+#include <cstdlib>
+#include <cstring>
+#include <initializer_list>
+
+#include "../simd.h"
+
+#if defined(__x86_64__) && (defined(__GNUC__) || defined(__clang__))
+#define SKTIME_SIMD_X86 1
+#include <immintrin.h>
+#endif
+
+namespace clustering {
+namespace simd {
+
+namespace detail {
+
+template<typename T>
+struct Kernels {
+    T (*squared_euclidean)(const T*, const T*, std::size_t);
+    void (*tile_products)(const T*, const T*, std::size_t, T*);
+};
+
+template<typename T>
+inline T squared_euclidean_portable(const T* xs, const T* ys, std::size_t dim) {
+    T sum = 0;
+    #pragma omp simd reduction(+:sum)
+    for (std::size_t i = 0; i < dim; ++i) {
+        auto d = xs[i] - ys[i];
+        sum += d * d;
+    }
+    return sum;
+}
+
+template<typename T>
+inline void tile_products_portable(const T* rows, const T* packed, std::size_t dim, T* acc) {
+    constexpr auto width = Tile<T>::width;
+    for (std::size_t d = 0; d < dim; ++d) {
+        const T* c = packed + d * width;
+        for (std::size_t r = 0; r < Tile<T>::rows; ++r) {
+            const T x = rows[r * dim + d];
+            #pragma omp simd
+            for (std::size_t j = 0; j < width; ++j) {
+                acc[r * width + j] += x * c[j];
+            }
+        }
+    }
+}
+
+#ifdef SKTIME_SIMD_X86
+
+/* SSE2 is part of the x86-64 baseline, the remaining instruction sets are enabled per function */
+
+inline float squared_euclidean_sse2(const float* xs, const float* ys, std::size_t dim) {
+    __m128 sum = _mm_setzero_ps();
+    std::size_t i = 0;
+    for (; i + 4 <= dim; i += 4) {
+        __m128 d = _mm_sub_ps(_mm_loadu_ps(xs + i), _mm_loadu_ps(ys + i));
+        sum = _mm_add_ps(sum, _mm_mul_ps(d, d));
+    }
+    float lanes[4];
+    _mm_storeu_ps(lanes, sum);
+    float result = (lanes[0] + lanes[1]) + (lanes[2] + lanes[3]);
+    for (; i < dim; ++i) {
+        float d = xs[i] - ys[i];
+        result += d * d;
+    }
+    return result;
+}
+
+inline double squared_euclidean_sse2(const double* xs, const double* ys, std::size_t dim) {
+    __m128d sum = _mm_setzero_pd();
+    std::size_t i = 0;
+    for (; i + 2 <= dim; i += 2) {
+        __m128d d = _mm_sub_pd(_mm_loadu_pd(xs + i), _mm_loadu_pd(ys + i));
+        sum = _mm_add_pd(sum, _mm_mul_pd(d, d));
+    }
+    double lanes[2];
+    _mm_storeu_pd(lanes, sum);
+    double result = lanes[0] + lanes[1];
+    for (; i < dim; ++i) {
+        double d = xs[i] - ys[i];
+        result += d * d;
+    }
+    return result;
+}
+
+inline void tile_products_sse2(const float* rows, const float* packed, std::size_t dim, float* acc) {
+    constexpr auto width = Tile<float>::width;
+    for (std::size_t r = 0; r < Tile<float>::rows; ++r) {
+        __m128 a0 = _mm_loadu_ps(acc + r * width), a1 = _mm_loadu_ps(acc + r * width + 4);
+        __m128 a2 = _mm_loadu_ps(acc + r * width + 8), a3 = _mm_loadu_ps(acc + r * width + 12);
+        for (std::size_t d = 0; d < dim; ++d) {
+            const float* c = packed + d * width;
+            __m128 x = _mm_set1_ps(rows[r * dim + d]);
+            a0 = _mm_add_ps(a0, _mm_mul_ps(x, _mm_loadu_ps(c)));
+            a1 = _mm_add_ps(a1, _mm_mul_ps(x, _mm_loadu_ps(c + 4)));
+            a2 = _mm_add_ps(a2, _mm_mul_ps(x, _mm_loadu_ps(c + 8)));
+            a3 = _mm_add_ps(a3, _mm_mul_ps(x, _mm_loadu_ps(c + 12)));
+        }
+        _mm_storeu_ps(acc + r * width, a0);
+        _mm_storeu_ps(acc + r * width + 4, a1);
+        _mm_storeu_ps(acc + r * width + 8, a2);
+        _mm_storeu_ps(acc + r * width + 12, a3);
+    }
+}
+
+inline void tile_products_sse2(const double* rows, const double* packed, std::size_t dim, double* acc) {
+    constexpr auto width = Tile<double>::width;
+    for (std::size_t r = 0; r < Tile<double>::rows; ++r) {
+        __m128d a0 = _mm_loadu_pd(acc + r * width), a1 = _mm_loadu_pd(acc + r * width + 2);
+        __m128d a2 = _mm_loadu_pd(acc + r * width + 4), a3 = _mm_loadu_pd(acc + r * width + 6);
+        for (std::size_t d = 0; d < dim; ++d) {
+            const double* c = packed + d * width;
+            __m128d x = _mm_set1_pd(rows[r * dim + d]);
+            a0 = _mm_add_pd(a0, _mm_mul_pd(x, _mm_loadu_pd(c)));
+            a1 = _mm_add_pd(a1, _mm_mul_pd(x, _mm_loadu_pd(c + 2)));
+            a2 = _mm_add_pd(a2, _mm_mul_pd(x, _mm_loadu_pd(c + 4)));
+            a3 = _mm_add_pd(a3, _mm_mul_pd(x, _mm_loadu_pd(c + 6)));
+        }
+        _mm_storeu_pd(acc + r * width, a0);
+        _mm_storeu_pd(acc + r * width + 2, a1);
+        _mm_storeu_pd(acc + r * width + 4, a2);
+        _mm_storeu_pd(acc + r * width + 6, a3);
+    }
+}
+
+__attribute__((target("avx2,fma")))
+inline float squared_euclidean_avx2(const float* xs, const float* ys, std::size_t dim) {
+    __m256 sum0 = _mm256_setzero_ps(), sum1 = _mm256_setzero_ps();
+    std::size_t i = 0;
+    for (; i + 16 <= dim; i += 16) {
+        __m256 d0 = _mm256_sub_ps(_mm256_loadu_ps(xs + i), _mm256_loadu_ps(ys + i));
+        __m256 d1 = _mm256_sub_ps(_mm256_loadu_ps(xs + i + 8), _mm256_loadu_ps(ys + i + 8));
+        sum0 = _mm256_fmadd_ps(d0, d0, sum0);
+        sum1 = _mm256_fmadd_ps(d1, d1, sum1);
+    }
+    for (; i + 8 <= dim; i += 8) {
+        __m256 d = _mm256_sub_ps(_mm256_loadu_ps(xs + i), _mm256_loadu_ps(ys + i));
+        sum0 = _mm256_fmadd_ps(d, d, sum0);
+    }
+    __m256 sum = _mm256_add_ps(sum0, sum1);
+    __m128 half = _mm_add_ps(_mm256_castps256_ps128(sum), _mm256_extractf128_ps(sum, 1));
+    half = _mm_add_ps(half, _mm_movehl_ps(half, half));
+    half = _mm_add_ss(half, _mm_shuffle_ps(half, half, 1));
+    float result = _mm_cvtss_f32(half);
+    for (; i < dim; ++i) {
+        float d = xs[i] - ys[i];
+        result += d * d;
+    }
+    return result;
+}
+
+__attribute__((target("avx2,fma")))
+inline double squared_euclidean_avx2(const double* xs, const double* ys, std::size_t dim) {
+    __m256d sum0 = _mm256_setzero_pd(), sum1 = _mm256_setzero_pd();
+    std::size_t i = 0;
+    for (; i + 8 <= dim; i += 8) {
+        __m256d d0 = _mm256_sub_pd(_mm256_loadu_pd(xs + i), _mm256_loadu_pd(ys + i));
+        __m256d d1 = _mm256_sub_pd(_mm256_loadu_pd(xs + i + 4), _mm256_loadu_pd(ys + i + 4));
+        sum0 = _mm256_fmadd_pd(d0, d0, sum0);
+        sum1 = _mm256_fmadd_pd(d1, d1, sum1);
+    }
+    for (; i + 4 <= dim; i += 4) {
+        __m256d d = _mm256_sub_pd(_mm256_loadu_pd(xs + i), _mm256_loadu_pd(ys + i));
+        sum0 = _mm256_fmadd_pd(d, d, sum0);
+    }
+    __m256d sum = _mm256_add_pd(sum0, sum1);
+    __m128d half = _mm_add_pd(_mm256_castpd256_pd128(sum), _mm256_extractf128_pd(sum, 1));
+    double result = _mm_cvtsd_f64(_mm_add_sd(half, _mm_unpackhi_pd(half, half)));
+    for (; i < dim; ++i) {
+        double d = xs[i] - ys[i];
+        result += d * d;
+    }
+    return result;
+}
+
+__attribute__((target("avx2,fma")))
+inline void tile_products_avx2(const float* rows, const float* packed, std::size_t dim, float* acc) {
+    constexpr auto width = Tile<float>::width;
+    __m256 a[Tile<float>::rows][2];
+    for (std::size_t r = 0; r < Tile<float>::rows; ++r) {
+        a[r][0] = _mm256_loadu_ps(acc + r * width);
+        a[r][1] = _mm256_loadu_ps(acc + r * width + 8);
+    }
+    for (std::size_t d = 0; d < dim; ++d) {
+        __m256 c0 = _mm256_loadu_ps(packed + d * width);
+        __m256 c1 = _mm256_loadu_ps(packed + d * width + 8);
+        for (std::size_t r = 0; r < Tile<float>::rows; ++r) {
+            __m256 x = _mm256_set1_ps(rows[r * dim + d]);
+            a[r][0] = _mm256_fmadd_ps(x, c0, a[r][0]);
+            a[r][1] = _mm256_fmadd_ps(x, c1, a[r][1]);
+        }
+    }
+    for (std::size_t r = 0; r < Tile<float>::rows; ++r) {
+        _mm256_storeu_ps(acc + r * width, a[r][0]);
+        _mm256_storeu_ps(acc + r * width + 8, a[r][1]);
+    }
+}
+
+__attribute__((target("avx2,fma")))
+inline void tile_products_avx2(const double* rows, const double* packed, std::size_t dim, double* acc) {
+    constexpr auto width = Tile<double>::width;
+    __m256d a[Tile<double>::rows][2];
+    for (std::size_t r = 0; r < Tile<double>::rows; ++r) {
+        a[r][0] = _mm256_loadu_pd(acc + r * width);
+        a[r][1] = _mm256_loadu_pd(acc + r * width + 4);
+    }
+    for (std::size_t d = 0; d < dim; ++d) {
+        __m256d c0 = _mm256_loadu_pd(packed + d * width);
+        __m256d c1 = _mm256_loadu_pd(packed + d * width + 4);
+        for (std::size_t r = 0; r < Tile<double>::rows; ++r) {
+            __m256d x = _mm256_set1_pd(rows[r * dim + d]);
+            a[r][0] = _mm256_fmadd_pd(x, c0, a[r][0]);
+            a[r][1] = _mm256_fmadd_pd(x, c1, a[r][1]);
+        }
+    }
+    for (std::size_t r = 0; r < Tile<double>::rows; ++r) {
+        _mm256_storeu_pd(acc + r * width, a[r][0]);
+        _mm256_storeu_pd(acc + r * width + 4, a[r][1]);
+    }
+}
+
+__attribute__((target("avx512f")))
+inline float squared_euclidean_avx512(const float* xs, const float* ys, std::size_t dim) {
+    __m512 sum = _mm512_setzero_ps();
+    std::size_t i = 0;
+    for (; i + 16 <= dim; i += 16) {
+        __m512 d = _mm512_sub_ps(_mm512_loadu_ps(xs + i), _mm512_loadu_ps(ys + i));
+        sum = _mm512_fmadd_ps(d, d, sum);
+    }
+    if (i < dim) {
+        /* masked loads read zeros beyond the end of the vectors */
+        auto mask = static_cast<__mmask16>((1u << (dim - i)) - 1u);
+        __m512 d = _mm512_sub_ps(_mm512_maskz_loadu_ps(mask, xs + i), _mm512_maskz_loadu_ps(mask, ys + i));
+        sum = _mm512_fmadd_ps(d, d, sum);
+    }
+    return _mm512_reduce_add_ps(sum);
+}
+
+__attribute__((target("avx512f")))
+inline double squared_euclidean_avx512(const double* xs, const double* ys, std::size_t dim) {
+    __m512d sum = _mm512_setzero_pd();
+    std::size_t i = 0;
+    for (; i + 8 <= dim; i += 8) {
+        __m512d d = _mm512_sub_pd(_mm512_loadu_pd(xs + i), _mm512_loadu_pd(ys + i));
+        sum = _mm512_fmadd_pd(d, d, sum);
+    }
+    if (i < dim) {
+        auto mask = static_cast<__mmask8>((1u << (dim - i)) - 1u);
+        __m512d d = _mm512_sub_pd(_mm512_maskz_loadu_pd(mask, xs + i), _mm512_maskz_loadu_pd(mask, ys + i));
+        sum = _mm512_fmadd_pd(d, d, sum);
+    }
+    return _mm512_reduce_add_pd(sum);
+}
+
+__attribute__((target("avx512f")))
+inline void tile_products_avx512(const float* rows, const float* packed, std::size_t dim, float* acc) {
+    constexpr auto width = Tile<float>::width;
+    __m512 a[Tile<float>::rows];
+    for (std::size_t r = 0; r < Tile<float>::rows; ++r) {
+        a[r] = _mm512_loadu_ps(acc + r * width);
+    }
+    for (std::size_t d = 0; d < dim; ++d) {
+        __m512 c = _mm512_loadu_ps(packed + d * width);
+        for (std::size_t r = 0; r < Tile<float>::rows; ++r) {
+            a[r] = _mm512_fmadd_ps(_mm512_set1_ps(rows[r * dim + d]), c, a[r]);
+        }
+    }
+    for (std::size_t r = 0; r < Tile<float>::rows; ++r) {
+        _mm512_storeu_ps(acc + r * width, a[r]);
+    }
+}
+
+__attribute__((target("avx512f")))
+inline void tile_products_avx512(const double* rows, const double* packed, std::size_t dim, double* acc) {
+    constexpr auto width = Tile<double>::width;
+    __m512d a[Tile<double>::rows];
+    for (std::size_t r = 0; r < Tile<double>::rows; ++r) {
+        a[r] = _mm512_loadu_pd(acc + r * width);
+    }
+    for (std::size_t d = 0; d < dim; ++d) {
+        __m512d c = _mm512_loadu_pd(packed + d * width);
+        for (std::size_t r = 0; r < Tile<double>::rows; ++r) {
+            a[r] = _mm512_fmadd_pd(_mm512_set1_pd(rows[r * dim + d]), c, a[r]);
+        }
+    }
+    for (std::size_t r = 0; r < Tile<double>::rows; ++r) {
+        _mm512_storeu_pd(acc + r * width, a[r]);
+    }
+}
+
+inline InstructionSet detect_instruction_set() {
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx512f")) {
+        return InstructionSet::avx512;
+    }
+    if (__builtin_cpu_supports("avx2") && __builtin_cpu_supports("fma")) {
+        return InstructionSet::avx2;
+    }
+    return InstructionSet::sse2;
+}
+
+#else
+
+inline InstructionSet detect_instruction_set() {
+    return InstructionSet::portable;
+}
+
+#endif
+
+inline InstructionSet select_instruction_set() {
+    auto isa = detect_instruction_set();
+    if (const char* cap = std::getenv("SKTIME_SIMD")) {
+        for (auto candidate : {InstructionSet::portable, InstructionSet::sse2, InstructionSet::avx2,
+                               InstructionSet::avx512}) {
+            if (std::strcmp(cap, name(candidate)) == 0 && candidate < isa) {
+                isa = candidate;
+            }
+        }
+    }
+    return isa;
+}
+
+template<typename T>
+inline Kernels<T> select_kernels() {
+    Kernels<T> kernels {&squared_euclidean_portable<T>, &tile_products_portable<T>};
+#ifdef SKTIME_SIMD_X86
+    switch (instruction_set()) {
+        case InstructionSet::avx512:
+            kernels.squared_euclidean = &squared_euclidean_avx512;
+            kernels.tile_products = &tile_products_avx512;
+            break;
+        case InstructionSet::avx2:
+            kernels.squared_euclidean = &squared_euclidean_avx2;
+            kernels.tile_products = &tile_products_avx2;
+            break;
+        case InstructionSet::sse2:
+            kernels.squared_euclidean = &squared_euclidean_sse2;
+            kernels.tile_products = &tile_products_sse2;
+            break;
+        case InstructionSet::portable:
+            break;
+    }
+#endif
+    return kernels;
+}
+
+template<typename T>
+inline const Kernels<T> &kernels() {
+    static const Kernels<T> selected = select_kernels<T>();
+    return selected;
+}
+
+}
+
+inline InstructionSet instruction_set() {
+    static const InstructionSet isa = detail::select_instruction_set();
+    return isa;
+}
+
+inline const char* name(InstructionSet isa) {
+    switch (isa) {
+        case InstructionSet::sse2: return "sse2";
+        case InstructionSet::avx2: return "avx2";
+        case InstructionSet::avx512: return "avx512";
+        default: return "portable";
+    }
+}
+
+template<typename T>
+inline T squared_euclidean(const T* xs, const T* ys, std::size_t dim) {
+    return detail::kernels<T>().squared_euclidean(xs, ys, dim);
+}
+
+template<typename T>
+inline void tile_products(const T* rows, const T* packed, std::size_t dim, T* acc) {
+    detail::kernels<T>().tile_products(rows, packed, dim, acc);
+}
+
+}
+}
@@ -4,9 +4,23 @@
 
 #pragma once
 
+#include <algorithm>
+#include <atomic>
+#include <condition_variable>
+#include <cstddef>
+#include <deque>
+#include <exception>
+#include <functional>
+#include <memory>
+#include <mutex>
 #include <stdexcept>
 #include <thread>
 #include <utility>
+#include <vector>
+
+#if defined(__unix__) || defined(__APPLE__)
+#include <pthread.h>
+#endif
 
 /**
  * scoped_thread implementation
@@ -61,3 +75,222 @@ public:
      */
     scoped_thread &operator=(const scoped_thread &) = delete;
 };
+
+/**
+ * Process-wide pool of persistent worker threads shared by all clustering kernels. A parallel loop splits its
+ * iterations into one contiguous range per participating thread, the calling thread being one of them. Threads that
+ * ran out of work steal the upper half of the largest remaining range. The pool grows on demand up to the largest
+ * number of threads ever requested and is never shrunk, so repeated calls on small chunks do not pay for thread
+ * creation. Loops may be issued concurrently from several threads as well as from within a loop body.
+ */
+class ThreadPool {
+public:
+    static ThreadPool &instance() {
+        static std::once_flag flag;
+        std::call_once(flag, []() {
+#if defined(__unix__) || defined(__APPLE__)
+            /* worker threads do not survive a fork, the child starts over with an empty pool */
+            pthread_atfork(nullptr, nullptr, []() { pointer() = new ThreadPool(); });
+#endif
+        });
+        return *pointer();
+    }
+
+    /**
+     * Calls fun(i) for all i in [0, n) on up to n_threads threads and returns once all iterations are done. With
+     * n_threads <= 1 the iterations are performed in order on the calling thread. If an iteration throws, the
+     * remaining iterations are skipped and the first exception is rethrown.
+     */
+    template<typename Function>
+    void parallel_for(std::size_t n, int n_threads, Function &&fun) {
+        auto n_slots = std::min(n, static_cast<std::size_t>(std::max(n_threads, 1)));
+        if (n_slots <= 1) {
+            for (std::size_t i = 0; i < n; ++i) {
+                fun(i);
+            }
+            return;
+        }
+        auto job = std::make_shared<Job>(n, n_slots, std::function<void(std::size_t)>(std::ref(fun)));
+        {
+            std::lock_guard<std::mutex> lock(_mutex);
+            while (_workers.size() < n_slots - 1) {
+                _workers.emplace_back([this]() { work(); });
+                _workers.back().detach();
+            }
+            _jobs.push_back(job);
+        }
+        _cv.notify_all();
+
+        job->run(0);
+        {
+            std::lock_guard<std::mutex> lock(_mutex);
+            auto it = std::find(_jobs.begin(), _jobs.end(), job);
+            if (it != _jobs.end()) {
+                _jobs.erase(it);
+            }
+        }
+        job->wait();
+    }
+
+    std::size_t n_workers() const {
+        std::lock_guard<std::mutex> lock(_mutex);
+        return _workers.size();
+    }
+
+private:
+    ThreadPool() = default;
+
+    /* the pool is intentionally leaked, detached workers may still wait on it during interpreter shutdown */
+    static ThreadPool *&pointer() {
+        static ThreadPool *pool = new ThreadPool();
+        return pool;
+    }
+
+    struct Range {
+        std::mutex mutex;
+        std::size_t begin {0}, end {0};
+    };
+
+    class Job {
+    public:
+        Job(std::size_t n, std::size_t n_slots, std::function<void(std::size_t)> fun)
+                : _fun(std::move(fun)), _n_slots(n_slots), _ranges(new Range[n_slots]), _remaining(n) {
+            for (std::size_t s = 0; s < n_slots; ++s) {
+                _ranges[s].begin = s * n / n_slots;
+                _ranges[s].end = (s + 1) * n / n_slots;
+            }
+        }
+
+        /**
+         * Whether there are free slots for further threads, the first slot belongs to the calling thread.
+         */
+        bool wants_helper() const {
+            return _next_slot.load() < _n_slots;
+        }
+
+        /**
+         * Claims a free slot, which comes with a share of the iterations, and works until no iterations are left.
+         */
+        void help() {
+            auto slot = _next_slot.fetch_add(1);
+            if (slot < _n_slots) {
+                run(slot);
+            }
+        }
+
+        void run(std::size_t slot) {
+            std::size_t i;
+            while (pop(slot, i) || steal(slot, i)) {
+                if (!_failed.load()) {
+                    try {
+                        _fun(i);
+                    } catch (...) {
+                        std::lock_guard<std::mutex> lock(_done_mutex);
+                        if (!_error) {
+                            _error = std::current_exception();
+                        }
+                        _failed.store(true);
+                    }
+                }
+                if (_remaining.fetch_sub(1) == 1) {
+                    std::lock_guard<std::mutex> lock(_done_mutex);
+                    _done.notify_all();
+                }
+            }
+        }
+
+        void wait() {
+            std::unique_lock<std::mutex> lock(_done_mutex);
+            _done.wait(lock, [this]() { return _remaining.load() == 0; });
+            if (_error) {
+                std::rethrow_exception(_error);
+            }
+        }
+
+    private:
+        bool pop(std::size_t slot, std::size_t &i) {
+            std::lock_guard<std::mutex> lock(_ranges[slot].mutex);
+            if (_ranges[slot].begin < _ranges[slot].end) {
+                i = _ranges[slot].begin++;
+                return true;
+            }
+            return false;
+        }
+
+        bool steal(std::size_t slot, std::size_t &i) {
+            while (true) {
+                /* pick the victim with the most remaining iterations, sizes are only a hint until locked */
+                std::size_t victim = _n_slots, largest = 0;
+                for (std::size_t s = 0; s < _n_slots; ++s) {
+                    std::lock_guard<std::mutex> lock(_ranges[s].mutex);
+                    auto size = _ranges[s].end - _ranges[s].begin;
+                    if (s != slot && size > largest) {
+                        largest = size;
+                        victim = s;
+                    }
+                }
+                if (victim == _n_slots) {
+                    return false;
+                }
+                std::size_t begin, end;
+                {
+                    std::lock_guard<std::mutex> lock(_ranges[victim].mutex);
+                    auto &range = _ranges[victim];
+                    if (range.begin >= range.end) {
+                        continue;
+                    }
+                    auto mid = range.begin + (range.end - range.begin) / 2;
+                    begin = mid;
+                    end = range.end;
+                    range.end = mid;
+                }
+                std::lock_guard<std::mutex> lock(_ranges[slot].mutex);
+                i = begin;
+                _ranges[slot].begin = begin + 1;
+                _ranges[slot].end = end;
+                return true;
+            }
+        }
+
+        std::function<void(std::size_t)> _fun;
+        std::size_t _n_slots;
+        std::unique_ptr<Range[]> _ranges;
+        std::atomic<std::size_t> _next_slot {1};
+        std::atomic<std::size_t> _remaining;
+        std::atomic<bool> _failed {false};
+        std::exception_ptr _error;
+        std::mutex _done_mutex;
+        std::condition_variable _done;
+    };
+
+    void work() {
+        while (true) {
+            std::shared_ptr<Job> job;
+            {
+                std::unique_lock<std::mutex> lock(_mutex);
+                _cv.wait(lock, [this]() { return !_jobs.empty(); });
+                job = _jobs.front();
+                _jobs.pop_front();
+                /* keep the job available to other workers as long as it has free slots */
+                if (job->wants_helper()) {
+                    _jobs.push_back(job);
+                }
+            }
+            job->help();
+        }
+    }
+
+    mutable std::mutex _mutex;
+    std::condition_variable _cv;
+    std::deque<std::shared_ptr<Job>> _jobs;
+    std::vector<std::thread> _workers;
+};
+
+/**
+ * Calls fun(i) for all i in [0, n) on up to n_threads threads of the shared ThreadPool. With n_threads <= 1 the
+ * iterations are performed in order on the calling thread.
+ */
+template<typename Function>
+void parallel_for(std::size_t n, int n_threads, Function &&fun) {
+    ThreadPool::instance().parallel_for(n, n_threads, std::forward<Function>(fun));
+}
@@ -0,0 +1,77 @@
+//
+// KD-tree over cluster centers for nearest center queries in low dimensions.
+//
+
+#pragma once
+
+#include <vector>
+
+#include "common.h"
+
+namespace clustering {
+namespace spatial {
+
+/**
+ * KD-tree over a set of cluster centers answering euclidean nearest center queries. The tree splits the widest
+ * dimension of each node at its median until at most leaf_size centers are left. A query descends into the child on
+ * the side of the frame first and only visits further nodes whose bounding box is not farther away than the closest
+ * center found so far. For few dimensions and many centers this is much faster than a brute force search.
+ * Ties are resolved in favor of the center with the smaller index, like the brute force assignment does.
+ */
+template<typename T>
+class KDTree {
+public:
+    KDTree(const T* centers, std::size_t n_centers, std::size_t dim, std::size_t leaf_size = 16);
+
+    /**
+     * Finds the closest center for each of the given frames. This method is not parallelized itself, so that
+     * callers can distribute blocks of frames across threads.
+     * @param chunk pointer to frames, shape (n_frames, dim)
+     * @param n_frames number of frames
+     * @param assignments output, index of the closest center per frame
+     * @param sq_dists optional output, squared distance to the closest center per frame
+     */
+    void query(const T* chunk, std::size_t n_frames, int* assignments, T* sq_dists = nullptr) const;
+
+    /** the centers in their original order */
+    std::vector<T> centers() const;
+
+    std::size_t n_centers() const { return _indices.size(); }
+    std::size_t dim() const { return _dim; }
+    std::size_t leaf_size() const { return _leaf_size; }
+    std::size_t n_nodes() const { return _nodes.size(); }
+
+private:
+    struct Node {
+        std::size_t begin, end;
+        std::size_t split_dim;
+        T split;
+        /** child node indices, both are zero for leaves */
+        std::size_t left, right;
+    };
+
+    std::size_t build(std::vector<std::size_t> &order, std::size_t begin, std::size_t end);
+    T box_distance(std::size_t node, const T* frame) const;
+    void search(std::size_t node, const T* frame, T &best, std::size_t &best_ix) const;
+
+    std::size_t _dim, _leaf_size;
+    /** centers reordered such that each node covers a contiguous range */
+    std::vector<T> _points;
+    /** original index of each reordered center */
+    std::vector<std::size_t> _indices;
+    /** bounding boxes of the nodes, shape (n_nodes, dim) each */
+    std::vector<T> _lower, _upper;
+    std::vector<Node> _nodes;
+};
+
+/**
+ * Assigns a chunk of frames to the closest centers stored in the tree.
+ * @return the discrete trajectory
+ */
+template<typename T>
+np_array<int> query_nearest(const KDTree<T> &tree, const np_array<T> &chunk, int n_threads);
+
+}
+}
+
+#include "bits/kdtree_bits.h"
@@ -13,19 +13,56 @@ namespace clustering {
 namespace kmeans {
 
 template<typename T>
-np_array<T> cluster(const np_array<T> & /*np_chunk*/, const np_array<T> & /*np_centers*/, int /*n_threads*/,
-                    const Metric *metric);
+std::tuple<np_array<T>, T> cluster(const np_array<T> & /*np_chunk*/, const np_array<T> & /*np_centers*/,
+                                   int /*n_threads*/, const Metric *metric, const T* weights = nullptr);
 template<typename T>
-std::tuple<np_array<T>, int, int, T> cluster_loop(const np_array<T>& np_chunk, const np_array<T>& np_centers,
-                                                  std::size_t k, const Metric *metric,
-                                                  int n_threads, int max_iter, T tolerance,
-                                                  py::object& callback);
+std::tuple<np_array<T>, int, int, T, np_array<int>> cluster_loop(const np_array<T>& np_chunk,
+                                                                 const np_array<T>& np_centers,
+                                                                 std::size_t k, const Metric *metric,
+                                                                 int n_threads, int max_iter, T tolerance,
+                                                                 py::object& callback,
+                                                                 bool return_assignments = false,
+                                                                 const T* weights = nullptr);
 template<typename T>
-T costFunction(const np_array<T>& np_data, const np_array<T>& np_centers, const Metric *metric, int n_threads);
+std::tuple<np_array<T>, int, int, T, np_array<int>> cluster_loop_hamerly(const np_array<T>& np_chunk,
+                                                                         const np_array<T>& np_centers,
+                                                                         const Metric *metric, int n_threads,
+                                                                         int max_iter, py::object& callback,
+                                                                         bool return_assignments = false,
+                                                                         const T* weights = nullptr);
+template<typename T>
+std::tuple<np_array<T>, np_array<std::int64_t>, double> accumulate(const np_array<T>& np_chunk,
+                                                                  const np_array<T>& np_centers,
+                                                                  int n_threads, const Metric *metric);
+template<typename T>
+std::tuple<np_array<T>, np_array<double>, T> minibatchStep(const np_array<T>& np_batch,
+                                                           const np_array<T>& np_centers,
+                                                           const np_array<double>& np_counts,
+                                                           int n_threads, const Metric *metric,
+                                                           const T* weights = nullptr);
+template<typename T>
+T costFunction(const np_array<T>& np_data, const np_array<T>& np_centers, const Metric *metric, int n_threads,
+               const T* weights = nullptr);
 
 template<typename T>
 np_array<T> initCentersKMpp(const np_array<T>& np_data, std::size_t k, const Metric *metric,
-                            unsigned int random_seed, int n_threads, py::object& callback);
+                            unsigned int random_seed, int n_threads, py::object& callback,
+                            const T* weights = nullptr);
+
+template<typename T>
+np_array<T> initCentersKMeansParallel(const np_array<T>& np_data, std::size_t k, const Metric *metric,
+                                      unsigned int random_seed, int n_threads, py::object& callback,
+                                      double oversampling_factor = 2., std::size_t n_rounds = 5,
+                                      const T* weights = nullptr);
+
+template<typename T>
+np_array<int> assignTree(const np_array<T>& np_chunk, const np_array<T>& np_node_centers,
+                         const np_array<int>& np_children, const np_array<int>& np_leaf_labels,
+                         int n_threads, const Metric *metric);
+
+template<typename T>
+np_array<double> coresetSensitivities(const np_array<T>& np_data, const np_array<T>& np_centers,
+                                      const Metric *metric, int n_threads, const T* weights = nullptr);
 
 }
 }
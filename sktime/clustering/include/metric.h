@@ -4,13 +4,16 @@
 
 #pragma once
 
+#include <algorithm>
 #include <cstddef>
 #include <cstring>
 #include <stdexcept>
 #include <cmath>
 #include <vector>
+#include <memory>
 
 #include "common.h"
+#include "simd.h"
 
 namespace py = pybind11;
 
@@ -20,36 +23,218 @@ public:
     virtual double compute_d(const double* xs, const double* ys, std::size_t dim) const = 0;
     virtual float compute_f(const float* xs, const float* ys, std::size_t dim) const = 0;
 
+    /**
+     * Comparable distance, i.e., a cheaper quantity that is monotonic in the distance. It is sufficient for
+     * searching the closest point and defaults to the distance itself.
+     */
+    virtual double compare_d(const double* xs, const double* ys, std::size_t dim) const {
+        return compute_d(xs, ys, dim);
+    }
+
+    virtual float compare_f(const float* xs, const float* ys, std::size_t dim) const {
+        return compute_f(xs, ys, dim);
+    }
+
+    /**
+     * Maps a distance, e.g., a threshold, onto the scale of the comparable distance.
+     */
+    virtual double comparable(double distance) const {
+        return distance;
+    }
+
     template<typename T>
     T compute(const T* xs, const T* ys, std::size_t dim) const {
         return compute_d(xs, ys, dim);
     }
+
+    template<typename T>
+    T compare(const T* xs, const T* ys, std::size_t dim) const {
+        return compare_d(xs, ys, dim);
+    }
 };
 
 class EuclideanMetric : public Metric {
 public:
 
     double compute_d(const double *xs, const double *ys, std::size_t dim) const override {
-        return _compute(xs, ys, dim);
+        return std::sqrt(clustering::simd::squared_euclidean(xs, ys, dim));
     }
 
     float compute_f(const float *xs, const float *ys, std::size_t dim) const override {
+        return std::sqrt(clustering::simd::squared_euclidean(xs, ys, dim));
+    }
+
+    /* the squared distance skips the square root */
+    double compare_d(const double *xs, const double *ys, std::size_t dim) const override {
+        return clustering::simd::squared_euclidean(xs, ys, dim);
+    }
+
+    float compare_f(const float *xs, const float *ys, std::size_t dim) const override {
+        return clustering::simd::squared_euclidean(xs, ys, dim);
+    }
+
+    double comparable(double distance) const override {
+        return distance * distance;
+    }
+};
+
+/**
+ * Minimal root mean square deviation of two conformations over all rigid body superpositions, evaluated with the
+ * quaternion characteristic polynomial (QCP) method of Theobald (2005) and Liu et al. (2010). Frames are flattened
+ * cartesian coordinates (x1, y1, z1, x2, ...) of dim / 3 atoms.
+ */
+class MinRMSDMetric : public Metric {
+public:
+
+    double compute_d(const double *xs, const double *ys, std::size_t dim) const override {
         return _compute(xs, ys, dim);
     }
 
+    float compute_f(const float *xs, const float *ys, std::size_t dim) const override {
+        return static_cast<float>(_compute(xs, ys, dim));
+    }
+
+    /**
+     * Minimal RMSD from the inner products of two centered conformations.
+     * @param m the 3x3 matrix sum_i x_i y_i^T, row major
+     * @param g_x sum of squared norms of the centered coordinates x_i
+     * @param g_y sum of squared norms of the centered coordinates y_i
+     * @param n_atoms number of atoms
+     */
+    static double rmsd(const double* m, double g_x, double g_y, std::size_t n_atoms);
+
+    /** throws std::invalid_argument unless dim is a multiple of 3 */
+    static void check_dim(std::size_t dim);
+
 private:
     template<typename T>
-    T _compute(const T* xs, const T* ys, std::size_t dim) const {
-        double sum = 0.0;
-#pragma omp simd reduction(+:sum)
-        for (size_t i = 0; i < dim; ++i) {
-            auto d = xs[i] - ys[i];
-            sum += d * d;
-        }
-        return static_cast<T>(std::sqrt(sum));
-    }
+    double _compute(const T* xs, const T* ys, std::size_t dim) const;
 };
 
+/**
+ * Cluster centers packed into tiles for a blocked euclidean nearest center search, which makes use of the expansion
+ * ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, so that the frame-center inner products can be computed like a tiled matrix
+ * multiplication of a block of frames with the transposed centers. Frames and centers enter the expansion relative
+ * to the mean of the centers and the squared norms are accumulated in double precision, so that single precision
+ * data far away from the origin is assigned accurately. Frames whose two closest centers are not separated by more
+ * than the rounding error of the expansion are compared to all centers with exact distances, hence the assignments
+ * agree with an exact nearest center search.
+ */
+template<typename T>
+class EuclideanCenters {
+public:
+    /** the centers are referenced for the exact comparisons, they have to outlive this object */
+    EuclideanCenters(const T* centers, std::size_t n_centers, std::size_t dim);
+
+    /**
+     * Finds the closest center for each of the given frames. This method is not parallelized itself, so that
+     * callers can distribute blocks of frames across threads.
+     * @param chunk pointer to frames, shape (n_frames, dim)
+     * @param n_frames number of frames
+     * @param assignments output, index of the closest center per frame
+     * @param sq_dists optional output, squared distance to the closest center per frame
+     */
+    void assign(const T* chunk, std::size_t n_frames, int* assignments, T* sq_dists = nullptr) const;
+
+    std::size_t n_centers() const { return _n_centers; }
+    std::size_t dim() const { return _dim; }
+
+    /** number of centers per tile, one cache line */
+    static constexpr std::size_t tile_width = clustering::simd::Tile<T>::width;
+    /** number of frames processed at once by the inner kernel */
+    static constexpr std::size_t n_rows = clustering::simd::Tile<T>::rows;
+    /** number of frames that share the center tiles residing in cache */
+    static constexpr std::size_t frame_block = 256;
+
+private:
+    void assign_rows(const T* rows, std::size_t tile_begin, std::size_t tile_end, T* best, T* second,
+                     int* argbest) const;
+
+    const T* _centers;
+    std::size_t _n_centers, _dim, _n_tiles, _tiles_per_group;
+    /* tiles of shape (dim, tile_width), zero padded */
+    std::vector<T> _packed;
+    /* squared norms of the shifted centers, padded with infinity */
+    std::vector<T> _norms;
+    /* mean of the centers, subtracted from frames and centers */
+    std::vector<T> _reference;
+    /* largest norm of the shifted centers and relative rounding error of the expansion */
+    double _max_norm, _error_scale;
+};
+
+/**
+ * Cluster centers for a nearest center search with the minRMSD metric. The centered coordinates of the centers and
+ * their inner products are computed once, so that each frame only has to be centered once for all centers.
+ */
+template<typename T>
+class MinRMSDCenters {
+public:
+    MinRMSDCenters(const T* centers, std::size_t n_centers, std::size_t dim);
+
+    /**
+     * Finds the closest center for each of the given frames, not parallelized itself.
+     * @param assignments output, index of the closest center per frame
+     * @param sq_dists optional output, squared minRMSD to the closest center per frame
+     */
+    void assign(const T* chunk, std::size_t n_frames, int* assignments, T* sq_dists = nullptr) const;
+
+    /** appends a center */
+    void add(const T* center);
+
+    /**
+     * Translates a frame to its centroid, which prepares it for distance().
+     * @param out centered coordinates, shape (dim,)
+     * @return the sum of squared norms of the centered coordinates
+     */
+    double center_frame(const T* frame, T* out) const;
+
+    /** minRMSD between a frame prepared by center_frame() and center j */
+    double distance(const T* centered_frame, double g_frame, std::size_t j) const;
+
+    std::size_t n_centers() const { return _n_centers; }
+
+private:
+    std::size_t _n_centers, _dim, _n_atoms;
+    /* centered coordinates, shape (n_centers, dim) */
+    std::vector<T> _centered;
+    /* sum of squared norms of the centered coordinates */
+    std::vector<double> _inner_products;
+};
+
+/**
+ * Nearest center search which dispatches to the blocked euclidean kernel if the metric is euclidean, to the prepared
+ * minRMSD centers if the metric is minRMSD and to assign_block otherwise.
+ */
+template<typename T>
+class CenterAssigner {
+public:
+    CenterAssigner(const T* centers, std::size_t n_centers, std::size_t dim, const Metric* metric);
+
+    /**
+     * Finds the closest center for each of the given frames, not parallelized itself.
+     * @param assignments output, index of the closest center per frame
+     * @param sq_dists optional output, squared distance to the closest center per frame
+     */
+    void assign(const T* chunk, std::size_t n_frames, int* assignments, T* sq_dists = nullptr) const;
+
+private:
+    const T* _centers;
+    std::size_t _n_centers, _dim;
+    const Metric* _metric;
+    std::unique_ptr<EuclideanCenters<T>> _euclidean;
+    std::unique_ptr<MinRMSDCenters<T>> _min_rmsd;
+};
+
+/**
+ * Assigns frames to their closest centers according to a generic metric. This function is not parallelized itself,
+ * so that callers can distribute blocks of frames across threads.
+ * @param assignments output, index of the closest center per frame
+ * @param dists optional output, distance to the closest center per frame
+ */
+template<typename T>
+void assign_block(const T* chunk, std::size_t n_frames, const T* centers, std::size_t n_centers, std::size_t dim,
+                  const Metric* metric, int* assignments, T* dists = nullptr);
+
 template<typename T>
 py::array_t<int> assign_chunk_to_centers(const np_array<T>& chunk,
                                          const np_array<T>& centers,
@@ -4,71 +4,112 @@
 
 #pragma once
 
+#include <array>
+#include <cstdint>
+#include <unordered_map>
+
 #include "common.h"
 #include "metric.h"
-
-#if defined(USE_OPENMP)
-#include <omp.h>
-#endif
+#include "bits/threading_utils.h"
 
 namespace clustering {
 namespace regspace {
 
-class MaxCentersReachedException : public std::exception {
+/**
+ * Contiguous, growable storage of regular space centers. For the euclidean metric, the centers are additionally
+ * sorted into a grid of cells with width dmin over the leading (at most three) coordinates. Any center within
+ * distance dmin of a frame differs by at most dmin in each of these coordinates and thus lies in one of the
+ * neighboring cells of the frame, so that only a small number of centers has to be tested per frame. For the minRMSD
+ * metric, the centered coordinates and inner products of the centers are kept, so that each frame is centered once
+ * per search instead of once per center.
+ */
+template<typename T>
+class Centers {
 public:
-    explicit MaxCentersReachedException(const char *m) : message{m} {}
+    /**
+     * @param n_threads number of threads used to scan the centers if they are not sorted into cells
+     */
+    Centers(std::size_t dim, T dmin, const Metric *metric, unsigned int n_threads = 1);
+
+    /**
+     * Checks whether there is a center within distance dmin of the frame.
+     * @param parallel whether the centers may be scanned on several threads, callers which already run in parallel
+     * over frames should pass false
+     */
+    bool has_neighbor(const T* frame, bool parallel = true) const;
+
+    void add(const T* center);
 
-    const char *what() const noexcept override { return message.c_str(); }
+    std::size_t size() const { return _centers.size() / _dim; }
+
+    const std::vector<T> &data() const { return _centers; }
 
 private:
-    std::string message;
+    using CellKey = std::array<std::int64_t, 3>;
+
+    struct CellKeyHash {
+        std::size_t operator()(const CellKey &key) const {
+            std::size_t seed = 0;
+            for (auto k : key) {
+                seed ^= std::hash<std::int64_t>()(k) + 0x9e3779b9 + (seed << 6u) + (seed >> 2u);
+            }
+            return seed;
+        }
+    };
+
+    CellKey cell(const T* frame) const;
+
+    bool has_neighbor_in(const std::vector<std::size_t> &candidates, const T* frame) const;
+
+    /** whether center j lies within dmin of the frame, centered and g_frame are only used for minRMSD */
+    bool within(const T* frame, const T* centered, double g_frame, std::size_t j) const;
+
+    std::size_t _dim;
+    T _dmin;
+    const Metric *_metric;
+    unsigned int _n_threads;
+    /* dmin on the scale of the metric's comparable distance */
+    T _comparable_dmin;
+    std::vector<T> _centers;
+
+    bool _use_grid;
+    std::size_t _grid_dim;
+    T _cell_width;
+    std::unordered_map<CellKey, std::vector<std::size_t>, CellKeyHash> _cells;
+
+    std::unique_ptr<MinRMSDCenters<T>> _min_rmsd;
 };
 
 /**
  * loops over all points in chunk and checks for each center if the distance is smaller than dmin,
- * if so, the point is appended to py_centers. This is done until max_centers is reached or all points have been
+ * if so, the point is appended to the centers. This is done until max_centers is reached or all points have been
  * added to the list.
  * @param chunk array shape(n, d)
- * @param py_centers python list containing found centers.
+ * @param initial_centers centers found so far, shape(n_centers, d), may be empty
+ * @return tuple of the centers of shape(n_centers, d) and whether the maximum number of centers was reached
  */
 template<typename T>
-void cluster(const np_array<T> &chunk, py::list& py_centers, T dmin, std::size_t maxClusters,
-             const Metric *metric, unsigned int n_threads) {
-
-    // this checks for ndim == 2
-    const auto &data = chunk.template unchecked<2>();
-
-    auto N_frames = static_cast<std::size_t>(chunk.shape(0));
-    auto dim = static_cast<std::size_t>(chunk.shape(1));
-    auto N_centers = py_centers.size();
-#if defined(USE_OPENMP)
-    omp_set_num_threads(n_threads);
-#endif
-    // do the clustering
-    for (auto i = 0U; i < N_frames; ++i) {
-        auto mindist = std::numeric_limits<T>::max();
-        #pragma omp parallel for reduction(min:mindist)
-        for (auto j = 0U; j < N_centers; ++j) {
-            // TODO avoid the cast in inner loop?
-            auto point = py_centers[j].cast<np_array<T>>();
-            auto d = metric->compute(&data(i, 0), point.data(), dim);
-            if (d < mindist) mindist = d;
-        }
-        if (mindist > dmin) {
-            if (N_centers + 1 > maxClusters) {
-                throw MaxCentersReachedException(
-                        "Maximum number of cluster centers reached. Consider increasing max_clusters "
-                        "or choose a larger minimum distance, dmin.");
-            }
-            // add newly found center
-            std::vector<size_t> shape = {1, dim};
-            np_array<T> new_center(shape, nullptr);
-            std::memcpy(new_center.mutable_data(), &data(i, 0), sizeof(T) * dim);
+std::tuple<np_array<T>, bool> cluster(const np_array<T> &chunk, const np_array<T> &initial_centers, T dmin,
+                                      std::size_t maxClusters, const Metric *metric, unsigned int n_threads);
+
+/**
+ * Parallel variant of the leader algorithm in two phases. First, the frames are divided into contiguous partitions,
+ * each of which runs the leader algorithm on its own. Then the candidate centers are merged in the order of the
+ * frames, dropping each candidate which lies within dmin of an earlier center. Frames whose local leader was dropped
+ * might be farther than dmin away from all centers, so a last parallel pass collects these frames, which are run
+ * through the leader algorithm in their order. Hence, as for the sequential definition, the centers are pairwise
+ * farther apart than dmin and every frame lies within dmin of a center. The centers differ from the ones of
+ * `cluster`, but since the partitions do not depend on the number of threads, neither do the centers.
+ * @param chunk array shape(n, d)
+ * @param initial_centers centers found so far, shape(n_centers, d), may be empty
+ * @return tuple of the centers of shape(n_centers, d) and whether the maximum number of centers was reached
+ */
+template<typename T>
+std::tuple<np_array<T>, bool> cluster_two_phase(const np_array<T> &chunk, const np_array<T> &initial_centers, T dmin,
+                                                std::size_t maxClusters, const Metric *metric,
+                                                unsigned int n_threads);
 
-            py_centers.append(new_center);
-            N_centers++;
-        }
-    }
-}
 }
 }
+
+#include "bits/regspace_bits.h"
@@ -0,0 +1,56 @@
+//
+// Vectorized distance kernels, the instruction set is selected once at runtime.
+//
+
+#pragma once
+
+#include <cstddef>
+
+namespace clustering {
+namespace simd {
+
+/**
+ * Instruction sets for which kernels are available, ordered by capability. On x86-64 the best instruction set
+ * supported by the CPU is selected when the kernels are first used. It can be capped by setting the environment
+ * variable SKTIME_SIMD to the name of one of the instruction sets, other platforms always use the portable kernels.
+ */
+enum class InstructionSet { portable = 0, sse2 = 1, avx2 = 2, avx512 = 3 };
+
+/**
+ * The instruction set of the kernels in use.
+ */
+inline InstructionSet instruction_set();
+
+inline const char* name(InstructionSet isa);
+
+/**
+ * Tiles of centers used by the blocked euclidean nearest center search, one cache line wide.
+ */
+template<typename T>
+struct Tile {
+    /** number of centers per tile */
+    static constexpr std::size_t width = 64 / sizeof(T);
+    /** number of frames processed at once */
+    static constexpr std::size_t rows = 4;
+};
+
+/**
+ * Squared euclidean distance between xs and ys. It is monotonic in the euclidean distance and hence sufficient to
+ * compare distances, e.g., when searching for the closest center.
+ */
+template<typename T>
+T squared_euclidean(const T* xs, const T* ys, std::size_t dim);
+
+/**
+ * Inner products of Tile<T>::rows frames with a tile of centers.
+ * @param rows frames of shape (Tile<T>::rows, dim)
+ * @param packed tile of shape (dim, Tile<T>::width)
+ * @param acc output of shape (Tile<T>::rows, Tile<T>::width), the products are added to it
+ */
+template<typename T>
+void tile_products(const T* rows, const T* packed, std::size_t dim, T* acc);
+
+}
+}
+
+#include "bits/simd_bits.h"
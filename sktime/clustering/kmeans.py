@@ -1,5 +1,7 @@
+import heapq
 import random
 import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 
@@ -8,16 +10,34 @@ from sktime.clustering._clustering_bindings import kmeans as _kmeans_ext
 
 from sktime.base import Estimator, Transformer
 from sktime.clustering.cluster_model import ClusterModel
+from sktime.data.util import is_chunked_source, iter_chunks, reservoir_sample
 
-__all__ = ['KmeansClustering', 'MiniBatchKmeansClustering']
+__all__ = ['KmeansClustering', 'MiniBatchKmeansClustering', 'HierarchicalKmeansClustering']
+
+
+def _resolve_fixed_seed(value: [bool, int, None]) -> int:
+    r""" Maps the value of a `fixed_seed` argument to a seed in [0, 2**32): `True` yields 42, `False` and `None` a
+    random seed, integers are kept. Integers out of range are replaced by a random seed with a warning. """
+    if isinstance(value, bool) or value is None:
+        return 42 if value else random.randint(0, 2 ** 32 - 1)
+    elif isinstance(value, int):
+        if value < 0 or value > 2 ** 32 - 1:
+            warnings.warn("seed has to be non-negative (or smaller than 2**32)."
+                          " Seed will be chosen randomly.")
+            return random.randint(0, 2 ** 32 - 1)
+        return value
+    else:
+        raise ValueError("fixed seed has to be None, bool or integer")
 
 
 class KMeansClusteringModel(ClusterModel):
 
-    def __init__(self, n_clusters, cluster_centers, metric, tolerance, inertia=np.inf, converged=False):
+    def __init__(self, n_clusters, cluster_centers, metric, tolerance, inertia=np.inf, converged=False,
+                 restart_inertias=None):
         super().__init__(n_clusters, cluster_centers, metric, converged=converged)
         self._inertia = inertia
         self._tolerance = tolerance
+        self._restart_inertias = restart_inertias
 
     @property
     def tolerance(self):
@@ -35,7 +55,8 @@ class KMeansClusteringModel(ClusterModel):
     @property
     def inertia(self):
         """
-        Sum of squared distances to centers.
+        Sum of squared distances of the data points to their closest cluster center.
+
         Returns
         -------
         float
@@ -43,13 +64,27 @@ class KMeansClusteringModel(ClusterModel):
         """
         return self._inertia
 
+    @property
+    def restart_inertias(self):
+        """
+        The inertias of all restarts in the order of the restarts, the model keeps the centers of the restart with
+        the lowest inertia.
+
+        Returns
+        -------
+        np.ndarray or None
+            the inertias of shape (n_init,), None if unknown
+        """
+        return self._restart_inertias
+
 
 class KmeansClustering(Estimator, Transformer):
     r"""Kmeans clustering"""
 
     def __init__(self, n_clusters, max_iter=5, metric=None,
                  tolerance=1e-5, init_strategy='kmeans++', fixed_seed=False,
-                 n_jobs=None, initial_centers=None, random_state=None):
+                 n_jobs=None, initial_centers=None, random_state=None, algorithm='lloyd', chunksize=None,
+                 n_init=1):
         r"""
         Parameters
         ----------
@@ -71,7 +106,10 @@ class KmeansClustering(Estimator, Transformer):
             is smaller than tolerance.
 
         init_strategy : string
-            can be either 'kmeans++' or 'uniform', determining how the initial cluster centers are being chosen
+            can be either 'kmeans++', 'kmeans||' or 'uniform', determining how the initial cluster centers are being
+            chosen. The scalable variant 'kmeans||' of kmeans++ samples candidates in a few parallel passes over the
+            data and reduces them to n_clusters centers afterwards, which is much faster for large numbers of
+            clusters.
 
         fixed_seed : bool or int
             if True, the seed gets set to 42. Use time based seeding otherwise. If an integer is given, use this to
@@ -83,7 +121,25 @@ class KmeansClustering(Estimator, Transformer):
 
         initial_centers: None or np.ndarray[k, dim]
             This is used to resume the kmeans iteration. Note, that if this is set, the init_strategy is ignored and
-            the centers are directly passed to the kmeans iteration algorithm.
+            the centers are directly passed to the kmeans iteration algorithm. Otherwise, every fit picks new initial
+            centers.
+
+        algorithm : string, default 'lloyd'
+            can be either 'lloyd' or 'hamerly', determining how the kmeans iterations are performed. The 'hamerly'
+            variant yields the same centers as 'lloyd' but uses the triangle inequality to skip most of the distance
+            evaluations once the centers only move slightly. It requires the metric to be a proper metric and stops
+            once no data point changes its assignment anymore, i.e., the tolerance is not used.
+
+        chunksize : int or None, default None
+            maximum number of data points per chunk when clustering a chunked data source, see `fit`. If None, each
+            array or file of the source is processed as a whole.
+
+        n_init : int, default 1
+            number of times the clustering is run with different initial centers, the model keeps the run with the
+            lowest inertia. The restarts run concurrently, the n_jobs threads are split among them. If n_init > 1,
+            restart i is seeded with fixed_seed + i for every i, so the result does not depend on n_jobs, a single run
+            draws from random_state instead. Only a single run is performed if initial centers are given or the data
+            is a chunked source.
         """
         super(KmeansClustering, self).__init__()
         if n_jobs is None:
@@ -104,6 +160,9 @@ class KmeansClustering(Estimator, Transformer):
         self.random_state = random_state
         self.n_jobs = n_jobs
         self.initial_centers = initial_centers
+        self.algorithm = algorithm
+        self.chunksize = chunksize
+        self.n_init = n_init
 
     def fetch_model(self) -> KMeansClusteringModel:
         return self._model
@@ -124,27 +183,74 @@ class KmeansClustering(Estimator, Transformer):
         Parameters
         ----------
         value : str
-            one of "kmeans++" or "uniform"
+            one of "kmeans++", "kmeans||" or "uniform"
         """
-        valid = ('kmeans++', 'uniform')
+        valid = ('kmeans++', 'kmeans||', 'uniform')
         if value not in valid:
             raise ValueError('invalid parameter "{}" for init_strategy. Should be one of {}'.format(value, valid))
         self._init_strategy = value
 
+    @property
+    def algorithm(self):
+        """Algorithm used to perform the kmeans iterations."""
+        return self._algorithm
+
+    @algorithm.setter
+    def algorithm(self, value: str):
+        """
+        Setter for the algorithm that is used to perform the kmeans iterations.
+
+        Parameters
+        ----------
+        value : str
+            one of "lloyd" or "hamerly"
+        """
+        valid = ('lloyd', 'hamerly')
+        if value not in valid:
+            raise ValueError('invalid parameter "{}" for algorithm. Should be one of {}'.format(value, valid))
+        self._algorithm = value
+
+    @property
+    def initial_centers(self):
+        """ The initial centers given to the estimator or to `fit`. If none were given, these are the initial centers
+        picked by the last fit, which are not reused by the next fit.
+
+        Returns
+        -------
+        np.ndarray or None
+            the initial centers of shape (n_clusters, dim), None if neither given nor picked yet
+        """
+        return self._initial_centers if self._initial_centers is not None else self._picked_initial_centers
+
+    @initial_centers.setter
+    def initial_centers(self, value):
+        self._initial_centers = value
+        self._picked_initial_centers = None
+
+    @property
+    def n_init(self):
+        """Number of runs with different initial centers, of which the one with the lowest inertia is kept."""
+        return self._n_init
+
+    @n_init.setter
+    def n_init(self, value: int):
+        if value <= 0:
+            raise ValueError("n_init has to be positive")
+        self._n_init = value
+
     @property
     def fixed_seed(self):
         """ seed for random choice of initial cluster centers.
 
-        Fix this to get reproducible results in conjunction with n_jobs=0. The latter is needed, because parallel
-        execution causes non-deterministic behaviour again.
+        Fix this to get reproducible results. The results do not depend on the number of threads (n_jobs), since all
+        parallel reductions are carried out in a fixed order.
         """
         return self._fixed_seed
 
     @fixed_seed.setter
     def fixed_seed(self, value: [bool, int, None]):
         """
-        Sets a fixed seed for cluster estimation to get reproducible results. This only works in the case of n_jobs=0
-        or n_jobs=1, parallel execution reintroduces non-deterministic behavior.
+        Sets a fixed seed for cluster estimation to get reproducible results, independent of the number of threads.
 
         Parameters
         ----------
@@ -153,111 +259,610 @@ class KmeansClustering(Estimator, Transformer):
             randomly. In case an `int` value is provided, that will be used as fixed seed.
 
         """
-        if isinstance(value, bool) or value is None:
-            if value:
-                self._fixed_seed = 42
-            else:
-                self._fixed_seed = random.randint(0, 2 ** 32 - 1)
-        elif isinstance(value, int):
-            if value < 0 or value > 2 ** 32 - 1:
-                warnings.warn("seed has to be non-negative (or smaller than 2**32)."
-                              " Seed will be chosen randomly.")
-                self.fixed_seed = False
-            else:
-                self._fixed_seed = value
-        else:
-            raise ValueError("fixed seed has to be None, bool or integer")
-
-    def _pick_initial_centers(self, data, strategy, n_jobs, callback=None):
-        if self.n_clusters > len(data):
+        self._fixed_seed = _resolve_fixed_seed(value)
+
+    @staticmethod
+    def _check_weights(weights, data):
+        if weights is None:
+            return None
+        weights = np.ascontiguousarray(weights, dtype=data.dtype)
+        if weights.shape != (len(data),):
+            raise ValueError(f"weights must have shape ({len(data)},) to match the data, got {weights.shape}.")
+        if not np.all(np.isfinite(weights)) or np.any(weights < 0) or not weights.sum() > 0:
+            raise ValueError("weights must be finite, non-negative and must not all be zero.")
+        return weights
+
+    def _pick_initial_centers(self, data, strategy, n_jobs, callback=None, seed=None, weights=None,
+                              n_clusters=None):
+        n_clusters = self.n_clusters if n_clusters is None else n_clusters
+        if n_clusters > len(data):
             raise ValueError('Not enough data points for desired amount of clusters.')
+        if weights is not None and np.count_nonzero(weights) < n_clusters:
+            raise ValueError('Not enough data points with positive weight for desired amount of clusters.')
 
+        random_state = self.random_state if seed is None else np.random.RandomState(seed)
+        seed = self.fixed_seed if seed is None else seed
         if strategy == 'uniform':
-            return data[self.random_state.randint(0, len(data), size=self.n_clusters)]
-        elif self.init_strategy == 'kmeans++':
-            return _kmeans_ext.init_centers_kmpp(data, self.n_clusters, self.fixed_seed, n_jobs,
-                                                 callback, self.metric)
+            if weights is None:
+                return data[random_state.randint(0, len(data), size=n_clusters)]
+            p = np.asarray(weights, dtype=np.float64)
+            return data[random_state.choice(len(data), size=n_clusters, p=p / p.sum())]
+        elif strategy == 'kmeans++':
+            return _kmeans_ext.init_centers_kmpp(data, n_clusters, seed, n_jobs,
+                                                 callback, self.metric, weights=weights)
+        elif strategy == 'kmeans||':
+            return _kmeans_ext.init_centers_kmeans_parallel(data, n_clusters, seed, n_jobs,
+                                                            callback, self.metric, weights=weights)
         else:
             raise ValueError(f"Unknown cluster center initialization strategy \"{strategy}\", supported are "
-                             f"\"uniform\" and \"kmeans++\"")
+                             f"\"uniform\", \"kmeans++\" and \"kmeans||\"")
 
-    def fit(self, data, initial_centers=None, callback_init_centers=None, callback_loop=None, n_jobs=None):
+    def fit(self, data, initial_centers=None, callback_init_centers=None, callback_loop=None, n_jobs=None,
+            weights=None):
         """ perform the clustering
 
         Parameters
         ----------
-        data: np.ndarray
+        data: np.ndarray, list or callable
             data to be clustered, shape should be (N, D), where N is the number of data points, D the dimension.
-            In case of one-dimensional data, a shape of (N,) also works.
+            In case of one-dimensional data, a shape of (N,) also works. Data which does not fit into memory can be
+            given as a list of arrays, memory maps or paths to .npy files, or as a callable returning an iterable over
+            arrays on each call. Such a source is clustered out of core with one streaming pass per Lloyd
+            iteration, chunked according to `chunksize`, so that only the current chunk and the centroid sums are
+            held in memory. The initial centers are then picked from a uniform reservoir sample of the source.
+            Chunked sources are always clustered with Lloyd iterations, since Hamerly's bounds require memory
+            proportional to the number of data points.
         initial_centers: np.ndarray or None
             Optional cluster center initialization that supersedes the estimator's `initial_centers` attribute
         callback_init_centers: function or None
-            used for kmeans++ initialization to indicate progress, called once per assigned center.
+            used for kmeans++ initialization to indicate progress, called once per assigned center and restart.
         callback_loop: function or None
-            used to indicate progress on kmeans iterations, called once per iteration.
+            used to indicate progress on kmeans iterations, called once per iteration and restart. With n_init > 1,
+            the callbacks are invoked from several threads.
         n_jobs: None or int
             if not None, supersedes the n_jobs attribute of the estimator instance; must be non-negative
+        weights: np.ndarray or None
+            optional non-negative weights of the data points of shape (N,), e.g., the multiplicities of deduplicated
+            or binned frames. The centers become weighted means, the inertia is weighted and the initialization
+            strategies sample proportional to the weights (D²·w sampling for kmeans++ and kmeans||). Fitting with
+            integer weights is equivalent to fitting the data in which every point is repeated accordingly. Only
+            supported for data given as a single array.
         """
-        if data.ndim == 1:
-            data = data[:, np.newaxis]
+        self._fit(data, initial_centers=initial_centers, callback_init_centers=callback_init_centers,
+                  callback_loop=callback_loop, n_jobs=n_jobs, weights=weights)
+        return self
+
+    def fit_transform(self, data, **kwargs):
+        """ perform the clustering and return the assignments of the data to the final cluster centers
+
+        The assignments are a by-product of the last pass over the data, so this saves the additional pass of
+        calling `transform` after `fit`.
+
+        Parameters
+        ----------
+        data: np.ndarray
+            data to be clustered, shape should be (N, D), where N is the number of data points, D the dimension.
+            Chunked data sources are not supported, since their assignments do not necessarily fit into memory.
+        **kwargs
+            keyword arguments of `fit`
+
+        Returns
+        -------
+        np.ndarray
+            the discrete trajectory of shape (N,), containing the index of the closest cluster center for each point
+        """
+        return self._fit(data, return_assignments=True, **kwargs)
+
+    def _fit(self, data, initial_centers=None, callback_init_centers=None, callback_loop=None, n_jobs=None,
+             return_assignments=False, weights=None):
         n_jobs = self.n_jobs if n_jobs is None else n_jobs
         if initial_centers is not None:
             self.initial_centers = initial_centers
-        if self.initial_centers is None:
-            self.initial_centers = self._pick_initial_centers(data, self.init_strategy, n_jobs, callback_init_centers)
-
-        # run k-means with all the data
-        converged = False
-        cluster_centers, code, iterations, cost = _kmeans_ext.cluster_loop(data, self.initial_centers, self.n_clusters,
-                                                                           n_jobs, self.max_iter, self.tolerance,
-                                                                           callback_loop, self.metric)
-        if code == 0:
-            converged = True
+        if is_chunked_source(data):
+            if return_assignments:
+                raise ValueError('Assignments can only be returned for data given as a single array.')
+            if weights is not None:
+                raise ValueError('Weights are only supported for data given as a single array.')
+            cluster_centers, code, iterations, cost = self._fit_chunked(data, n_jobs, callback_init_centers,
+                                                                        callback_loop)
+            self._set_model(cluster_centers, code, cost, restart_inertias=np.array([cost], dtype=np.float64))
+            return None
+
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        weights = self._check_weights(weights, data)
+        n_init = self.n_init if self._initial_centers is None else 1
+
+        def run(restart, n_threads):
+            initial_centers = self._initial_centers
+            if initial_centers is None:
+                # a single run draws from random_state, restarts are seeded independently of each other
+                seed = None if n_init == 1 else (self.fixed_seed + restart) % 2 ** 32
+                initial_centers = self._pick_initial_centers(data, self.init_strategy, n_threads,
+                                                             callback_init_centers, seed=seed, weights=weights)
+            return (initial_centers,) + self._cluster_loop(data, initial_centers, n_threads, callback_loop,
+                                                           return_assignments, weights)
+
+        if n_init == 1:
+            runs = [run(0, n_jobs)]
         else:
+            # the restarts release the GIL, hence they run concurrently and share the thread budget
+            n_workers = min(n_init, max(n_jobs, 1))
+            n_threads = n_jobs // n_workers if n_jobs > 0 else 0
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                runs = list(executor.map(lambda restart: run(restart, n_threads), range(n_init)))
+
+        inertias = np.array([r[4] for r in runs], dtype=np.float64)
+        initial_centers, cluster_centers, code, iterations, cost, dtraj = runs[int(np.argmin(inertias))]
+        if self._initial_centers is None:
+            self._picked_initial_centers = initial_centers
+        self._set_model(cluster_centers, code, cost, restart_inertias=inertias)
+        return dtraj
+
+    def _cluster_loop(self, data, initial_centers, n_jobs, callback_loop, return_assignments, weights=None):
+        if self.algorithm == 'hamerly':
+            return _kmeans_ext.cluster_loop_hamerly(
+                data, initial_centers, n_jobs, self.max_iter, callback_loop, self.metric, return_assignments, weights
+            )
+        return _kmeans_ext.cluster_loop(
+            data, initial_centers, self.n_clusters, n_jobs, self.max_iter, self.tolerance, callback_loop,
+            self.metric, return_assignments, weights
+        )
+
+    def _fit_chunked(self, source, n_jobs, callback_init_centers, callback_loop):
+        if self._initial_centers is None:
+            # a bounded sample, which is large enough for the initialization strategies to pick meaningful centers
+            sample_size = max(10000, 100 * self.n_clusters)
+            sample = reservoir_sample(iter_chunks(source, self.chunksize), sample_size, self.random_state)
+            self._picked_initial_centers = self._pick_initial_centers(sample, self.init_strategy, n_jobs,
+                                                                      callback_init_centers)
+        centers = np.array(self.initial_centers)
+        if centers.ndim == 1:
+            centers = centers[:, np.newaxis]
+
+        # Lloyd iterations with the same stopping criterion as the in-memory loop, each pass yields the inertia of
+        # the current centers together with the centroid sums for the next ones.
+        it, converged, prev_cost = 0, False, 0.
+        while True:
+            sums = np.zeros(centers.shape, dtype=np.float64)
+            counts = np.zeros(len(centers), dtype=np.int64)
+            cost = 0.
+            for chunk in iter_chunks(source, self.chunksize):
+                chunk_sums, chunk_counts, chunk_cost = _kmeans_ext.accumulate(
+                    np.asarray(chunk, dtype=centers.dtype), centers, n_jobs, self.metric
+                )
+                sums += chunk_sums
+                counts += chunk_counts
+                cost += chunk_cost
+            if it > 0:
+                rel_change = np.abs(cost - prev_cost) / cost if cost != 0.0 else 0.0
+                if rel_change <= self.tolerance:
+                    converged = True
+                elif callback_loop is not None:
+                    callback_loop()
+            if converged or it >= max(self.max_iter, 1):
+                break
+            # empty clusters keep their center
+            assigned = counts > 0
+            centers = centers.copy()
+            centers[assigned] = sums[assigned] / counts[assigned, np.newaxis]
+            prev_cost = cost
+            it += 1
+        return centers, 0 if converged else 1, it, cost
+
+    def _set_model(self, cluster_centers, code, cost, restart_inertias=None):
+        converged = code == 0
+        if not converged:
             warnings.warn("Algorithm did not reach convergence criterion"
                           " of {t} in {i} iterations. Consider increasing max_iter.".format(t=self.tolerance,
                                                                                             i=self.max_iter))
         self._model = KMeansClusteringModel(n_clusters=self.n_clusters, metric=self.metric, tolerance=self.tolerance,
-                                            cluster_centers=cluster_centers, inertia=cost, converged=converged)
-
-        return self
+                                            cluster_centers=cluster_centers, inertia=cost, converged=converged,
+                                            restart_inertias=restart_inertias)
 
 
 class MiniBatchKmeansClustering(KmeansClustering):
-    r"""Mini-batch k-means clustering"""
+    r"""Mini-batch k-means clustering
+
+    Implements the mini-batch k-means algorithm of Sculley [1]_. Instead of the whole data set, each iteration only
+    assigns a small batch of data points to the centers. Afterwards, every data point of the batch moves its center
+    towards itself with a per-center learning rate, which is the inverse of the number of data points that center has
+    seen so far. With weights, every data point moves its center proportional to its weight, and the learning rate is
+    the inverse of the total weight the center has seen so far. The batches are either passed to :meth:`partial_fit`
+    or drawn at random from an array or memory map by :meth:`fit`, which only reads the sampled rows. The inertia of
+    the model refers to the last batch with respect to the centers before the update.
+
+    References
+    ----------
+    .. [1] Sculley, D. 2010. Web-scale k-means clustering. Proceedings of the 19th international conference on World
+       wide web, 1177-1178.
+    """
 
     def __init__(self, n_clusters, max_iter=5, metric=None, tolerance=1e-5, init_strategy='kmeans++',
-                 n_jobs=None, initial_centers=None):
+                 n_jobs=None, initial_centers=None, batch_size=1024, fixed_seed=False):
         """
         Constructs a Minibatch k-means estimator. For details, see `KmeansClustering`.
+
+        Parameters
+        ----------
+        max_iter : int
+            maximum number of passes over the data in :meth:`fit`, measured in batches, i.e., at most
+            `max_iter * ceil(N / batch_size)` batches are drawn.
+
+        tolerance : float
+            stop iteration when the relative change of the exponentially weighted average of the inertia per data
+            point over recent batches is smaller than tolerance.
+
+        batch_size : int, default 1024
+            number of data points per randomly drawn batch in :meth:`fit`.
         """
 
         super(MiniBatchKmeansClustering, self).__init__(n_clusters, max_iter, metric,
-                                                        tolerance, init_strategy, False,
+                                                        tolerance, init_strategy, fixed_seed,
                                                         n_jobs=n_jobs,
                                                         initial_centers=initial_centers)
+        self.batch_size = batch_size
+        self._center_counts = None
+        self._smoothed_inertia = None
 
-    def partial_fit(self, data, n_jobs=None):
-        if self._model is None:
-            self._model = KMeansClusteringModel(n_clusters=self.n_clusters, cluster_centers=None, metric=self.metric,
-                                                tolerance=self.tolerance, inertia=float('inf'))
+    @property
+    def batch_size(self):
+        """Number of data points per randomly drawn batch in :meth:`fit`."""
+        return self._batch_size
+
+    @batch_size.setter
+    def batch_size(self, value: int):
+        if value <= 0:
+            raise ValueError("batch_size has to be positive")
+        self._batch_size = value
+
+    def fit(self, data, initial_centers=None, callback_init_centers=None, callback_loop=None, n_jobs=None,
+            weights=None):
+        """ perform the clustering on randomly drawn mini-batches
+
+        Parameters
+        ----------
+        data: np.ndarray or np.memmap
+            data to be clustered, shape should be (N, D), where N is the number of data points, D the dimension.
+            In case of one-dimensional data, a shape of (N,) also works. Only the rows of the sampled batches are
+            read, so this works for memory maps which are much larger than the available memory.
+        initial_centers: np.ndarray or None
+            Optional cluster center initialization that supersedes the estimator's `initial_centers` attribute
+        callback_init_centers: function or None
+            used for kmeans++ initialization to indicate progress, called once per assigned center.
+        callback_loop: function or None
+            used to indicate progress, called once per batch.
+        n_jobs: None or int
+            if not None, supersedes the n_jobs attribute of the estimator instance; must be non-negative
+        weights: np.ndarray or None
+            optional non-negative weights of the data points of shape (N,). The batches are still drawn uniformly,
+            their points contribute to the center updates and the inertia proportional to their weights.
+        """
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        weights = self._check_weights(weights, data)
+        n_frames = len(data)
+        self._model = None
+        self._center_counts = None
+        self._smoothed_inertia = None
+        if initial_centers is not None:
+            self.initial_centers = initial_centers
+        if self._initial_centers is None:
+            init_size = min(n_frames, max(3 * self.batch_size, 3 * self.n_clusters))
+            sample_indices = np.unique(self.random_state.randint(0, n_frames, size=init_size))
+            if len(sample_indices) < self.n_clusters:
+                sample_indices = slice(None)
+            sample_weights = weights[sample_indices] if weights is not None else None
+            if sample_weights is not None and not sample_weights.sum() > 0:
+                sample_indices, sample_weights = slice(None), weights
+            self._picked_initial_centers = self._pick_initial_centers(np.asarray(data[sample_indices]),
+                                                                      self.init_strategy, n_jobs,
+                                                                      callback_init_centers, weights=sample_weights)
+
+        n_batches = max(self.max_iter, 1) * int(np.ceil(n_frames / self.batch_size))
+        for _ in range(n_batches):
+            # sorted indices give a sequential access pattern on memory maps
+            indices = np.sort(self.random_state.randint(0, n_frames, size=min(self.batch_size, n_frames)))
+            self._partial_fit(np.asarray(data[indices]), n_jobs,
+                              weights[indices] if weights is not None else None)
+            if self._model.converged:
+                break
+            if callback_loop is not None:
+                callback_loop()
+        if not self._model.converged:
+            warnings.warn("Algorithm did not reach convergence criterion"
+                          " of {t} in {i} iterations. Consider increasing max_iter.".format(t=self.tolerance,
+                                                                                            i=self.max_iter))
+        return self
+
+    def partial_fit(self, data, n_jobs=None, weights=None):
+        """ updates the cluster centers with one mini-batch
+
+        Parameters
+        ----------
+        data: np.ndarray
+            the mini-batch, shape should be (N, D), where N is the number of data points, D the dimension.
+            In case of one-dimensional data, a shape of (N,) also works. If no centers have been found yet, the initial
+            centers are picked from this batch.
+        n_jobs: None or int
+            if not None, supersedes the n_jobs attribute of the estimator instance; must be non-negative
+        weights: np.ndarray or None
+            optional non-negative weights of the data points of shape (N,), each point moves its center
+            proportional to its weight.
+        """
         if data.ndim == 1:
             data = data[:, np.newaxis]
         n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        self._partial_fit(data, n_jobs, self._check_weights(weights, data))
+        return self
+
+    def _partial_fit(self, data, n_jobs, weights=None):
+        if self._model is None:
+            self._model = KMeansClusteringModel(n_clusters=self.n_clusters, cluster_centers=None, metric=self.metric,
+                                                tolerance=self.tolerance, inertia=float('inf'))
         if self._model.cluster_centers is None:
             if self.initial_centers is None:
                 # we have no initial centers set, pick some based on the first partial fit
-                self._model._cluster_centers = self._pick_initial_centers(data, self.init_strategy, n_jobs)
+                self._model.cluster_centers = self._pick_initial_centers(data, self.init_strategy, n_jobs,
+                                                                         weights=weights)
             else:
-                self._model._cluster_centers = np.copy(self.initial_centers)
+                self._model.cluster_centers = np.copy(self.initial_centers)
+        if self._center_counts is None or len(self._center_counts) != len(self._model.cluster_centers):
+            self._center_counts = np.zeros(len(self._model.cluster_centers), dtype=np.float64)
 
-        self._model._cluster_centers = _kmeans_ext.cluster(data, self._model.cluster_centers, n_jobs, self.metric)
-        cost = _kmeans_ext.cost_function(data, self._model.cluster_centers, n_jobs, self.metric)
-
-        rel_change = np.abs(cost - self._model.inertia) / cost if cost != 0.0 else 0.0
+        self._model.cluster_centers, self._center_counts, cost = _kmeans_ext.minibatch_step(
+            data, self._model.cluster_centers, self._center_counts, n_jobs, self.metric, weights
+        )
         self._model._inertia = cost
 
-        if rel_change <= self.tolerance:
-            self._model._converged = True
+        # The inertia of single batches is noisy, hence convergence is checked on its exponentially weighted average
+        # per unit of weight, which roughly averages over all data points seen so far.
+        batch_weight = float(len(data)) if weights is None else float(np.sum(weights, dtype=np.float64))
+        if weights is not None and batch_weight == 0:
+            # a randomly drawn batch of zero weight leaves the centers unchanged and carries no information
+            return
+        batch_inertia = cost / batch_weight if batch_weight > 0 else 0.0
+        if self._smoothed_inertia is None:
+            self._smoothed_inertia = batch_inertia
+            rel_change = np.inf
+        else:
+            alpha = min(1.0, 2.0 * batch_weight / (self._center_counts.sum() + 1))
+            smoothed = (1.0 - alpha) * self._smoothed_inertia + alpha * batch_inertia
+            rel_change = np.abs(smoothed - self._smoothed_inertia) / smoothed if smoothed != 0.0 else 0.0
+            self._smoothed_inertia = smoothed
+        self._model._converged = rel_change <= self.tolerance
+
+
+class HierarchicalKmeansClusteringModel(KMeansClusteringModel):
+    r""" The binary tree of centers found by bisecting k-means. The leaves of the tree make up the flat array of
+    :attr:`cluster_centers`, frames are assigned by descending the tree. """
+
+    def __init__(self, n_clusters, node_centers, children, leaf_labels, metric, tolerance, inertia=np.inf,
+                 converged=False):
+        leaves = np.flatnonzero(leaf_labels >= 0)
+        cluster_centers = np.empty((len(leaves), node_centers.shape[1]), dtype=node_centers.dtype)
+        cluster_centers[leaf_labels[leaves]] = node_centers[leaves]
+        super().__init__(n_clusters, cluster_centers, metric, tolerance, inertia=inertia, converged=converged)
+        self._node_centers = node_centers
+        self._children = children
+        self._leaf_labels = leaf_labels
+        # the tree already is a spatial index
+        self.use_spatial_index = False
+
+    @property
+    def node_centers(self):
+        """
+        The centers of all nodes of the tree, the root being the first node.
 
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n_nodes, D).
+        """
+        return self._node_centers
+
+    @property
+    def children(self):
+        """
+        The indices of the two children of each node, -1 for leaves. Children have a larger index than their parent.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n_nodes, 2).
+        """
+        return self._children
+
+    @property
+    def leaf_labels(self):
+        """
+        The index into :attr:`cluster_centers` of each leaf node, -1 for inner nodes.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n_nodes,).
+        """
+        return self._leaf_labels
+
+    @property
+    def depth(self):
+        """ The maximum number of splits from the root to a leaf. """
+        depth = np.zeros(len(self.children), dtype=int)
+        for node in range(len(self.children)):
+            if self.children[node, 0] >= 0:
+                depth[self.children[node]] = depth[node] + 1
+        return int(depth.max())
+
+    def transform(self, data, n_jobs=None):
+        """
+        Assigns the data by descending the tree, at each inner node moving on to the closer of its two children. This
+        requires 2 * :attr:`depth` distance evaluations per frame, usually O(log k), but it does not necessarily find
+        the closest of the :attr:`cluster_centers`, for which :meth:`ClusterModel.transform` can be used.
+        """
+        assert data.dtype == self.cluster_centers.dtype
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        return _kmeans_ext.assign_tree(data, self.node_centers, self.children, self.leaf_labels,
+                                       0 if n_jobs is None else n_jobs, self.metric)
+
+
+class HierarchicalKmeansClustering(KmeansClustering):
+    r"""Bisecting (hierarchical) k-means clustering
+
+    Builds a binary tree of centers by recursively splitting clusters with 2-means [1]_. Starting with all data in a
+    single cluster, the cluster with the largest inertia is split until there are n_clusters leaves. The split of a
+    cluster only depends on its frames, hence the splits of the clusters with the largest inertias are evaluated
+    concurrently in different subtrees, the n_jobs threads being split among them, and committed in the order of
+    their inertia. Every split only processes the frames of its cluster, so building a tree of depth h costs
+    O(N h) instead of O(N k) distance evaluations per Lloyd iteration, and the model assigns new frames in O(h). This
+    pays off for very large numbers of clusters at the expense of a somewhat larger inertia than flat k-means.
+
+    References
+    ----------
+    .. [1] Steinbach, M., Karypis, G. and Kumar, V. 2000. A comparison of document clustering techniques. KDD workshop
+       on text mining.
+    """
+
+    def __init__(self, n_clusters, max_iter=50, metric=None, tolerance=1e-5, init_strategy='kmeans++',
+                 fixed_seed=False, n_jobs=None, random_state=None, algorithm='lloyd'):
+        """
+        Constructs a bisecting k-means estimator. For details, see `KmeansClustering`.
+
+        Parameters
+        ----------
+        max_iter : int
+            maximum number of iterations of each split.
+
+        init_strategy : string
+            can be either 'kmeans++', 'kmeans||' or 'uniform', determining how the two initial centers of each split
+            are chosen. The split of node i is seeded with fixed_seed + i, so the result does not depend on n_jobs.
+        """
+        super(HierarchicalKmeansClustering, self).__init__(n_clusters, max_iter, metric, tolerance, init_strategy,
+                                                           fixed_seed, n_jobs=n_jobs, random_state=random_state,
+                                                           algorithm=algorithm)
+
+    def fetch_model(self) -> HierarchicalKmeansClusteringModel:
+        return self._model
+
+    def fit(self, data, initial_centers=None, callback_init_centers=None, callback_loop=None, n_jobs=None,
+            weights=None):
+        """ builds the tree of centers
+
+        Parameters
+        ----------
+        data: np.ndarray
+            data to be clustered, shape should be (N, D), where N is the number of data points, D the dimension.
+            In case of one-dimensional data, a shape of (N,) also works.
+        initial_centers: None
+            not supported, the initial centers of every split are picked according to `init_strategy`.
+        callback_init_centers: function or None
+            used for kmeans++ initialization to indicate progress, called once per assigned center and split.
+        callback_loop: function or None
+            used to indicate progress on kmeans iterations, called once per iteration and split. With n_jobs > 1,
+            the callbacks are invoked from several threads.
+        n_jobs: None or int
+            if not None, supersedes the n_jobs attribute of the estimator instance; must be non-negative
+        weights: np.ndarray or None
+            optional non-negative weights of the data points of shape (N,), see `KmeansClustering.fit`.
+        """
+        self._fit(data, initial_centers=initial_centers, callback_init_centers=callback_init_centers,
+                  callback_loop=callback_loop, n_jobs=n_jobs, weights=weights)
         return self
+
+    def _fit(self, data, initial_centers=None, callback_init_centers=None, callback_loop=None, n_jobs=None,
+             return_assignments=False, weights=None):
+        # fit_transform returns the leaf each frame ended up in while splitting, which the inertia refers to
+        if initial_centers is not None:
+            raise ValueError('Initial centers are not supported, the centers of each split are picked according to '
+                             'init_strategy.')
+        if is_chunked_source(data):
+            raise ValueError('Bisecting k-means only supports data given as a single array.')
+        if data.ndim == 1:
+            data = data[:, np.newaxis]
+        n_jobs = self.n_jobs if n_jobs is None else n_jobs
+        weights = self._check_weights(weights, data)
+        root_center = np.average(data, axis=0, weights=weights).astype(data.dtype)[np.newaxis]
+        node_centers = [root_center[0]]
+        node_costs = [_kmeans_ext.cost_function(data, root_center, n_jobs, self.metric, weights)]
+        node_indices = {0: np.arange(len(data))}
+        children = [[-1, -1]]
+        converged = True
+
+        def split(node, n_threads):
+            indices = node_indices[node]
+            subset = np.ascontiguousarray(data[indices])
+            subset_weights = weights[indices] if weights is not None else None
+            if len(subset) < 2 or (subset_weights is not None and np.count_nonzero(subset_weights) < 2):
+                return None
+            seed = (self.fixed_seed + node) % 2 ** 32
+            initial_centers = self._pick_initial_centers(subset, self.init_strategy, n_threads, callback_init_centers,
+                                                         seed=seed, weights=subset_weights, n_clusters=2)
+            centers, code, _, _, labels = self._cluster_loop(subset, initial_centers, n_threads, callback_loop, True,
+                                                             subset_weights)
+            halves = [labels == 0, labels == 1]
+            if not all(np.any(half) for half in halves):
+                return None
+            costs = [_kmeans_ext.cost_function(np.ascontiguousarray(subset[half]), centers[j:j + 1], n_threads,
+                                               self.metric,
+                                               subset_weights[half] if subset_weights is not None else None)
+                     for j, half in enumerate(halves)]
+            return centers, [indices[half] for half in halves], costs, code
+
+        # leaves ordered by decreasing inertia, ties are broken by the node index
+        candidates = [(-node_costs[0], 0)]
+        splits = {}
+        n_leaves = 1
+        while n_leaves < self.n_clusters and candidates:
+            # The splits of the leaves with the largest inertias are evaluated ahead of time. They only depend on the
+            # leaves themselves, so the tree is the same as if the leaves were split one after another.
+            n_ahead = min(max(n_jobs, 1), self.n_clusters - n_leaves)
+            pending = [node for _, node in heapq.nsmallest(n_ahead, candidates) if node not in splits]
+            if len(pending) == 1:
+                splits[pending[0]] = split(pending[0], n_jobs)
+            elif len(pending) > 1:
+                # the splits release the GIL, hence they run concurrently and share the thread budget
+                n_threads = n_jobs // len(pending) if n_jobs > 0 else 0
+                with ThreadPoolExecutor(max_workers=len(pending)) as executor:
+                    splits.update(zip(pending, executor.map(lambda node: split(node, n_threads), pending)))
+
+            _, node = heapq.heappop(candidates)
+            result = splits.pop(node)
+            if result is None:
+                continue
+            centers, child_indices, costs, code = result
+            converged &= code == 0
+            del node_indices[node]
+            children[node] = [len(node_centers), len(node_centers) + 1]
+            for center, indices, cost in zip(centers, child_indices, costs):
+                child = len(node_centers)
+                node_centers.append(center)
+                node_costs.append(cost)
+                node_indices[child] = indices
+                children.append([-1, -1])
+                heapq.heappush(candidates, (-cost, child))
+            n_leaves += 1
+
+        children = np.array(children, dtype=np.int32)
+        leaves = children[:, 0] < 0
+        leaf_labels = np.full(len(children), -1, dtype=np.int32)
+        leaf_labels[leaves] = np.arange(np.count_nonzero(leaves))
+        if np.count_nonzero(leaves) < self.n_clusters:
+            warnings.warn(f"Only {np.count_nonzero(leaves)} of the {self.n_clusters} clusters could be split off, "
+                          f"since the remaining clusters consist of too few distinct data points.")
+        if not converged:
+            warnings.warn("Not all splits reached the convergence criterion"
+                          " of {t} in {i} iterations. Consider increasing max_iter.".format(t=self.tolerance,
+                                                                                            i=self.max_iter))
+        self._model = HierarchicalKmeansClusteringModel(
+            n_clusters=int(np.count_nonzero(leaves)), node_centers=np.array(node_centers, dtype=data.dtype),
+            children=children, leaf_labels=leaf_labels, metric=self.metric, tolerance=self.tolerance,
+            inertia=float(np.sum(np.array(node_costs)[leaves])), converged=converged
+        )
+        if return_assignments:
+            dtraj = np.empty(len(data), dtype=np.int32)
+            for node, indices in node_indices.items():
+                dtraj[indices] = leaf_labels[node]
+            return dtraj
+        return None
@@ -5,7 +5,7 @@ import numpy as np
 from sktime.base import Estimator
 from sktime.clustering.cluster_model import ClusterModel
 
-from sktime.clustering._clustering_bindings import Metric, EuclideanMetric
+from sktime.clustering._clustering_bindings import Metric, EuclideanMetric, MinRMSDMetric
 from sktime.clustering._clustering_bindings import regspace as _regspace_ext
 
 __all__ = ['RegularSpaceClustering']
@@ -29,14 +29,22 @@ class RegularSpaceClustering(Estimator):
     ----------
     dmin : float
         minimum distance between all clusters.
-    metric : str
-        metric to use during clustering ('euclidean', 'minRMSD')
+    metric : str or subclass of `sktime.clustering._bindings.Metric`
+        metric to use during clustering ('euclidean', 'minRMSD'). The minRMSD metric expects frames of flattened
+        cartesian coordinates (x1, y1, z1, x2, ...) and superimposes them optimally before measuring their distance.
     max_centers : int
         if this cutoff is hit during finding the centers,
         the algorithm will abort.
     n_jobs : int or None, default None
         Number of threads to use during assignment of the data.
         If None, all available CPUs will be used.
+    algorithm : str, default 'sequential'
+        either 'sequential' or 'two_phase'. The 'sequential' algorithm visits the frames one after another. The
+        'two_phase' algorithm runs the leader algorithm on partitions of the data in parallel and merges the
+        candidate centers in the order of the frames, dropping the ones within dmin of an earlier center. Frames
+        which are then not covered by any center are clustered in a last pass. It provides the same guarantees, i.e.,
+        the centers are farther than dmin apart and every frame lies within dmin of a center, but finds different
+        centers than the 'sequential' algorithm. They do not depend on the number of threads.
 
     References
     ----------
@@ -49,7 +57,7 @@ class RegularSpaceClustering(Estimator):
 
     """
 
-    def __init__(self, dmin, max_centers=1000, metric=None, n_jobs=None):
+    def __init__(self, dmin, max_centers=1000, metric=None, n_jobs=None, algorithm='sequential'):
         super(RegularSpaceClustering, self).__init__()
         self.dmin = dmin
         if metric is None:
@@ -57,6 +65,7 @@ class RegularSpaceClustering(Estimator):
         self.metric = metric
         self.max_centers = max_centers
         self.n_jobs = n_jobs
+        self.algorithm = algorithm
 
     @property
     def metric(self):
@@ -66,11 +75,25 @@ class RegularSpaceClustering(Estimator):
     def metric(self, value):
         if value == 'euclidean':
             value = EuclideanMetric()
+        elif value == 'minRMSD':
+            value = MinRMSDMetric()
 
         if not isinstance(value, Metric):
             raise ValueError(f"Unknown metric {value}, must be subclass of _clustering_bindings.Metric")
         self._metric = value
 
+    @property
+    def algorithm(self):
+        """Algorithm used to find the cluster centers, either 'sequential' or 'two_phase'."""
+        return self._algorithm
+
+    @algorithm.setter
+    def algorithm(self, value: str):
+        valid = ('sequential', 'two_phase')
+        if value not in valid:
+            raise ValueError('invalid parameter "{}" for algorithm. Should be one of {}'.format(value, valid))
+        self._algorithm = value
+
     @property
     def dmin(self):
         """Minimum distance between cluster centers."""
@@ -110,13 +133,49 @@ class RegularSpaceClustering(Estimator):
         return self._model
 
     def fit(self, data, n_jobs=None):
+        """ Finds the cluster centers of the data, previously found centers are discarded.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            data to be clustered, shape should be (N, D), where N is the number of data points, D the dimension.
+            In case of one-dimensional data, a shape of (N,) also works.
+        n_jobs : None or int
+            if not None, supersedes the n_jobs attribute of the estimator instance; must be non-negative
+
+        Returns
+        -------
+        self : RegularSpaceClustering
+            reference to self
+        """
+        self._model = None
+        return self.partial_fit(data, n_jobs=n_jobs)
+
+    def partial_fit(self, data, n_jobs=None):
+        """ Updates the cluster centers with a chunk of data. Frames which are farther than dmin away from all
+        centers found so far, including the ones of previous calls, become new centers. Calling this method on the
+        chunks of a stream of trajectories yields the same centers as calling :meth:`fit` on their concatenation,
+        unless the 'two_phase' algorithm is used, which partitions each chunk on its own.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            chunk of data, shape should be (N, D), where N is the number of data points, D the dimension.
+            In case of one-dimensional data, a shape of (N,) also works.
+        n_jobs : None or int
+            if not None, supersedes the n_jobs attribute of the estimator instance; must be non-negative
+
+        Returns
+        -------
+        self : RegularSpaceClustering
+            reference to self
+        """
         ########
         # Calculate clustercenters:
         # 1. choose first datapoint as centroid
         # 2. for all X: calc distances to all clustercenters
         # 3. add new centroid, if min(distance to all other clustercenters) >= dmin
         ########
-        # temporary list to store cluster centers
 
         n_jobs = self.n_jobs if n_jobs is None else n_jobs
         if n_jobs is None:
@@ -125,23 +184,23 @@ class RegularSpaceClustering(Estimator):
         if data.ndim == 1:
             data = data[:, np.newaxis]
 
-        clustercenters = []
-        converged = False
-        try:
-            _regspace_ext.cluster(data, clustercenters, self.dmin, self.max_centers, n_jobs, self.metric)
-            converged = True
-        except _regspace_ext.MaxCentersReachedException:
+        previous = self.fetch_model()
+        clustercenters, max_reached = _regspace_ext.cluster(
+            data, None if previous is None else previous.cluster_centers, self.dmin, self.max_centers, n_jobs,
+            self.metric, two_phase=self.algorithm == 'two_phase'
+        )
+        converged = not max_reached and (previous is None or previous.converged)
+        if max_reached:
             warnings.warn('Maximum number of cluster centers reached.'
                           ' Consider increasing max_centers or choose'
                           ' a larger minimum distance, dmin.')
-        finally:
-            # even if not converged, we store the found centers.
-            clustercenters = np.asarray_chkfinite(clustercenters).squeeze()
+        # even if not converged, we store the found centers.
+        clustercenters = np.asarray_chkfinite(clustercenters)
 
-            self._model = ClusterModel(len(clustercenters), clustercenters, self.metric, converged)
+        self._model = ClusterModel(len(clustercenters), clustercenters, self.metric, converged)
 
-            if len(clustercenters) == 1:
-                warnings.warn('Have found only one center according to '
-                              'minimum distance requirement of %f' % self.dmin)
+        if len(clustercenters) == 1:
+            warnings.warn('Have found only one center according to '
+                          'minimum distance requirement of %f' % self.dmin)
 
         return self
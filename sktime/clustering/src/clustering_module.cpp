@@ -5,24 +5,52 @@
 #include "metric.h"
 #include "kmeans.h"
 #include "regspace.h"
+#include "kdtree.h"
 
 using namespace pybind11::literals;
 
 static const auto euclidean = EuclideanMetric{};
 
 template<typename T>
-std::tuple<py::object, int, int, double> castLoopResult(const std::tuple<np_array<T>, int, int, T> &input) {
+std::tuple<py::object, int, int, double, py::object> castLoopResult(
+        const std::tuple<np_array<T>, int, int, T, np_array<int>> &input, bool return_assignments) {
     const auto& arr = std::get<0>(input);
     const auto& res = std::get<1>(input);
     const auto& it =  std::get<2>(input);
     const auto& cost = std::get<3>(input);
+    auto assignments = return_assignments ? py::cast<py::object>(std::get<4>(input)) : py::none();
 
-    return std::make_tuple(py::cast<py::object>(arr), res, it, static_cast<double>(cost));
+    return std::make_tuple(py::cast<py::object>(arr), res, it, static_cast<double>(cost), assignments);
+}
+
+template<typename T>
+std::tuple<py::object, double> castClusterResult(const std::tuple<np_array<T>, T> &input) {
+    return std::make_tuple(py::cast<py::object>(std::get<0>(input)), static_cast<double>(std::get<1>(input)));
+}
+
+/**
+ * Casts optional per-frame weights to the dtype of the data, None yields an empty array.
+ */
+template<typename T>
+np_array<T> castWeights(const py::object &weights, const py::array &data) {
+    if (weights.is_none()) {
+        return np_array<T>();
+    }
+    auto w = py::cast<np_array<T>>(weights);
+    if (w.ndim() != 1 || data.ndim() != 2 || w.shape(0) != data.shape(0)) {
+        throw std::invalid_argument("weights must be one-dimensional with one entry per frame.");
+    }
+    return w;
+}
+
+template<typename T>
+const T* weightsPtr(const py::object &weights, const np_array<T> &w) {
+    return weights.is_none() ? nullptr : w.data();
 }
 
 void registerKmeans(py::module &mod) {
     mod.def("cluster", [](py::object np_chunk, py::object np_centers, int n_threads,
-                          const Metric *metric) {
+                          const Metric *metric, const py::object &weights) {
         metric = metric ? metric : &euclidean;
         auto bufChunk = py::array::ensure(np_chunk);
         auto bufCenters = py::array::ensure(np_centers);
@@ -30,18 +58,21 @@ void registerKmeans(py::module &mod) {
             throw std::invalid_argument("chunk or centers were no numpy arrays.");
         }
         if (py::isinstance<np_array<float>>(bufChunk)) {
-            return py::cast<py::object>(clustering::kmeans::cluster(py::cast<np_array<float>>(np_chunk),
-                                                                    py::cast<np_array<float>>(np_centers),
-                                                                    n_threads, metric));
+            auto w = castWeights<float>(weights, bufChunk);
+            return castClusterResult(clustering::kmeans::cluster(py::cast<np_array<float>>(np_chunk),
+                                                                 py::cast<np_array<float>>(np_centers),
+                                                                 n_threads, metric, weightsPtr(weights, w)));
         } else {
-            return py::cast<py::object>(clustering::kmeans::cluster(py::cast<np_array<double>>(np_chunk),
-                                                                    py::cast<np_array<double>>(np_centers),
-                                                                    n_threads, metric));
+            auto w = castWeights<double>(weights, bufChunk);
+            return castClusterResult(clustering::kmeans::cluster(py::cast<np_array<double>>(np_chunk),
+                                                                 py::cast<np_array<double>>(np_centers),
+                                                                 n_threads, metric, weightsPtr(weights, w)));
         }
-    }, "chunk"_a, "centers"_a, "n_threads"_a, "metric"_a = nullptr);
+    }, "chunk"_a, "centers"_a, "n_threads"_a, "metric"_a = nullptr, "weights"_a = py::none());
     mod.def("cluster_loop", [](py::object np_chunk, py::object np_centers,
                                std::size_t k, int n_threads, int max_iter, double tolerance,
-                               py::object& callback, const Metric *metric) {
+                               py::object& callback, const Metric *metric, bool return_assignments,
+                               const py::object &weights) {
         metric = metric ? metric : &euclidean;
         auto bufChunk = py::array::ensure(np_chunk);
         auto bufCenters = py::array::ensure(np_centers);
@@ -50,22 +81,91 @@ void registerKmeans(py::module &mod) {
         }
         if (py::isinstance<np_array<float>>(bufChunk)) {
             auto fCenters = py::cast<np_array<float>>(bufCenters);
+            auto w = castWeights<float>(weights, bufChunk);
             auto result = clustering::kmeans::cluster_loop(
                     py::cast<np_array<float>>(bufChunk), fCenters, k, metric, n_threads, max_iter,
-                    static_cast<float>(tolerance), callback
+                    static_cast<float>(tolerance), callback, return_assignments, weightsPtr(weights, w)
             );
-            return castLoopResult(result);
+            return castLoopResult(result, return_assignments);
         } else {
             auto dCenters = py::cast<np_array<double>>(bufCenters);
+            auto w = castWeights<double>(weights, bufChunk);
             auto result = clustering::kmeans::cluster_loop(
                     py::cast<np_array<double>>(bufChunk), dCenters, k, metric, n_threads, max_iter,
-                    tolerance, callback
+                    tolerance, callback, return_assignments, weightsPtr(weights, w)
+            );
+            return castLoopResult(result, return_assignments);
+        }
+    }, "chunk"_a, "centers"_a, "k"_a, "n_threads"_a, "max_iter"_a, "tolerance"_a, "callback"_a, "metric"_a = nullptr,
+       "return_assignments"_a = false, "weights"_a = py::none());
+    mod.def("cluster_loop_hamerly", [](py::object np_chunk, py::object np_centers, int n_threads, int max_iter,
+                                       py::object& callback, const Metric *metric, bool return_assignments,
+                                       const py::object &weights) {
+        metric = metric ? metric : &euclidean;
+        auto bufChunk = py::array::ensure(np_chunk);
+        auto bufCenters = py::array::ensure(np_centers);
+        if(!(bufChunk && bufCenters)) {
+            throw std::invalid_argument("chunk or centers were no numpy arrays.");
+        }
+        if (py::isinstance<np_array<float>>(bufChunk)) {
+            auto w = castWeights<float>(weights, bufChunk);
+            auto result = clustering::kmeans::cluster_loop_hamerly(
+                    py::cast<np_array<float>>(bufChunk), py::cast<np_array<float>>(bufCenters), metric, n_threads,
+                    max_iter, callback, return_assignments, weightsPtr(weights, w)
             );
-            return castLoopResult(result);
+            return castLoopResult(result, return_assignments);
+        } else {
+            auto w = castWeights<double>(weights, bufChunk);
+            auto result = clustering::kmeans::cluster_loop_hamerly(
+                    py::cast<np_array<double>>(bufChunk), py::cast<np_array<double>>(bufCenters), metric, n_threads,
+                    max_iter, callback, return_assignments, weightsPtr(weights, w)
+            );
+            return castLoopResult(result, return_assignments);
+        }
+    }, "chunk"_a, "centers"_a, "n_threads"_a, "max_iter"_a, "callback"_a, "metric"_a = nullptr,
+       "return_assignments"_a = false, "weights"_a = py::none());
+    mod.def("accumulate", [](py::object np_chunk, py::object np_centers, int n_threads,
+                             const Metric *metric) -> py::tuple {
+        metric = metric ? metric : &euclidean;
+        auto bufChunk = py::array::ensure(np_chunk);
+        auto bufCenters = py::array::ensure(np_centers);
+        if(!(bufChunk && bufCenters)) {
+            throw std::invalid_argument("chunk or centers were no numpy arrays.");
+        }
+        if (py::isinstance<np_array<float>>(bufChunk)) {
+            auto result = clustering::kmeans::accumulate(py::cast<np_array<float>>(bufChunk),
+                                                         py::cast<np_array<float>>(bufCenters), n_threads, metric);
+            return py::make_tuple(std::get<0>(result), std::get<1>(result), std::get<2>(result));
+        } else {
+            auto result = clustering::kmeans::accumulate(py::cast<np_array<double>>(bufChunk),
+                                                         py::cast<np_array<double>>(bufCenters), n_threads, metric);
+            return py::make_tuple(std::get<0>(result), std::get<1>(result), std::get<2>(result));
+        }
+    }, "chunk"_a, "centers"_a, "n_threads"_a, "metric"_a = nullptr);
+    mod.def("minibatch_step", [](py::object np_batch, py::object np_centers, const np_array<double> &counts,
+                                 int n_threads, const Metric *metric, const py::object &weights) -> py::tuple {
+        metric = metric ? metric : &euclidean;
+        auto bufBatch = py::array::ensure(np_batch);
+        auto bufCenters = py::array::ensure(np_centers);
+        if(!(bufBatch && bufCenters)) {
+            throw std::invalid_argument("batch or centers were no numpy arrays.");
         }
-    }, "chunk"_a, "centers"_a, "k"_a, "n_threads"_a, "max_iter"_a, "tolerance"_a, "callback"_a, "metric"_a = nullptr);
+        if (py::isinstance<np_array<float>>(bufBatch)) {
+            auto w = castWeights<float>(weights, bufBatch);
+            auto result = clustering::kmeans::minibatchStep(py::cast<np_array<float>>(bufBatch),
+                                                            py::cast<np_array<float>>(bufCenters), counts,
+                                                            n_threads, metric, weightsPtr(weights, w));
+            return py::make_tuple(std::get<0>(result), std::get<1>(result), static_cast<double>(std::get<2>(result)));
+        } else {
+            auto w = castWeights<double>(weights, bufBatch);
+            auto result = clustering::kmeans::minibatchStep(py::cast<np_array<double>>(bufBatch),
+                                                            py::cast<np_array<double>>(bufCenters), counts,
+                                                            n_threads, metric, weightsPtr(weights, w));
+            return py::make_tuple(std::get<0>(result), std::get<1>(result), static_cast<double>(std::get<2>(result)));
+        }
+    }, "batch"_a, "centers"_a, "counts"_a, "n_threads"_a, "metric"_a = nullptr, "weights"_a = py::none());
     mod.def("cost_function", [](py::object np_data, py::object np_centers, int n_threads,
-                                const Metric *metric) {
+                                const Metric *metric, const py::object &weights) {
         metric = metric ? metric : &euclidean;
         auto bufChunk = py::array::ensure(np_data);
         auto bufCenters = py::array::ensure(np_centers);
@@ -74,57 +174,177 @@ void registerKmeans(py::module &mod) {
         }
         double result;
         if (py::isinstance<np_array<float>>(bufChunk)) {
+            auto w = castWeights<float>(weights, bufChunk);
             result = static_cast<double>(clustering::kmeans::costFunction(
-                    py::cast<np_array<float>>(bufChunk), py::cast<np_array<float>>(bufCenters), metric, n_threads));
+                    py::cast<np_array<float>>(bufChunk), py::cast<np_array<float>>(bufCenters), metric, n_threads,
+                    weightsPtr(weights, w)));
         } else {
+            auto w = castWeights<double>(weights, bufChunk);
             result = clustering::kmeans::costFunction(
-                    py::cast<np_array<double>>(bufChunk), py::cast<np_array<double>>(bufCenters), metric, n_threads);
+                    py::cast<np_array<double>>(bufChunk), py::cast<np_array<double>>(bufCenters), metric, n_threads,
+                    weightsPtr(weights, w));
         }
         return result;
-    }, "chunk"_a, "centers"_a, "n threads"_a, "metric"_a = nullptr);
+    }, "chunk"_a, "centers"_a, "n threads"_a, "metric"_a = nullptr, "weights"_a = py::none());
     mod.def("init_centers_kmpp", [](py::object np_data, std::size_t k, unsigned int random_seed, int n_threads,
-                                    py::object& callback, const Metric *metric) {
+                                    py::object& callback, const Metric *metric, const py::object &weights) {
         metric = metric ? metric : &euclidean;
         auto bufChunk = py::array::ensure(np_data);
         if(!bufChunk) {
             throw std::invalid_argument("data was not a numpy array.");
         }
         if(py::isinstance<np_array<float>>(bufChunk)) {
+            auto w = castWeights<float>(weights, bufChunk);
             return py::cast<py::object>(clustering::kmeans::initCentersKMpp(
-                    py::cast<np_array<float>>(bufChunk), k, metric, random_seed, n_threads, callback
+                    py::cast<np_array<float>>(bufChunk), k, metric, random_seed, n_threads, callback,
+                    weightsPtr(weights, w)
                     ));
         } else {
+            auto w = castWeights<double>(weights, bufChunk);
             return py::cast<py::object>(clustering::kmeans::initCentersKMpp(
-                    py::cast<np_array<double>>(bufChunk), k, metric, random_seed, n_threads, callback
+                    py::cast<np_array<double>>(bufChunk), k, metric, random_seed, n_threads, callback,
+                    weightsPtr(weights, w)
             ));
         }
-    }, "chunk"_a, "k"_a, "random_seed"_a, "n_threads"_a, "callback"_a, "metric"_a = nullptr);
+    }, "chunk"_a, "k"_a, "random_seed"_a, "n_threads"_a, "callback"_a, "metric"_a = nullptr,
+       "weights"_a = py::none());
+    mod.def("init_centers_kmeans_parallel", [](py::object np_data, std::size_t k, unsigned int random_seed,
+                                               int n_threads, py::object& callback, const Metric *metric,
+                                               double oversampling_factor, std::size_t n_rounds,
+                                               const py::object &weights) {
+        metric = metric ? metric : &euclidean;
+        auto bufChunk = py::array::ensure(np_data);
+        if(!bufChunk) {
+            throw std::invalid_argument("data was not a numpy array.");
+        }
+        if(py::isinstance<np_array<float>>(bufChunk)) {
+            auto w = castWeights<float>(weights, bufChunk);
+            return py::cast<py::object>(clustering::kmeans::initCentersKMeansParallel(
+                    py::cast<np_array<float>>(bufChunk), k, metric, random_seed, n_threads, callback,
+                    oversampling_factor, n_rounds, weightsPtr(weights, w)
+            ));
+        } else {
+            auto w = castWeights<double>(weights, bufChunk);
+            return py::cast<py::object>(clustering::kmeans::initCentersKMeansParallel(
+                    py::cast<np_array<double>>(bufChunk), k, metric, random_seed, n_threads, callback,
+                    oversampling_factor, n_rounds, weightsPtr(weights, w)
+            ));
+        }
+    }, "chunk"_a, "k"_a, "random_seed"_a, "n_threads"_a, "callback"_a, "metric"_a = nullptr,
+       "oversampling_factor"_a = 2., "n_rounds"_a = 5, "weights"_a = py::none());
+    mod.def("assign_tree", [](py::object np_chunk, py::object np_node_centers, const np_array<int> &children,
+                              const np_array<int> &leaf_labels, int n_threads, const Metric *metric) {
+        metric = metric ? metric : &euclidean;
+        auto bufChunk = py::array::ensure(np_chunk);
+        auto bufCenters = py::array::ensure(np_node_centers);
+        if(!(bufChunk && bufCenters)) {
+            throw std::invalid_argument("chunk or node centers were no numpy arrays.");
+        }
+        if (py::isinstance<np_array<float>>(bufChunk)) {
+            return clustering::kmeans::assignTree(py::cast<np_array<float>>(bufChunk),
+                                                  py::cast<np_array<float>>(bufCenters), children, leaf_labels,
+                                                  n_threads, metric);
+        } else {
+            return clustering::kmeans::assignTree(py::cast<np_array<double>>(bufChunk),
+                                                  py::cast<np_array<double>>(bufCenters), children, leaf_labels,
+                                                  n_threads, metric);
+        }
+    }, "chunk"_a, "node_centers"_a, "children"_a, "leaf_labels"_a, "n_threads"_a, "metric"_a = nullptr);
+    mod.def("coreset_sensitivities", [](py::object np_data, py::object np_centers, int n_threads,
+                                        const Metric *metric, const py::object &weights) {
+        metric = metric ? metric : &euclidean;
+        auto bufChunk = py::array::ensure(np_data);
+        auto bufCenters = py::array::ensure(np_centers);
+        if(!(bufChunk && bufCenters)) {
+            throw std::invalid_argument("chunk or centers were no numpy arrays.");
+        }
+        if (py::isinstance<np_array<float>>(bufChunk)) {
+            auto w = castWeights<float>(weights, bufChunk);
+            return clustering::kmeans::coresetSensitivities(
+                    py::cast<np_array<float>>(bufChunk), py::cast<np_array<float>>(bufCenters), metric, n_threads,
+                    weightsPtr(weights, w));
+        } else {
+            auto w = castWeights<double>(weights, bufChunk);
+            return clustering::kmeans::coresetSensitivities(
+                    py::cast<np_array<double>>(bufChunk), py::cast<np_array<double>>(bufCenters), metric, n_threads,
+                    weightsPtr(weights, w));
+        }
+    }, "chunk"_a, "centers"_a, "n_threads"_a, "metric"_a = nullptr, "weights"_a = py::none());
+}
+
+template<typename T>
+std::tuple<py::object, bool> castRegspaceResult(const std::tuple<np_array<T>, bool> &input) {
+    return std::make_tuple(py::cast<py::object>(std::get<0>(input)), std::get<1>(input));
 }
 
 void registerRegspace(py::module &module) {
-    module.def("cluster", [](py::object np_chunk, py::list &py_centers, double dmin,
-            std::size_t max_n_clusters, unsigned int n_threads, const Metric *metric) {
+    module.def("cluster", [](py::object np_chunk, py::object np_centers, double dmin,
+            std::size_t max_n_clusters, unsigned int n_threads, const Metric *metric, bool two_phase) {
         metric = metric ? metric : &euclidean;
         auto bufChunk = py::array::ensure(np_chunk);
         if(!bufChunk) {
             throw std::invalid_argument("data was not a numpy array.");
         }
         if(py::isinstance<np_array<float>>(bufChunk)) {
-            clustering::regspace::cluster(py::cast<np_array<float>>(bufChunk), py_centers, static_cast<float>(dmin),
-                                          max_n_clusters, metric ? metric : &euclidean,
-                                          n_threads);
+            auto centers = np_centers.is_none() ? np_array<float>() : py::cast<np_array<float>>(np_centers);
+            auto chunk = py::cast<np_array<float>>(bufChunk);
+            return castRegspaceResult(two_phase ?
+                    clustering::regspace::cluster_two_phase(chunk, centers, static_cast<float>(dmin), max_n_clusters,
+                                                            metric, n_threads) :
+                    clustering::regspace::cluster(chunk, centers, static_cast<float>(dmin), max_n_clusters, metric,
+                                                  n_threads));
         } else {
-            clustering::regspace::cluster(py::cast<np_array<double>>(bufChunk), py_centers, static_cast<double>(dmin),
-                                          max_n_clusters, metric ? metric : &euclidean,
-                                          n_threads);
+            auto centers = np_centers.is_none() ? np_array<double>() : py::cast<np_array<double>>(np_centers);
+            auto chunk = py::cast<np_array<double>>(bufChunk);
+            return castRegspaceResult(two_phase ?
+                    clustering::regspace::cluster_two_phase(chunk, centers, dmin, max_n_clusters, metric, n_threads) :
+                    clustering::regspace::cluster(chunk, centers, dmin, max_n_clusters, metric, n_threads));
         }
+    }, "chunk"_a, "centers"_a, "dmin"_a, "max_n_clusters"_a, "n_threads"_a, "metric"_a = nullptr,
+       "two_phase"_a = false);
+}
 
-    });
-    py::register_exception<clustering::regspace::MaxCentersReachedException>(module, "MaxCentersReachedException");
+template<typename T>
+void registerKDTree(py::module &module, const char* name) {
+    using Tree = clustering::spatial::KDTree<T>;
+    py::class_<Tree>(module, name)
+            .def(py::init([](const np_array<T> &centers, std::size_t leafSize) {
+                if (centers.ndim() != 2) {
+                    throw std::invalid_argument("provided centers does not have two dimensions.");
+                }
+                return std::unique_ptr<Tree>(new Tree(centers.data(), static_cast<std::size_t>(centers.shape(0)),
+                                                      static_cast<std::size_t>(centers.shape(1)), leafSize));
+            }), "centers"_a, "leaf_size"_a = 16)
+            .def("query", [](const Tree &self, const np_array<T> &chunk, int nThreads) {
+                return clustering::spatial::query_nearest(self, chunk, nThreads);
+            }, "chunk"_a, "n_threads"_a = 0)
+            .def_property_readonly("n_centers", &Tree::n_centers)
+            .def_property_readonly("dim", &Tree::dim)
+            .def_property_readonly("leaf_size", &Tree::leaf_size)
+            .def_property_readonly("n_nodes", &Tree::n_nodes)
+            .def(py::pickle(
+                    [](const Tree &self) {
+                        std::vector<std::size_t> shape = {self.n_centers(), self.dim()};
+                        np_array<T> centers(shape);
+                        auto values = self.centers();
+                        std::copy(values.begin(), values.end(), centers.mutable_data());
+                        return py::make_tuple(centers, self.leaf_size());
+                    },
+                    [](const py::tuple &state) {
+                        if (state.size() != 2) {
+                            throw std::runtime_error("invalid state of KDTree.");
+                        }
+                        auto centers = state[0].cast<np_array<T>>();
+                        return std::unique_ptr<Tree>(new Tree(
+                                centers.data(), static_cast<std::size_t>(centers.shape(0)),
+                                static_cast<std::size_t>(centers.shape(1)), state[1].cast<std::size_t>()));
+                    }));
 }
 
 PYBIND11_MODULE(_clustering_bindings, m) {
     m.doc() = "module containing clustering algorithms.";
+    /* select the distance kernels once at import time */
+    m.attr("simd_instruction_set") = clustering::simd::name(clustering::simd::instruction_set());
     auto kmeans_mod = m.def_submodule("kmeans");
     registerKmeans(kmeans_mod);
     auto regspace_mod = m.def_submodule("regspace");
@@ -148,5 +368,15 @@ PYBIND11_MODULE(_clustering_bindings, m) {
     }, "chunk"_a, "centers"_a, "n_threads"_a, "metric"_a = nullptr);
 
     py::class_<Metric>(m, "Metric");
-    py::class_<EuclideanMetric, Metric>(m, "EuclideanMetric").def(py::init<>());
+    py::class_<EuclideanMetric, Metric>(m, "EuclideanMetric")
+            .def(py::init<>())
+            .def(py::pickle([](const EuclideanMetric &) { return py::tuple(); },
+                            [](const py::tuple &) { return EuclideanMetric(); }));
+    py::class_<MinRMSDMetric, Metric>(m, "MinRMSDMetric")
+            .def(py::init<>())
+            .def(py::pickle([](const MinRMSDMetric &) { return py::tuple(); },
+                            [](const py::tuple &) { return MinRMSDMetric(); }));
+
+    registerKDTree<float>(m, "KDTree32");
+    registerKDTree<double>(m, "KDTree64");
 }
@@ -1,6 +1,8 @@
 import itertools
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
+import scipy.sparse
 from scipy.linalg import eig
 
 from sktime.base import Estimator, Model
@@ -14,22 +16,19 @@ __author__ = 'paul, nueske, marscher, clonker'
 
 
 def ensure_timeseries_data(input_data):
+    r""" Wraps the input into a list of float32 or float64 arrays or scipy.sparse CSR matrices. Arrays are neither
+    copied nor converted, so that float32 data reaches the moments kernel as it is. Sparse matrices in other formats
+    are converted to CSR, whose rows can be sliced. """
     if not isinstance(input_data, list):
-        if not isinstance(input_data, np.ndarray):
+        if not isinstance(input_data, np.ndarray) and not scipy.sparse.issparse(input_data):
             raise ValueError('input data can not be converted to a list of arrays')
-        elif isinstance(input_data, np.ndarray):
-            if input_data.dtype not in (np.float32, np.float64):
-                raise ValueError('only float and double dtype is supported')
-            return [input_data]
-    else:
-        for i, x in enumerate(input_data):
-            if not isinstance(x, np.ndarray):
-                raise ValueError(f'element {i} of given input data list is not an array.')
-            else:
-                if x.dtype not in (np.float32, np.float64):
-                    raise ValueError('only float and double dtype is supported')
-                input_data[i] = x
-    return input_data
+        input_data = [input_data]
+    for i, x in enumerate(input_data):
+        if not isinstance(x, np.ndarray) and not scipy.sparse.issparse(x):
+            raise ValueError(f'element {i} of given input data list is not an array.')
+        if x.dtype not in (np.float32, np.float64):
+            raise ValueError('only float and double dtype is supported')
+    return [x.tocsr() if scipy.sparse.issparse(x) else x for x in input_data]
 
 
 class OnlineCovarianceModel(Model):
@@ -119,23 +118,30 @@ class OnlineCovariance(Estimator):
         self.ncov = ncov
         self.diag_only = diag_only
 
-        self._rc = running_covar(xx=self.compute_c00, xy=self.compute_c0t, yy=self.compute_ctt,
-                                 remove_mean=self.remove_data_mean, symmetrize=self.reversible,
-                                 sparse_mode=self.sparse_mode, modify_data=False, diag_only=self.diag_only,
-                                 nsave=ncov)
+        self._rc = self._new_running_covar()
+
+    def _new_running_covar(self, n_threads=1):
+        return running_covar(xx=self.compute_c00, xy=self.compute_c0t, yy=self.compute_ctt,
+                             remove_mean=self.remove_data_mean, symmetrize=self.reversible,
+                             sparse_mode=self.sparse_mode, modify_data=False, diag_only=self.diag_only,
+                             nsave=self.ncov, n_threads=n_threads)
 
     @property
     def is_lagged(self) -> bool:
         return self.compute_c0t or self.compute_ctt
 
-    def fit(self, data, lagtime=None, weights=None, n_splits=None, column_selection=None):
+    def fit(self, data, lagtime=None, weights=None, n_splits=None, column_selection=None, n_jobs=None):
         """
          column_selection: ndarray(k, dtype=int) or None
          Indices of those columns that are to be computed. If None, all columns are computed.
-        :param data: list of sequences (n elements)
+        :param data: list of sequences (n elements), arrays or scipy.sparse matrices
         :param weights: list of weight arrays (n elements) or array (shape
         :param n_splits:
         :param column_selection:
+        :param n_jobs: None or int, total number of threads. If larger than one, the trajectories are split into
+            contiguous groups, whose moments are accumulated concurrently and merged pairwise afterwards, the
+            threads being split among the groups. A single trajectory uses all threads in the moments kernel. None
+            is the same as 1, i.e., the chunks are processed one by one on a single thread.
         :return:
         """
         # TODO: constistent dtype
@@ -144,7 +150,7 @@ class OnlineCovariance(Estimator):
         self._rc.clear()
 
         if n_splits is None:
-            dlen = min(len(d) for d in data)
+            dlen = min(d.shape[0] for d in data)
             n_splits = int(dlen // 100 if dlen >= 1e4 else 1)
 
         if lagtime is None:
@@ -159,24 +165,58 @@ class OnlineCovariance(Estimator):
         if weights is not None:
             if hasattr(weights, 'weights'):
                 lazy_weights = True
-            elif len(np.atleast_1d(weights)) != len(data[0]):
+            elif len(np.atleast_1d(weights)) != data[0].shape[0]:
                 raise ValueError(
                     "Weights have incompatible shape "
-                    f"(#weights={len(weights) if weights is not None else None} != {len(data[0])}=#frames.")
+                    f"(#weights={len(weights) if weights is not None else None} != {data[0].shape[0]}=#frames.")
             elif isinstance(weights, np.ndarray):
                 wsplit = np.array_split(weights, n_splits)
 
         if self.is_lagged:
-            for (x, y), w in zip(timeshifted_split(data, lagtime=lagtime, n_splits=n_splits), wsplit):
+            chunks = zip(timeshifted_split(data, lagtime=lagtime, n_splits=n_splits), wsplit)
+        else:
+            chunks = zip(data, itertools.repeat(weights))
+
+        def add(rc, chunk):
+            x, w = chunk
+            if self.is_lagged:
                 if lazy_weights:
-                    w = weights.weights(x)
+                    w = weights.weights(x[0])
                 # weights can weights be shorter than actual data
                 if isinstance(w, np.ndarray):
-                    w = w[:len(x)]
-                self.partial_fit((x, y), weights=w, column_selection=column_selection)
+                    w = w[:x[0].shape[0]]
+            self._add(rc, x, weights=w, column_selection=column_selection)
+
+        if n_jobs is None:
+            n_jobs = 1
+        if n_jobs <= 1 or len(data) == 1:
+            n_threads = self._rc.n_threads
+            self._rc.n_threads = max(n_jobs, 1)
+            try:
+                for chunk in chunks:
+                    add(self._rc, chunk)
+            finally:
+                self._rc.n_threads = n_threads
         else:
-            for x in data:
-                self.partial_fit(x, weights=weights, column_selection=column_selection)
+            # the moments kernel releases the GIL, hence groups of trajectories are accumulated concurrently
+            chunks = list(chunks)
+            n_workers = min(len(data), n_jobs)
+            n_threads = n_jobs // n_workers
+            groups = [g for g in np.array_split(np.arange(len(chunks)), n_workers) if len(g) > 0]
+
+            def accumulate(group):
+                rc = self._new_running_covar(n_threads)
+                for i in group:
+                    add(rc, chunks[i])
+                return rc
+
+            with ThreadPoolExecutor(max_workers=len(groups)) as executor:
+                partial = list(executor.map(accumulate, groups))
+            # merge neighboring groups pairwise, so that merged moments have similar weights
+            while len(partial) > 1:
+                partial = [partial[i].combine(partial[i + 1]) if i + 1 < len(partial) else partial[i]
+                           for i in range(0, len(partial), 2)]
+            self._rc.combine(partial[0])
 
         return self
 
@@ -189,17 +229,20 @@ class OnlineCovariance(Estimator):
         weights: the weights as 1d array with length len(data)
         column_selection: the column selection
         """
+        self._add(self._rc, data, weights=weights, column_selection=column_selection)
+        return self
+
+    def _add(self, rc, data, weights=None, column_selection=None):
         if self.is_lagged:
             x, y = data
         else:
             x, y = data, None
         # TODO: types, shapes checking!
         try:
-            self._rc.add(x, y, column_selection=column_selection, weights=weights)
+            rc.add(x, y, column_selection=column_selection, weights=weights)
         except MemoryError:
             raise MemoryError('Covariance matrix does not fit into memory. '
                               'Input is too high-dimensional ({} dimensions). '.format(x.shape[1]))
-        return self
 
     def fetch_model(self) -> OnlineCovarianceModel:
         cov_00 = cov_tt = cov_0t = mean_0 = mean_t = None
@@ -240,8 +283,8 @@ class KoopmanEstimator(Estimator):
         self._cov = OnlineCovariance(lagtime=lagtime, compute_c00=True, compute_c0t=True, remove_data_mean=True, reversible=False,
                                      bessels_correction=False, ncov=ncov)
 
-    def fit(self, data, y=None, lagtime=None):
-        self._cov.fit(data, lagtime=lagtime)
+    def fit(self, data, y=None, lagtime=None, n_jobs=None):
+        self._cov.fit(data, lagtime=lagtime, n_jobs=n_jobs)
         self.fetch_model()  # pre-compute Koopman operator
         return self
 
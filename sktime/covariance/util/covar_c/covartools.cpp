@@ -1,8 +1,10 @@
 #include <pybind11/pybind11.h>
 
 #include "covartools.hpp"
+#include "moments.hpp"
 
 namespace py = pybind11;
+using namespace pybind11::literals;
 
 
 PYBIND11_MODULE(_covartools, m) {
@@ -16,4 +18,12 @@ PYBIND11_MODULE(_covartools, m) {
     m.def("variable_cols_long", &_variable_cols<long>);
     m.def("variable_cols_float", &_variable_cols<float>);
     m.def("variable_cols_double", &_variable_cols<double>);
+
+    // ================================================
+    // Fused first and second moments
+    // ================================================
+    m.def("moments_float", &moments::moments<float>, "X"_a, "Y"_a, "weights"_a, "shift_x"_a, "shift_y"_a,
+          "compute_xx"_a, "compute_xy"_a, "compute_yy"_a, "n_threads"_a);
+    m.def("moments_double", &moments::moments<double>, "X"_a, "Y"_a, "weights"_a, "shift_x"_a, "shift_y"_a,
+          "compute_xx"_a, "compute_xy"_a, "compute_yy"_a, "n_threads"_a);
 }
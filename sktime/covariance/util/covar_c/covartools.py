@@ -54,3 +54,52 @@ def variable_cols(X, tol=0.0, min_constant=0):
         return numpy.ones_like(cols, dtype=numpy.bool)
 
     return cols
+
+
+def moments(X, Y=None, weights=None, shift_x=None, shift_y=None, compute_xx=True, compute_xy=False,
+            compute_yy=False, n_threads=1):
+    """ Computes the first two moments of X and Y in a single multi-threaded pass without copying the data
+
+    Parameters
+    ----------
+    X : ndarray (T, M)
+        C-contiguous float32 or float64 data matrix.
+    Y : ndarray (T, N) or None
+        C-contiguous data matrix of the same data type as X.
+    weights : ndarray (T,) or None
+        weights of the rows, if None, all rows have weight one.
+    shift_x : ndarray (M,) or None
+        vector a which is subtracted from the rows of X before forming the products.
+    shift_y : ndarray (N,) or None
+        vector b which is subtracted from the rows of Y before forming the products.
+    compute_xx, compute_xy, compute_yy : bool
+        which of the second moment matrices to compute.
+    n_threads : int
+        number of OpenMP threads. The results do not depend on the number of threads.
+
+    Returns
+    -------
+    w : float
+        sum of the weights
+    sx : ndarray (M)
+        weighted column sum of X - a
+    sy : ndarray (N) or None
+        weighted column sum of Y - b
+    Mxx : ndarray (M, M) or None
+        weighted second moment matrix of X - a
+    Mxy : ndarray (M, N) or None
+        weighted second moment matrix of X - a and Y - b
+    Myy : ndarray (N, N) or None
+        weighted second moment matrix of Y - b
+
+    """
+    from ._covartools import moments_float, moments_double
+    if X.dtype == numpy.float64:
+        fun = moments_double
+    elif X.dtype == numpy.float32:
+        fun = moments_float
+    else:
+        raise TypeError('unsupported type of X: %s' % X.dtype)
+    if weights is not None:
+        weights = numpy.asarray(weights, dtype=numpy.float64)
+    return fun(X, Y, weights, shift_x, shift_y, compute_xx, compute_xy, compute_yy, n_threads)
@@ -0,0 +1,415 @@
+#pragma once
+
+#include <algorithm>
+#include <cstddef>
+#include <stdexcept>
+#include <vector>
+
+#ifdef USE_OPENMP
+#include <omp.h>
+#endif
+
+#include <pybind11/pybind11.h>
+#include <pybind11/numpy.h>
+
+#if defined(__x86_64__) && (defined(__GNUC__) || defined(__clang__))
+#define MOMENTS_SIMD_X86 1
+#include <immintrin.h>
+#endif
+
+namespace py = pybind11;
+
+namespace moments {
+
+template<typename dtype>
+using np_array = py::array_t<dtype, py::array::c_style>;
+
+namespace detail {
+
+/** width of the square tiles of the moment matrices, each tile is accumulated by a single thread */
+static constexpr std::size_t tile = 64;
+
+/**
+ * Calls fun(index, team_size) on a team of at most n_threads OpenMP threads, where index enumerates the threads of
+ * the team. Without OpenMP, the team consists of the calling thread only.
+ */
+template<typename Function>
+void run_team(unsigned int n_threads, Function &&fun) {
+#ifdef USE_OPENMP
+    #pragma omp parallel num_threads(static_cast<int>(std::max(n_threads, 1u)))
+    {
+        fun(static_cast<std::size_t>(omp_get_thread_num()), static_cast<std::size_t>(omp_get_num_threads()));
+    }
+#else
+    fun(0, 1);
+#endif
+}
+
+/** Synchronizes the threads of the team started by run_team. */
+inline void barrier() {
+#ifdef USE_OPENMP
+    #pragma omp barrier
+#endif
+}
+
+/** A shifted and weighted data matrix, (w_t (x_t - a)) or (x_t - a), which is never materialized. */
+template<typename dtype>
+struct Operand {
+    const dtype* data;
+    const dtype* shift;
+    std::size_t n_cols;
+};
+
+/**
+ * Micro kernels add the products of k packed rows to a block of mr x nr accumulators, which stay in registers:
+ * acc[r * ld_acc + j] += sum_l u[l * mr + r] * v[l * nr + j]. Every accumulator sums up the rows in their order.
+ */
+struct MicroKernel {
+    std::size_t mr, nr;
+    void (*fun)(const double*, const double*, std::size_t, double*, std::size_t);
+};
+
+inline void micro_portable(const double* u, const double* v, std::size_t k, double* acc, std::size_t ld_acc) {
+    double a[4][8];
+    for (std::size_t r = 0; r < 4; ++r) {
+        std::copy(acc + r * ld_acc, acc + r * ld_acc + 8, a[r]);
+    }
+    for (std::size_t l = 0; l < k; ++l) {
+        for (std::size_t r = 0; r < 4; ++r) {
+            const double x = u[l * 4 + r];
+            for (std::size_t j = 0; j < 8; ++j) {
+                a[r][j] += x * v[l * 8 + j];
+            }
+        }
+    }
+    for (std::size_t r = 0; r < 4; ++r) {
+        std::copy(a[r], a[r] + 8, acc + r * ld_acc);
+    }
+}
+
+#ifdef MOMENTS_SIMD_X86
+
+__attribute__((target("avx2,fma")))
+inline void micro_avx2(const double* u, const double* v, std::size_t k, double* acc, std::size_t ld_acc) {
+    __m256d a[4][2];
+    for (std::size_t r = 0; r < 4; ++r) {
+        a[r][0] = _mm256_loadu_pd(acc + r * ld_acc);
+        a[r][1] = _mm256_loadu_pd(acc + r * ld_acc + 4);
+    }
+    for (std::size_t l = 0; l < k; ++l) {
+        __m256d v0 = _mm256_loadu_pd(v + l * 8);
+        __m256d v1 = _mm256_loadu_pd(v + l * 8 + 4);
+        #pragma GCC unroll 4
+        for (std::size_t r = 0; r < 4; ++r) {
+            __m256d x = _mm256_broadcast_sd(u + l * 4 + r);
+            a[r][0] = _mm256_fmadd_pd(x, v0, a[r][0]);
+            a[r][1] = _mm256_fmadd_pd(x, v1, a[r][1]);
+        }
+    }
+    for (std::size_t r = 0; r < 4; ++r) {
+        _mm256_storeu_pd(acc + r * ld_acc, a[r][0]);
+        _mm256_storeu_pd(acc + r * ld_acc + 4, a[r][1]);
+    }
+}
+
+__attribute__((target("avx512f")))
+inline void micro_avx512(const double* u, const double* v, std::size_t k, double* acc, std::size_t ld_acc) {
+    __m512d a[8][2];
+    for (std::size_t r = 0; r < 8; ++r) {
+        a[r][0] = _mm512_loadu_pd(acc + r * ld_acc);
+        a[r][1] = _mm512_loadu_pd(acc + r * ld_acc + 8);
+    }
+    for (std::size_t l = 0; l < k; ++l) {
+        __m512d v0 = _mm512_loadu_pd(v + l * 16);
+        __m512d v1 = _mm512_loadu_pd(v + l * 16 + 8);
+        #pragma GCC unroll 8
+        for (std::size_t r = 0; r < 8; ++r) {
+            __m512d x = _mm512_set1_pd(u[l * 8 + r]);
+            a[r][0] = _mm512_fmadd_pd(x, v0, a[r][0]);
+            a[r][1] = _mm512_fmadd_pd(x, v1, a[r][1]);
+        }
+    }
+    for (std::size_t r = 0; r < 8; ++r) {
+        _mm512_storeu_pd(acc + r * ld_acc, a[r][0]);
+        _mm512_storeu_pd(acc + r * ld_acc + 8, a[r][1]);
+    }
+}
+
+#endif
+
+/** the widest micro kernel supported by the CPU, SSE2 is left to the compiler */
+inline MicroKernel select_micro_kernel() {
+#ifdef MOMENTS_SIMD_X86
+    __builtin_cpu_init();
+    if (__builtin_cpu_supports("avx512f")) {
+        return {8, 16, &micro_avx512};
+    }
+    if (__builtin_cpu_supports("avx2") && __builtin_cpu_supports("fma")) {
+        return {4, 8, &micro_avx2};
+    }
+#endif
+    return {4, 8, &micro_portable};
+}
+
+inline const MicroKernel &micro_kernel() {
+    static const MicroKernel kernel = select_micro_kernel();
+    return kernel;
+}
+
+inline std::size_t round_up(std::size_t n, std::size_t multiple) {
+    return (n + multiple - 1) / multiple * multiple;
+}
+
+/**
+ * A block of k rows of an operand, shifted, weighted, converted to double and stored in panels of the given width,
+ * i.e., column c of row l is stored at data[(c / width) * k * width + l * width + c % width], such that the micro
+ * kernels read contiguous memory. The last panel is padded with zeros.
+ */
+template<typename dtype>
+struct Packed {
+    const Operand<dtype>* operand;
+    const double* weights;
+    std::size_t width;
+    std::vector<double> data;
+
+    Packed(const Operand<dtype>* operand, const double* weights, std::size_t width, std::size_t depth)
+            : operand(operand), weights(weights), width(width),
+              data(operand ? depth * round_up(operand->n_cols, width) : 0) {}
+
+    std::size_t n_panels() const {
+        return operand ? round_up(operand->n_cols, width) / width : 0;
+    }
+
+    void pack_panel(std::size_t panel, std::size_t t0, std::size_t k) {
+        auto begin = panel * width;
+        auto n = std::min(width, operand->n_cols - begin);
+        double* out = data.data() + begin * k;
+        for (std::size_t l = 0; l < k; ++l, out += width) {
+            const dtype* x = operand->data + (t0 + l) * operand->n_cols + begin;
+            const double w = weights ? weights[t0 + l] : 1.;
+            for (std::size_t c = 0; c < n; ++c) {
+                out[c] = w * (operand->shift ? static_cast<double>(x[c]) - static_cast<double>(operand->shift[begin + c])
+                                             : static_cast<double>(x[c]));
+            }
+            std::fill(out + n, out + width, 0.);
+        }
+    }
+};
+
+/** Accumulators of sum_t w_t u_t v_t^T, padded to multiples of the micro kernel's block size. */
+template<typename dtype>
+struct Product {
+    const Packed<dtype>* u;
+    const Packed<dtype>* v;
+    bool symmetric;
+    std::size_t ld;
+    std::vector<double> acc;
+
+    Product(const Packed<dtype>* u, const Packed<dtype>* v, bool symmetric)
+            : u(u), v(v), symmetric(symmetric), ld(v->n_panels() * v->width),
+              acc(u->n_panels() * u->width * ld, 0.) {}
+
+    /** adds k packed rows to the tile starting at (row, col), blocks below the diagonal are skipped if symmetric */
+    void accumulate(std::size_t row, std::size_t col, std::size_t k, const MicroKernel &kernel) {
+        auto row_end = std::min(row + tile, u->n_panels() * u->width);
+        auto col_end = std::min(col + tile, ld);
+        for (auto j = col; j < col_end; j += kernel.nr) {
+            for (auto i = row; i < row_end; i += kernel.mr) {
+                if (symmetric && i >= j + kernel.nr) {
+                    break;
+                }
+                kernel.fun(u->data.data() + i * k, v->data.data() + j * k, k, acc.data() + i * ld + j, ld);
+            }
+        }
+    }
+
+    /** copies the accumulators into the output of shape (n_i, n_j), mirroring the upper triangle if symmetric */
+    void store(double* out, std::size_t n_i, std::size_t n_j) const {
+        for (std::size_t i = 0; i < n_i; ++i) {
+            for (std::size_t j = 0; j < n_j; ++j) {
+                out[i * n_j + j] = symmetric && j < i ? acc[j * ld + i] : acc[i * ld + j];
+            }
+        }
+    }
+};
+
+/** Work item of a block of rows: packing a panel, adding the rows to a tile or to the column sums of a panel. */
+struct Task {
+    enum Kind { pack, product, sum } kind;
+    std::size_t index, row, col;
+};
+
+template<typename dtype>
+const dtype* shiftPtr(const py::object &shift, std::size_t n_cols, np_array<dtype> &buffer) {
+    if (shift.is_none()) {
+        return nullptr;
+    }
+    buffer = py::cast<np_array<dtype>>(shift);
+    if (buffer.ndim() != 1 || static_cast<std::size_t>(buffer.shape(0)) != n_cols) {
+        throw std::invalid_argument("the shift has to be a vector with one entry per column.");
+    }
+    return buffer.data();
+}
+
+}
+
+/**
+ * Computes the first two moments of the data X and Y in a single pass over the buffers, i.e., without copying,
+ * converting or centering the data beforehand. With the shifts a and b, the results are
+ *
+ *     w = sum_t w_t,   s_x = sum_t w_t (x_t - a),   s_y = sum_t w_t (y_t - b),
+ *     P_xx = sum_t w_t (x_t - a)(x_t - a)^T,   P_xy = sum_t w_t (x_t - a)(y_t - b)^T,
+ *     P_yy = sum_t w_t (y_t - b)(y_t - b)^T.
+ *
+ * Shifting by a data point keeps the cancellation small when the moments are centered afterwards. The sums are
+ * accumulated in double precision, each tile of the moment matrices by a single thread and in the order of the rows,
+ * hence the results do not depend on the number of threads. Only the upper triangle of P_xx and P_yy is computed.
+ *
+ * @param np_X array of shape (T, M)
+ * @param np_Y None or array of shape (T, N)
+ * @param np_weights None or array of shape (T,)
+ * @param shift_x None or vector a of shape (M,)
+ * @param shift_y None or vector b of shape (N,)
+ * @param n_threads number of OpenMP threads, 0 or 1 accumulates on the calling thread
+ * @return tuple (w, s_x, s_y, P_xx, P_xy, P_yy), where entries which were not requested are None
+ */
+template<typename dtype>
+py::tuple moments(const np_array<dtype> &np_X, const py::object &np_Y, const py::object &np_weights,
+                  const py::object &shift_x, const py::object &shift_y, bool compute_xx, bool compute_xy,
+                  bool compute_yy, unsigned int n_threads) {
+    if (np_X.ndim() != 2) {
+        throw std::invalid_argument("X has to be a two-dimensional array.");
+    }
+    auto n_rows = static_cast<std::size_t>(np_X.shape(0));
+    auto dim_x = static_cast<std::size_t>(np_X.shape(1));
+
+    np_array<dtype> Y;
+    bool has_y = !np_Y.is_none();
+    if (has_y) {
+        Y = py::cast<np_array<dtype>>(np_Y);
+        if (Y.ndim() != 2 || static_cast<std::size_t>(Y.shape(0)) != n_rows) {
+            throw std::invalid_argument("Y has to be a two-dimensional array with as many rows as X.");
+        }
+    } else if (compute_xy || compute_yy) {
+        throw std::invalid_argument("Y is required for the moments XY and YY.");
+    }
+    auto dim_y = has_y ? static_cast<std::size_t>(Y.shape(1)) : 0;
+
+    np_array<double> weights;
+    const double* w = nullptr;
+    if (!np_weights.is_none()) {
+        weights = py::cast<np_array<double>>(np_weights);
+        if (weights.ndim() != 1 || static_cast<std::size_t>(weights.shape(0)) != n_rows) {
+            throw std::invalid_argument("weights must have one entry per row of X.");
+        }
+        w = weights.data();
+    }
+    np_array<dtype> buffer_x, buffer_y;
+    detail::Operand<dtype> x {np_X.data(), detail::shiftPtr(shift_x, dim_x, buffer_x), dim_x};
+    detail::Operand<dtype> y {has_y ? Y.data() : nullptr, has_y ? detail::shiftPtr(shift_y, dim_y, buffer_y) : nullptr,
+                              dim_y};
+
+    np_array<double> sx(std::vector<std::size_t>{dim_x}), sy(std::vector<std::size_t>{dim_y});
+    np_array<double> Pxx(std::vector<std::size_t>{compute_xx ? dim_x : 0, compute_xx ? dim_x : 0});
+    np_array<double> Pxy(std::vector<std::size_t>{compute_xy ? dim_x : 0, compute_xy ? dim_y : 0});
+    np_array<double> Pyy(std::vector<std::size_t>{compute_yy ? dim_y : 0, compute_yy ? dim_y : 0});
+    double total_weight = static_cast<double>(n_rows);
+    {
+        py::gil_scoped_release release;
+        if (w) {
+            total_weight = 0;
+            for (std::size_t t = 0; t < n_rows; ++t) {
+                total_weight += w[t];
+            }
+        }
+        const auto &kernel = detail::micro_kernel();
+        /* blocks of rows are packed such that the packed panels of both operands stay in the cache */
+        auto depth = std::min(static_cast<std::size_t>(8192),
+                              std::max(static_cast<std::size_t>(256), (1u << 16) / std::max(std::max(dim_x, dim_y),
+                                                                                            static_cast<std::size_t>(1))));
+        /* the weights go into the left operands, which are also used for the column sums */
+        detail::Packed<dtype> xu(&x, w, kernel.mr, depth), xv(compute_xx ? &x : nullptr, nullptr, kernel.nr, depth);
+        detail::Packed<dtype> yu(has_y ? &y : nullptr, w, kernel.mr, depth);
+        detail::Packed<dtype> yv(compute_xy || compute_yy ? &y : nullptr, nullptr, kernel.nr, depth);
+        std::vector<detail::Packed<dtype>*> packed {&xu, &xv, &yu, &yv};
+        std::vector<detail::Product<dtype>> products;
+        std::vector<double*> outputs;
+        if (compute_xx) {
+            products.emplace_back(&xu, &xv, true);
+            outputs.push_back(Pxx.mutable_data());
+        }
+        if (compute_xy) {
+            products.emplace_back(&xu, &yv, false);
+            outputs.push_back(Pxy.mutable_data());
+        }
+        if (compute_yy) {
+            products.emplace_back(&yu, &yv, true);
+            outputs.push_back(Pyy.mutable_data());
+        }
+        std::vector<std::vector<double>> sums {std::vector<double>(xu.n_panels() * kernel.mr, 0.),
+                                               std::vector<double>(yu.n_panels() * kernel.mr, 0.)};
+
+        std::vector<detail::Task> pack_tasks, tasks;
+        for (std::size_t p = 0; p < packed.size(); ++p) {
+            for (std::size_t panel = 0; panel < packed[p]->n_panels(); ++panel) {
+                pack_tasks.push_back({detail::Task::pack, p, panel, 0});
+            }
+        }
+        for (std::size_t p = 0; p < products.size(); ++p) {
+            const auto &product = products[p];
+            for (std::size_t i = 0; i < product.acc.size() / product.ld; i += detail::tile) {
+                for (std::size_t j = product.symmetric ? i : 0; j < product.ld; j += detail::tile) {
+                    tasks.push_back({detail::Task::product, p, i, j});
+                }
+            }
+        }
+        for (std::size_t p = 0; p < 2; ++p) {
+            for (std::size_t panel = 0; panel < packed[2 * p]->n_panels(); ++panel) {
+                tasks.push_back({detail::Task::sum, p, panel, 0});
+            }
+        }
+
+        /* Every thread handles a fixed subset of the tasks, hence each tile and column sum is accumulated by the same
+         * thread in the order of the rows and the results do not depend on the number of threads. */
+        auto team_size = std::max(std::min(static_cast<std::size_t>(n_threads), tasks.size()),
+                                  static_cast<std::size_t>(1));
+        detail::run_team(static_cast<unsigned int>(team_size), [&](std::size_t index, std::size_t n_team) {
+            for (std::size_t t0 = 0; t0 < n_rows; t0 += depth) {
+                auto k = std::min(depth, n_rows - t0);
+                for (auto task = index; task < pack_tasks.size(); task += n_team) {
+                    packed[pack_tasks[task].index]->pack_panel(pack_tasks[task].row, t0, k);
+                }
+                detail::barrier();
+                for (auto task = index; task < tasks.size(); task += n_team) {
+                    const auto &t = tasks[task];
+                    if (t.kind == detail::Task::product) {
+                        products[t.index].accumulate(t.row, t.col, k, kernel);
+                    } else {
+                        const double* panel = packed[2 * t.index]->data.data() + t.row * kernel.mr * k;
+                        double* s = sums[t.index].data() + t.row * kernel.mr;
+                        for (std::size_t l = 0; l < k; ++l) {
+                            for (std::size_t c = 0; c < kernel.mr; ++c) {
+                                s[c] += panel[l * kernel.mr + c];
+                            }
+                        }
+                    }
+                }
+                detail::barrier();
+            }
+        });
+
+        std::copy(sums[0].begin(), sums[0].begin() + dim_x, sx.mutable_data());
+        std::copy(sums[1].begin(), sums[1].begin() + dim_y, sy.mutable_data());
+        for (std::size_t p = 0; p < products.size(); ++p) {
+            auto n_i = products[p].u->operand->n_cols;
+            auto n_j = products[p].v->operand->n_cols;
+            products[p].store(outputs[p], n_i, n_j);
+        }
+    }
+    return py::make_tuple(total_weight, sx, has_y ? py::cast<py::object>(sy) : py::none(),
+                          compute_xx ? py::cast<py::object>(Pxx) : py::none(),
+                          compute_xy ? py::cast<py::object>(Pxy) : py::none(),
+                          compute_yy ? py::cast<py::object>(Pyy) : py::none());
+}
+
+}
@@ -70,6 +70,15 @@ take the following actions:
     4. Run operation on the new array X0 (Y0), including in-place substraction
        of the mean if needed.
 
+scipy.sparse Input
+------------------
+Data matrices with mostly zero entries can also be given as scipy.sparse
+matrices (preferably CSR). Then the sums and the products X^T X, X^T Y are
+computed by sparse matrix products and the data is never densified. The mean
+is removed analytically afterwards, C = X^T X - s s^T / w, which gives a dense
+matrix. Without mean removal, the second moment matrices stay sparse unless
+more than a fraction of _SPARSE_FILL of their entries is nonzero.
+
 """
 
 __author__ = 'noe'
@@ -77,6 +86,7 @@ __author__ = 'noe'
 import math
 import numbers
 import numpy as np
+import scipy.sparse
 from .covar_c import covartools
 
 
@@ -598,6 +608,216 @@ def _M2_symmetric(Xvar, Yvar, mask_X=None, mask_Y=None, xsum=0, xconst=0, ysum=0
     return Cxxyy, Cxyyx
 
 
+# =================================================
+# SCIPY.SPARSE INPUT
+# =================================================
+
+#: fill fraction above which second moment matrices of scipy.sparse data are returned as dense arrays
+_SPARSE_FILL = 0.1
+
+
+def _csr_float(X):
+    """ converts a scipy.sparse matrix (or an array) to a CSR matrix of float64, sharing the data if possible """
+    return scipy.sparse.csr_matrix(X, dtype=np.float64)
+
+
+def _sum_csr(X, weights=None):
+    """ weighted column sums of a CSR matrix """
+    if weights is None:
+        return np.asarray(X.sum(axis=0)).ravel()
+    return X.T.dot(weights)
+
+
+def _M2_csr(pairs, weights=None, diag_only=False, mean_free=None):
+    r""" Second moment matrix :math:`\sum_{(A, B)} A^\top W B` over pairs of CSR matrices.
+
+    If mean_free=(w, s_a, s_b) is given, the mean is removed analytically, C - s_a s_b^T / w, and the result is dense.
+    Otherwise the result is a sparse matrix unless it is filled more than _SPARSE_FILL.
+    """
+    C = 0
+    for A, B in pairs:
+        if weights is not None:
+            A = A.multiply(weights[:, np.newaxis]).tocsr()
+        if diag_only:
+            C = C + np.asarray(A.multiply(B).sum(axis=0)).ravel()
+        else:
+            C = C + A.T.dot(B)
+    if mean_free is not None:
+        w, s_a, s_b = mean_free
+        if diag_only:
+            return C - s_a * s_b / w
+        return C.toarray() - np.outer(s_a, s_b / w)
+    if not diag_only:
+        C = C.tocsr()
+        if C.nnz > _SPARSE_FILL * C.shape[0] * C.shape[1]:
+            C = C.toarray()
+    return C
+
+
+def _moments_XX_csr(X, remove_mean=False, weights=None, column_selection=None, diag_only=False):
+    """ moments_XX for scipy.sparse data """
+    X = _csr_float(X)
+    w = float(X.shape[0] if weights is None else np.sum(weights))
+    sx = _sum_csr(X, weights)
+    cols = slice(None) if column_selection is None else column_selection
+    C = _M2_csr([(X, X[:, cols])], weights=weights, diag_only=diag_only,
+                mean_free=(w, sx, sx[cols]) if remove_mean else None)
+    return w, sx, C
+
+
+def _moments_XXXY_csr(X, Y, remove_mean=False, symmetrize=False, weights=None, column_selection=None,
+                      diag_only=False):
+    """ moments_XXXY for scipy.sparse data """
+    X, Y = _csr_float(X), _csr_float(Y)
+    w = float(X.shape[0] if weights is None else np.sum(weights))
+    sx, sy = _sum_csr(X, weights), _sum_csr(Y, weights)
+    cols = slice(None) if column_selection is None else column_selection
+    Xk, Yk = X[:, cols], Y[:, cols]
+    if symmetrize:
+        w = 2 * w
+        sx = sx + sy
+        sy = sx
+        pairs_xx, pairs_xy = [(X, Xk), (Y, Yk)], [(X, Yk), (Y, Xk)]
+    else:
+        pairs_xx, pairs_xy = [(X, Xk)], [(X, Yk)]
+    Cxx = _M2_csr(pairs_xx, weights=weights, diag_only=diag_only, mean_free=(w, sx, sx[cols]) if remove_mean else None)
+    Cxy = _M2_csr(pairs_xy, weights=weights, diag_only=diag_only, mean_free=(w, sx, sy[cols]) if remove_mean else None)
+    return w, sx, sy, Cxx, Cxy
+
+
+def _moments_block_csr(X, Y, remove_mean=False, column_selection=None, diag_only=False):
+    """ moments_block for scipy.sparse data """
+    X, Y = _csr_float(X), _csr_float(Y)
+    w = float(X.shape[0])
+    sx, sy = _sum_csr(X), _sum_csr(Y)
+    cols = slice(None) if column_selection is None else column_selection
+    Xk, Yk = X[:, cols], Y[:, cols]
+
+    def M2(A, B, s_a, s_b):
+        return _M2_csr([(A, B)], diag_only=diag_only, mean_free=(w, s_a, s_b[cols]) if remove_mean else None)
+
+    Cxx = M2(X, Xk, sx, sx)
+    Cxy = M2(X, Yk, sx, sy)
+    Cyx = Cxy.T if column_selection is None else M2(Y, Xk, sy, sx)
+    Cyy = M2(Y, Yk, sy, sy)
+    return w, (sx, sy), ((Cxx, Cxy), (Cyx, Cyy))
+
+
+# =================================================
+# FUSED NATIVE MOMENTS
+# =================================================
+
+
+def _native_supported(X, Y=None, sparse_mode='auto', column_selection=None, diag_only=False):
+    """ Checks whether the fused native kernel can compute the moments directly on the buffers of X and Y.
+
+    This is the case for C-contiguous float32 or float64 data of equal data type, when neither constant columns are
+    to be removed explicitly (sparse_mode='sparse'), nor a column selection or the diagonal only is requested.
+
+    """
+    if sparse_mode.lower() == 'sparse' or column_selection is not None or diag_only:
+        return False
+    arrays = (X,) if Y is None else (X, Y)
+    return all(isinstance(A, np.ndarray) and A.ndim == 2 and A.dtype in (np.float32, np.float64)
+               and A.dtype == X.dtype and A.flags.c_contiguous for A in arrays)
+
+
+def _recenter(M, w, s1, s2, d1, d2):
+    r""" Moves the centers of a second moment matrix.
+
+    Given :math:`M = \sum_t w_t (x_t - a)(y_t - b)^\top` and the sums :math:`s_1 = \sum_t w_t (x_t - a)`,
+    :math:`s_2 = \sum_t w_t (y_t - b)`, returns :math:`\sum_t w_t (x_t - a - d_1)(y_t - b - d_2)^\top`.
+
+    """
+    if M is None:
+        return None
+    M -= np.outer(s1, d2)
+    M -= np.outer(d1, s2)
+    M += w * np.outer(d1, d2)
+    return M
+
+
+def moments_fused(X, Y=None, remove_mean=False, symmetrize=False, weights=None, compute_XX=True, compute_XY=False,
+                  compute_YY=False, n_threads=1):
+    r""" Computes the first two unnormalized moments of X and Y with the fused native kernel
+
+    Computes the same sums and second moment matrices as :func:`moments_XX`, :func:`moments_XXXY` and
+    :func:`moments_block`, but in a single multi-threaded pass over the original buffers: the data is neither
+    copied, converted to float64, nor centered beforehand. Instead, the rows are shifted by the first row on the fly
+    and the mean is removed from the resulting moments afterwards, which keeps the cancellation small. The results do
+    not depend on the number of threads.
+
+    Parameters
+    ----------
+    X : ndarray (T, M)
+        C-contiguous float32 or float64 data matrix
+    Y : ndarray (T, N) or None
+        C-contiguous second data matrix of the same data type, required for compute_XY and compute_YY
+    remove_mean : bool
+        True: remove column mean from the data, False: don't remove mean.
+    symmetrize : bool
+        Computes symmetrized means and moments as :func:`moments_XXXY`, requires compute_YY=False
+    weights : None or ndarray(T, )
+        weights assigned to each trajectory point of X. If None, all data points have weight one.
+    compute_XX, compute_XY, compute_YY : bool
+        which of the second moment matrices to compute
+    n_threads : int
+        number of threads, defaults to a single thread.
+
+    Returns
+    -------
+    w : float
+        statistical weight
+    s_x : ndarray (M)
+        x-sum
+    s_y : ndarray (N) or None
+        y-sum
+    C_XX : ndarray (M, M) or None
+        unnormalized covariance matrix of X
+    C_XY : ndarray (M, N) or None
+        unnormalized covariance matrix of XY
+    C_YY : ndarray (N, N) or None
+        unnormalized covariance matrix of Y
+
+    """
+    if symmetrize and compute_YY:
+        raise ValueError('Combining compute_YY and symmetrize=True is meaningless.')
+    if symmetrize and X.shape[1] != Y.shape[1]:
+        raise ValueError('X and Y need to have equal sizes for symmetrization.')
+    shift = remove_mean and X.shape[0] > 0
+    a = X[0] if shift else None
+    b = Y[0] if shift and Y is not None else None
+    w, sx, sy, Cxx, Cxy, Cyy = covartools.moments(X, Y, weights=weights, shift_x=a, shift_y=b, compute_xx=compute_XX,
+                                                  compute_xy=compute_XY,
+                                                  compute_yy=compute_YY or (symmetrize and compute_XX),
+                                                  n_threads=n_threads)
+    # sums of the shifted data and sums of the data
+    sx_shifted, sy_shifted = sx, sy
+    if shift:
+        a = a.astype(np.float64)
+        sx = sx + w * a
+        if Y is not None:
+            b = b.astype(np.float64)
+            sy = sy + w * b
+    if symmetrize:
+        sx = sx + sy
+        sy = sx
+    if shift:
+        mx = sx / (2 * w if symmetrize else w)
+        my = sy / (2 * w if symmetrize else w) if Y is not None else None
+        Cxx = _recenter(Cxx, w, sx_shifted, sx_shifted, mx - a, mx - a)
+        if Y is not None:
+            Cxy = _recenter(Cxy, w, sx_shifted, sy_shifted, mx - a, my - b)
+            Cyy = _recenter(Cyy, w, sy_shifted, sy_shifted, my - b, my - b)
+    if symmetrize:
+        if Cxx is not None:
+            Cxx += Cyy
+        if Cxy is not None:
+            Cxy += Cxy.T.copy()
+        return 2 * w, sx, sy, Cxx, Cxy, None
+    return w, sx, sy, Cxx, Cxy, Cyy
+
+
 # =================================================
 # USER API
 # =================================================
@@ -612,7 +832,7 @@ def moments_XX(X, remove_mean=False, modify_data=False, weights=None, sparse_mod
 
     Parameters
     ----------
-    X : ndarray (T, M)
+    X : ndarray (T, M) or scipy.sparse matrix
         Data matrix
     remove_mean : bool
         True: remove column mean from the data, False: don't remove mean.
@@ -653,6 +873,9 @@ def moments_XX(X, remove_mean=False, modify_data=False, weights=None, sparse_mod
     # Check consistency of inputs:
     if weights is not None:
         assert X.shape[0] == weights.shape[0], 'X and weights_x must have equal length'
+    if scipy.sparse.issparse(X):
+        return _moments_XX_csr(X, remove_mean=remove_mean, weights=weights, column_selection=column_selection,
+                               diag_only=diag_only)
     # diag_only is only implemented for dense mode
     if diag_only and sparse_mode is not 'dense':
         if sparse_mode is 'sparse':
@@ -720,9 +943,9 @@ def moments_XXXY(X, Y, remove_mean=False, symmetrize=False, weights=None,
 
     Parameters
     ----------
-    X : ndarray (T, M)
+    X : ndarray (T, M) or scipy.sparse matrix
         Data matrix
-    Y : ndarray (T, N)
+    Y : ndarray (T, N) or scipy.sparse matrix
         Second data matrix
     remove_mean : bool
         True: remove column mean from the data, False: don't remove mean.
@@ -781,6 +1004,9 @@ def moments_XXXY(X, Y, remove_mean=False, symmetrize=False, weights=None,
         sparse_mode = 'dense'
     if diag_only and X.shape[1] != Y.shape[1]:
         raise ValueError('Computing diagonal entries only does not make sense for rectangular covariance matrix.')
+    if scipy.sparse.issparse(X) or scipy.sparse.issparse(Y):
+        return _moments_XXXY_csr(X, Y, remove_mean=remove_mean, symmetrize=symmetrize, weights=weights,
+                                 column_selection=column_selection, diag_only=diag_only)
     # sparsify
     X0, mask_X, xconst, Y0, mask_Y, yconst = _sparsify_pair(X, Y, remove_mean=remove_mean, modify_data=modify_data,
                                                             symmetrize=symmetrize, sparse_mode=sparse_mode, sparse_tol=sparse_tol)
@@ -858,9 +1084,9 @@ def moments_block(X, Y, remove_mean=False, modify_data=False,
 
     Parameters
     ----------
-    X : ndarray (T, M)
+    X : ndarray (T, M) or scipy.sparse matrix
         Data matrix
-    Y : ndarray (T, N)
+    Y : ndarray (T, N) or scipy.sparse matrix
         Second data matrix
     remove_mean : bool
         True: remove column mean from the data, False: don't remove mean.
@@ -896,6 +1122,9 @@ def moments_block(X, Y, remove_mean=False, modify_data=False,
         C[0,0] = Cxx, C[0,1] = Cxy, C[1,0] = Cyx, C[1,1] = Cyy
 
     """
+    if scipy.sparse.issparse(X) or scipy.sparse.issparse(Y):
+        return _moments_block_csr(X, Y, remove_mean=remove_mean, column_selection=column_selection,
+                                  diag_only=diag_only)
     # diag_only is only implemented for dense mode
     if diag_only and sparse_mode is not 'dense':
         if sparse_mode is 'sparse':
@@ -987,7 +1216,7 @@ def covar(X, remove_mean=False, modify_data=False, weights=None, sparse_mode='au
 
     Parameters
     ----------
-    X : ndarray (T, M)
+    X : ndarray (T, M) or scipy.sparse matrix
         Data matrix
     remove_mean : bool
         True: remove column mean from the data, False: don't remove mean.
@@ -1048,9 +1277,9 @@ def covars(X, Y, remove_mean=False, modify_data=False, symmetrize=False, weights
 
     Parameters
     ----------
-    X : ndarray (T, M)
+    X : ndarray (T, M) or scipy.sparse matrix
         Data matrix
-    Y : ndarray (T, N)
+    Y : ndarray (T, N) or scipy.sparse matrix
         Second data matrix
     remove_mean : bool
         True: remove column mean from the data, False: don't remove mean.
@@ -2,8 +2,9 @@ import numbers
 import warnings
 
 import numpy as np
+import scipy.sparse
 
-from .moments import moments_XX, moments_XXXY, moments_block
+from .moments import moments_XX, moments_XXXY, moments_block, moments_fused, _native_supported
 
 __author__ = 'noe'
 
@@ -50,15 +51,20 @@ class Moments(object):
         self.w = w1 + w2
         self.sx = self.sx + other.sx
         self.sy = self.sy + other.sy
+        # moments of scipy.sparse chunks stay sparse unless they are combined with dense ones
+        Mxy = other.Mxy
+        if scipy.sparse.issparse(self.Mxy) != scipy.sparse.issparse(Mxy):
+            self.Mxy = self.Mxy.toarray() if scipy.sparse.issparse(self.Mxy) else self.Mxy
+            Mxy = Mxy.toarray() if scipy.sparse.issparse(Mxy) else Mxy
         #
         if mean_free:
             if len(self.Mxy.shape) == 1:  # diagonal only
                 d = dsx*dsy
             else:
                 d = np.outer(dsx, dsy)
-            self.Mxy += other.Mxy + (w1 / (w2 * w)) * d
+            self.Mxy += Mxy + (w1 / (w2 * w)) * d
         else:
-            self.Mxy += other.Mxy
+            self.Mxy += Mxy
         return self
 
     @property
@@ -144,6 +150,12 @@ class MomentsStorage(object):
     def clear(self):
         self.storage.clear()
 
+    def merge(self, other):
+        """ Stores the collapsed moments of another storage, e.g., one which was accumulated concurrently
+        """
+        if len(other.storage) > 0:
+            self.store(other.moments)
+
 
 class RunningCovar(object):
     """ Running covariance estimator
@@ -182,6 +194,11 @@ class RunningCovar(object):
         Depth of Moment storage. Moments computed from each chunk will be
         combined with Moments of similar statistical weight using the pairwise
         combination algorithm described in [1]_.
+    n_threads : int
+        Number of threads of the fused native kernel, which computes the moments
+        of dense float32 or float64 chunks in a single pass without copying them.
+        Defaults to a single thread. Chunks the kernel does not support, e.g., with
+        sparse_mode='sparse' or a column selection, are processed in numpy.
 
     References
     ----------
@@ -192,7 +209,7 @@ class RunningCovar(object):
     # to get the Y mean, but this is currently not stored.
     def __init__(self, compute_XX=True, compute_XY=False, compute_YY=False,
                  remove_mean=False, symmetrize=False, sparse_mode='auto', modify_data=False,
-                 diag_only=False, nsave=5):
+                 diag_only=False, nsave=5, n_threads=1):
         # check input
         if not compute_XX and not compute_XY:
             raise ValueError('One of compute_XX or compute_XY must be True.')
@@ -220,6 +237,7 @@ class RunningCovar(object):
         self.modify_data = modify_data
         # whether to compute only matrix diagonals
         self.diag_only = diag_only
+        self.n_threads = n_threads
 
     def add(self, X, Y=None, weights=None, column_selection=None):
         """
@@ -227,9 +245,9 @@ class RunningCovar(object):
 
         Parameters
         ----------
-        X : ndarray(T, N)
+        X : ndarray(T, N) or scipy.sparse matrix
             array of N time series.
-        Y : ndarray(T, N)
+        Y : ndarray(T, N) or scipy.sparse matrix
             array of N time series, usually time shifted version of X.
         weights : None or float or ndarray(T, ):
             weights assigned to each trajectory point. If None, all data points have weight one. If float,
@@ -258,11 +276,26 @@ class RunningCovar(object):
             # Check appropriate length if weights is an array:
             elif isinstance(weights, np.ndarray):
                 if len(weights) != T:
-                    raise ValueError('weights and X must have equal length. Was {} and {} respectively.'.format(len(weights), len(X)))
+                    raise ValueError('weights and X must have equal length. Was {} and {} respectively.'
+                                     .format(len(weights), T))
             else:
                 raise TypeError('weights is of type %s, must be a number or ndarray' % (type(weights)))
         # estimate and add to storage
-        if self.compute_XX and not self.compute_XY and not self.compute_YY:
+        need_Y = self.compute_XY or self.compute_YY
+        if _native_supported(X, Y if need_Y else None, sparse_mode=self.sparse_mode,
+                             column_selection=column_selection, diag_only=self.diag_only):
+            w, s_X, s_Y, C_XX, C_XY, C_YY = moments_fused(X, Y if need_Y else None, remove_mean=self.remove_mean,
+                                                          symmetrize=self.symmetrize and self.compute_XY,
+                                                          weights=weights, compute_XX=self.compute_XX,
+                                                          compute_XY=self.compute_XY, compute_YY=self.compute_YY,
+                                                          n_threads=self.n_threads)
+            if self.compute_XX:
+                self.storage_XX.store(Moments(w, s_X, s_X, C_XX))
+            if self.compute_XY:
+                self.storage_XY.store(Moments(w, s_X, s_Y, C_XY))
+            if self.compute_YY:
+                self.storage_YY.store(Moments(w, s_Y, s_Y, C_YY))
+        elif self.compute_XX and not self.compute_XY and not self.compute_YY:
             w, s_X, C_XX = moments_XX(X, remove_mean=self.remove_mean, weights=weights, sparse_mode=self.sparse_mode,
                                       modify_data=self.modify_data, column_selection=column_selection,
                                       diag_only=self.diag_only)
@@ -368,9 +401,26 @@ class RunningCovar(object):
         self.storage_XY.clear()
         self.storage_YY.clear()
 
+    def combine(self, other):
+        """ Merges the moments of another estimator with the same settings into this one.
+
+        Parameters
+        ----------
+        other : RunningCovar
+            estimator which has been fed with different data, e.g., other trajectories.
+
+        Returns
+        -------
+        self : RunningCovar
+        """
+        self.storage_XX.merge(other.storage_XX)
+        self.storage_XY.merge(other.storage_XY)
+        self.storage_YY.merge(other.storage_YY)
+        return self
+
 
 def running_covar(xx=True, xy=False, yy=False, remove_mean=False, symmetrize=False, sparse_mode='auto',
-                  modify_data=False, diag_only=False, nsave=5):
+                  modify_data=False, diag_only=False, nsave=5, n_threads=1):
     """ Returns a running covariance estimator
 
     Returns an estimator object that can be fed chunks of X and Y data, and
@@ -405,6 +455,8 @@ def running_covar(xx=True, xy=False, yy=False, remove_mean=False, symmetrize=Fal
         Depth of Moment storage. Moments computed from each chunk will be
         combined with Moments of similar statistical weight using the pairwise
         combination algorithm described in [1]_.
+    n_threads : int
+        Number of threads of the fused native moments kernel, defaults to 1.
 
     References
     ----------
@@ -413,4 +465,4 @@ def running_covar(xx=True, xy=False, yy=False, remove_mean=False, symmetrize=Fal
     """
     return RunningCovar(compute_XX=xx, compute_XY=xy, compute_YY=yy, sparse_mode=sparse_mode, modify_data=modify_data,
                         remove_mean=remove_mean, symmetrize=symmetrize,
-                        diag_only=diag_only, nsave=nsave)
+                        diag_only=diag_only, nsave=nsave, n_threads=n_threads)
@@ -1,4 +1,5 @@
 import numpy as np
+import scipy.sparse
 
 
 def timeshifted_split(inputs, lagtime: int, chunksize=1000, n_splits=None):
@@ -12,23 +13,113 @@ def timeshifted_split(inputs, lagtime: int, chunksize=1000, n_splits=None):
             inputs = list(inputs)
         inputs = [inputs]
 
-    if not all(len(data) > lagtime for data in inputs):
-        too_short_inputs = [i for i,x in enumerate(inputs) if len(x) < lagtime]
+    if not all(_n_frames(data) > lagtime for data in inputs):
+        too_short_inputs = [i for i,x in enumerate(inputs) if _n_frames(x) < lagtime]
         raise ValueError(f'Input contained to short (smaller than lagtime({lagtime}) at following indices: {too_short_inputs}')
 
     for data in inputs:
-        data = np.asarray_chkfinite(data)
+        if scipy.sparse.issparse(data):
+            # the rows of sparse matrices are sliced, which requires CSR format
+            data = data.tocsr()
+        else:
+            data = np.asarray_chkfinite(data)
+        n_frames = _n_frames(data)
 
-        n_splits = np.ceil(len(data) // min(len(data), chunksize)) if n_splits is None else n_splits
+        n_splits = np.ceil(n_frames // min(n_frames, chunksize)) if n_splits is None else n_splits
         assert n_splits >= 1, n_splits
 
         data_lagged = data[lagtime:]
         data = data[:-lagtime]
 
-        for x, x_lagged in zip(np.array_split(data, n_splits),
-                               np.array_split(data_lagged, n_splits)):
-            if len(x) > 0:
-                assert len(x) == len(x_lagged)
+        for rows in np.array_split(np.arange(_n_frames(data)), n_splits):
+            if len(rows) > 0:
+                x, x_lagged = data[rows[0]:rows[-1] + 1], data_lagged[rows[0]:rows[-1] + 1]
+                assert _n_frames(x) == _n_frames(x_lagged)
                 yield x, x_lagged
             else:
                 break
+
+
+def _n_frames(data):
+    return data.shape[0] if scipy.sparse.issparse(data) else len(data)
+
+
+def is_chunked_source(source) -> bool:
+    r""" Whether the input is a re-iterable source of chunks rather than a single in-memory array, see
+    :meth:`iter_chunks`. """
+    return callable(source) or isinstance(source, (list, tuple))
+
+
+def iter_chunks(source, chunksize=None):
+    r""" Iterates over the chunks of a data source, which can be passed over several times.
+
+    Parameters
+    ----------
+    source : ndarray, list of ndarrays, memmaps or paths to .npy files, or callable
+        The data source. Files are memory mapped, a callable is called once per pass and has to return an iterable
+        over arrays.
+    chunksize : int or None, default None
+        maximum number of frames per chunk. If None, each array is yielded as a whole.
+
+    Yields
+    ------
+    chunk : ndarray
+        chunks of shape (n, d), one-dimensional arrays are interpreted as a single feature.
+    """
+    import os
+    if chunksize is not None and int(chunksize) <= 0:
+        raise ValueError('chunksize has to be positive')
+    if callable(source):
+        arrays = source()
+    elif isinstance(source, (list, tuple)):
+        arrays = source
+    else:
+        arrays = [source]
+    for x in arrays:
+        if isinstance(x, (str, os.PathLike)):
+            x = np.load(x, mmap_mode='r')
+        if x.ndim == 1:
+            x = x[:, np.newaxis]
+        if chunksize is None:
+            yield x
+        else:
+            for start in range(0, len(x), chunksize):
+                yield x[start:start + chunksize]
+
+
+def reservoir_sample(chunks, size: int, random_state=None):
+    r""" Draws a uniform sample of frames without replacement from a stream of chunks in one pass, keeping at most
+    `size` frames in memory. Every frame is assigned a random key and the frames with the smallest keys are kept.
+
+    Parameters
+    ----------
+    chunks : iterable of ndarray
+        chunks of shape (n, d)
+    size : int
+        sample size, if the stream contains fewer frames, all of them are returned
+    random_state : np.random.RandomState or None
+        random state used to draw the keys
+
+    Returns
+    -------
+    sample : ndarray
+        array of shape (min(size, total number of frames), d) with the sampled frames in stream order
+    """
+    if random_state is None:
+        random_state = np.random.RandomState()
+    sample, keys, positions = None, np.empty(0), np.empty(0, dtype=np.int64)
+    offset = 0
+    for chunk in chunks:
+        chunk_keys = random_state.random_sample(len(chunk))
+        candidates = np.concatenate((keys, chunk_keys))
+        kept = np.argsort(candidates, kind='stable')[:size]
+        n_old = len(keys)
+        old, new = kept[kept < n_old], kept[kept >= n_old] - n_old
+        new_frames = np.asarray(chunk[new])
+        sample = new_frames if sample is None else np.concatenate((sample[old], new_frames))
+        keys = np.concatenate((keys[old], chunk_keys[new]))
+        positions = np.concatenate((positions[old], offset + new))
+        offset += len(chunk)
+    if sample is None:
+        raise ValueError('The data source did not yield any frames.')
+    return sample[np.argsort(positions, kind='stable')]
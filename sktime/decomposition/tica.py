@@ -2,6 +2,7 @@ from numbers import Real, Integral
 from typing import Union
 
 import numpy as np
+import scipy.sparse
 
 from sktime.base import Model, Estimator, Transformer
 from sktime.covariance.online_covariance import OnlineCovariance
@@ -22,8 +23,12 @@ class TICAModel(Model, Transformer):
         self._rank = None
 
     def transform(self, data):
+        eigenvectors = self.eigenvectors[:, :self.output_dimension()]
+        if scipy.sparse.issparse(data):
+            # project without densifying the data
+            return data.dot(eigenvectors) - np.dot(self.mean_0, eigenvectors)
         data_meanfree = data - self.mean_0
-        return np.dot(data_meanfree, self.eigenvectors[:, :self.output_dimension()])
+        return np.dot(data_meanfree, eigenvectors)
 
     @property
     def dim(self):
@@ -301,7 +306,7 @@ class TICA(Estimator, Transformer):
 
         Parameters
         ----------
-        data : ndarray(n, m)
+        data : ndarray(n, m) or scipy.sparse matrix
             the input data
 
         Returns
@@ -325,9 +330,9 @@ class TICA(Estimator, Transformer):
         self._covar.partial_fit(X, weights=weights, column_selection=column_selection)
         return self
 
-    def fit(self, X, lagtime=None, weights=None, column_selection=None):
+    def fit(self, X, lagtime=None, weights=None, column_selection=None, n_jobs=None):
         self._model = TICAModel(scaling=self.scaling, dim=self.dim, epsilon=self.epsilon)
-        self._covar.fit(X, lagtime=lagtime, weights=weights, column_selection=column_selection)
+        self._covar.fit(X, lagtime=lagtime, weights=weights, column_selection=column_selection, n_jobs=n_jobs)
         return self
 
     def fetch_model(self) -> TICAModel:
@@ -22,6 +22,7 @@
 import warnings
 
 import numpy as np
+import scipy.sparse
 
 from sktime.base import Model, Estimator
 from sktime.covariance.online_covariance import OnlineCovariance
@@ -294,7 +295,7 @@ class VAMPModel(Model):
 
         Parameters
         ----------
-        X : ndarray(n, m)
+        X : ndarray(n, m) or scipy.sparse matrix
             the input data
 
         Returns
@@ -307,11 +308,15 @@ class VAMPModel(Model):
         """
         # TODO: in principle get_output should not return data for *all* frames!
         if self.right:
-            X_meanfree = X - self.mean_t
-            Y = np.dot(X_meanfree, self.singular_vectors_right[:, 0:self.dimension()])
+            mean, singular_vectors = self.mean_t, self.singular_vectors_right[:, 0:self.dimension()]
         else:
-            X_meanfree = X - self.mean_0
-            Y = np.dot(X_meanfree, self.singular_vectors_left[:, 0:self.dimension()])
+            mean, singular_vectors = self.mean_0, self.singular_vectors_left[:, 0:self.dimension()]
+        if scipy.sparse.issparse(X):
+            # project without densifying the data
+            Y = X.dot(singular_vectors) - np.dot(mean, singular_vectors)
+        else:
+            X_meanfree = X - mean
+            Y = np.dot(X_meanfree, singular_vectors)
 
         return Y
 
@@ -0,0 +1,192 @@
+import os
+import pickle
+import subprocess
+import sys
+import unittest
+
+import numpy as np
+
+from sktime.clustering.cluster_model import ClusterModel
+from sktime.clustering import _clustering_bindings
+from sktime.clustering._clustering_bindings import EuclideanMetric, MinRMSDMetric
+
+
+def brute_force_assignment(data, centers):
+    return np.argmin(((data[:, np.newaxis, :] - centers[np.newaxis, :, :]) ** 2).sum(axis=-1), axis=1)
+
+
+def kabsch_rmsd(x, y):
+    x, y = x.reshape(-1, 3), y.reshape(-1, 3)
+    x, y = x - x.mean(axis=0), y - y.mean(axis=0)
+    u, s, vt = np.linalg.svd(x.T @ y)
+    s[-1] *= np.sign(np.linalg.det(u @ vt))
+    return np.sqrt(max(0., ((x ** 2).sum() + (y ** 2).sum() - 2 * s.sum()) / len(x)))
+
+
+class TestClusterModel(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        state = np.random.RandomState(13)
+        cls.data = state.randn(1003, 7)
+        cls.centers = state.randn(133, 7)
+
+    def test_euclidean_assignment(self):
+        for dtype in (np.float32, np.float64):
+            data, centers = self.data.astype(dtype), self.centers.astype(dtype)
+            model = ClusterModel(len(centers), centers, EuclideanMetric())
+            for n_jobs in (0, 1, 3):
+                np.testing.assert_equal(model.transform(data, n_jobs=n_jobs), brute_force_assignment(data, centers))
+
+    def test_min_rmsd_assignment(self):
+        state = np.random.RandomState(3)
+        data, centers = state.randn(200, 24), state.randn(9, 24)
+        expected = np.argmin([[kabsch_rmsd(x, c) for c in centers] for x in data], axis=1)
+        for dtype in (np.float32, np.float64):
+            model = ClusterModel(len(centers), centers.astype(dtype), MinRMSDMetric())
+            for n_jobs in (1, 3):
+                np.testing.assert_equal(model.transform(data.astype(dtype), n_jobs=n_jobs), expected)
+        with self.assertRaises(ValueError):
+            ClusterModel(2, centers[:2, :23], MinRMSDMetric()).transform(data[:, :23])
+
+    def test_euclidean_assignment_offset(self):
+        # single precision data far away from the origin, the expansion of the distances must not cancel
+        state = np.random.RandomState(17)
+        data = state.randn(20000, 3)
+        centers = data[state.choice(len(data), size=50, replace=False)]
+        for offset in (100., 1000.):
+            shifted_data, shifted_centers = (data + offset).astype(np.float32), (centers + offset).astype(np.float32)
+            model = ClusterModel(len(centers), shifted_centers, EuclideanMetric())
+            dtraj = model.transform(shifted_data, n_jobs=2)
+            dists = ((shifted_data.astype(np.float64)[:, np.newaxis, :]
+                      - shifted_centers.astype(np.float64)[np.newaxis, :, :]) ** 2).sum(axis=-1)
+            # near ties are resolved with exact distances, hence the assignment is the exact nearest center
+            np.testing.assert_equal(dtraj, dists.argmin(axis=1))
+
+            from sktime.clustering.kmeans import KmeansClustering
+            reference = KmeansClustering(len(centers), max_iter=10, initial_centers=centers.astype(np.float32)) \
+                .fit(data.astype(np.float32)).fetch_model()
+            est = KmeansClustering(len(centers), max_iter=10, initial_centers=shifted_centers) \
+                .fit(shifted_data).fetch_model()
+            np.testing.assert_allclose(est.inertia, reference.inertia, rtol=1e-2)
+
+    def test_cluster_centers_setter(self):
+        model = ClusterModel(len(self.centers), self.centers, EuclideanMetric())
+        np.testing.assert_equal(model.transform(self.data), brute_force_assignment(self.data, self.centers))
+        model.cluster_centers = self.centers[:10]
+        np.testing.assert_equal(model.transform(self.data), brute_force_assignment(self.data, self.centers[:10]))
+
+    def test_transform_many(self):
+        state = np.random.RandomState(11)
+        trajectories = [state.randn(n, 7) for n in (0, 1, 500, 3001)]
+        for use_spatial_index in (False, True):
+            model = ClusterModel(len(self.centers), self.centers, EuclideanMetric(),
+                                 use_spatial_index=use_spatial_index)
+            for n_jobs in (None, 1, 3, 8):
+                dtrajs = model.transform_many(trajectories, n_jobs=n_jobs)
+                self.assertEqual(len(dtrajs), len(trajectories))
+                for traj, dtraj in zip(trajectories, dtrajs):
+                    np.testing.assert_equal(dtraj, brute_force_assignment(traj, self.centers))
+        self.assertEqual(model.transform_many([]), [])
+
+    def test_transform_to_disk(self):
+        import tempfile
+        state = np.random.RandomState(12)
+        # the files are stored in single precision and converted to the dtype of the centers while reading
+        trajectories = [state.randn(n, 7).astype(np.float32).astype(np.float64) for n in (0, 1, 500, 3001)]
+        model = ClusterModel(len(self.centers), self.centers, EuclideanMetric())
+        with tempfile.TemporaryDirectory() as tmp:
+            sources = []
+            for i, traj in enumerate(trajectories):
+                if i % 2 == 0:
+                    sources.append(os.path.join(tmp, 'traj_{}.npy'.format(i)))
+                    np.save(sources[-1], traj.astype(np.float32))
+                else:
+                    sources.append(traj)
+            out_dir = os.path.join(tmp, 'dtrajs')
+            for dtype in (np.int32, np.uint8):
+                paths = model.transform_to_disk(sources, out_dir, chunksize=128, n_jobs=2, dtype=dtype)
+                self.assertEqual([os.path.basename(p) for p in paths], ['traj_0.npy', '1.npy', 'traj_2.npy', '3.npy'])
+                for traj, path in zip(trajectories, paths):
+                    dtraj = np.load(path)
+                    self.assertEqual(dtraj.dtype, dtype)
+                    np.testing.assert_equal(dtraj, brute_force_assignment(traj, self.centers))
+            with self.assertRaises(ValueError):
+                ClusterModel(300, np.zeros((300, 7)), EuclideanMetric()).transform_to_disk(sources, out_dir,
+                                                                                           dtype=np.uint8)
+            with self.assertRaises(ValueError):
+                model.transform_to_disk([sources[0], sources[0]], out_dir)
+
+    def test_spatial_index(self):
+        state = np.random.RandomState(7)
+        for dtype in (np.float32, np.float64):
+            data = state.uniform(-3, 3, size=(5000, 2)).astype(dtype)
+            centers = state.uniform(-3, 3, size=(3000, 2)).astype(dtype)
+            # points on a grid cause plenty of ties, which have to be resolved like the brute force assignment does
+            grid = np.round(state.uniform(-3, 3, size=(500, 2))).astype(dtype)
+            grid_centers = np.array([[i, j] for i in range(-3, 4) for j in range(-3, 4)] * 2, dtype=dtype)
+            for X, C in ((data, centers), (grid, grid_centers)):
+                model = ClusterModel(len(C), C, EuclideanMetric(), use_spatial_index=True)
+                self.assertIsNone(model.spatial_index)
+                for n_jobs in (0, 3):
+                    np.testing.assert_equal(model.transform(X, n_jobs=n_jobs), brute_force_assignment(X, C))
+                self.assertIsNotNone(model.spatial_index)
+
+    def test_spatial_index_auto(self):
+        model = ClusterModel(len(self.centers), self.centers, EuclideanMetric())
+        model.transform(self.data)
+        self.assertIsNone(model.spatial_index)
+        model.build_spatial_index(leaf_size=4)
+        self.assertEqual(model.spatial_index.leaf_size, 4)
+        np.testing.assert_equal(model.transform(self.data), brute_force_assignment(self.data, self.centers))
+
+        centers = np.random.RandomState(3).randn(2000, 3)
+        model = ClusterModel(len(centers), centers, EuclideanMetric())
+        model.transform(self.data[:, :3].copy())
+        self.assertIsNotNone(model.spatial_index)
+
+    def test_spatial_index_invalidated_and_pickled(self):
+        model = ClusterModel(len(self.centers), self.centers, EuclideanMetric())
+        model.build_spatial_index()
+        restored = pickle.loads(pickle.dumps(model))
+        self.assertIsNotNone(restored.spatial_index)
+        np.testing.assert_equal(restored.transform(self.data), model.transform(self.data))
+        model.cluster_centers = self.centers[:10]
+        self.assertIsNone(model.spatial_index)
+        np.testing.assert_equal(model.transform(self.data), brute_force_assignment(self.data, self.centers[:10]))
+
+    def test_spatial_index_in_place_edit(self):
+        centers = np.random.RandomState(5).randn(2000, 3)
+        data = np.random.RandomState(6).randn(20000, 3)
+        model = ClusterModel(len(centers), centers.copy(), EuclideanMetric())
+        np.testing.assert_equal(model.transform(data), brute_force_assignment(data, centers))
+        self.assertIsNotNone(model.spatial_index)
+        model.cluster_centers[:100] += .5
+        self.assertIsNone(model.spatial_index)
+        np.testing.assert_equal(model.transform(data), brute_force_assignment(data, model.cluster_centers))
+        self.assertIsNotNone(model.spatial_index)
+
+    def test_spatial_index_invalid(self):
+        with self.assertRaises(ValueError):
+            ClusterModel(len(self.centers), self.centers, EuclideanMetric(), use_spatial_index='always')
+
+    def test_simd_instruction_sets(self):
+        self.assertIn(_clustering_bindings.simd_instruction_set, ('portable', 'sse2', 'avx2', 'avx512'))
+        script = ("import numpy as np; from sktime.clustering import _clustering_bindings as b; "
+                  "s = np.random.RandomState(7); x, c = s.randn(1001, 13), s.randn(37, 13); "
+                  "print(b.simd_instruction_set); "
+                  "[print(b.assign(x.astype(t), c.astype(t), 1).tolist()) for t in (np.float32, np.float64)]")
+        state = np.random.RandomState(7)
+        data, centers = state.randn(1001, 13), state.randn(37, 13)
+        expected = brute_force_assignment(data, centers).tolist()
+        names = ('portable', 'sse2', 'avx2', 'avx512')
+        for isa in names:
+            env = dict(os.environ, SKTIME_SIMD=isa)
+            out = subprocess.check_output([sys.executable, '-c', script], env=env, universal_newlines=True).split('\n')
+            self.assertLessEqual(names.index(out[0]), names.index(isa))
+            self.assertEqual(out[2], str(expected))
+            self.assertEqual(out[1], str(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
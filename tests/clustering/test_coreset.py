@@ -0,0 +1,80 @@
+import unittest
+
+import numpy as np
+from sklearn.datasets import make_blobs
+
+from sktime.clustering import KmeansClustering, KmeansCoreset
+
+
+def cost(data, centers, weights=None):
+    sq_dists = np.min(((data[:, None] - centers[None]) ** 2).sum(-1), axis=1)
+    return np.sum(sq_dists if weights is None else weights * sq_dists)
+
+
+class TestKmeansCoreset(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.data = make_blobs(n_samples=40000, n_features=3, centers=10, cluster_std=1.5, random_state=13)[0]
+
+    def test_approximates_cost(self):
+        est = KmeansCoreset(n_clusters=10, coreset_size=2000, fixed_seed=3, chunksize=4000)
+        model = est.fit(np.array_split(self.data, 3)).fetch_model()
+        self.assertLessEqual(len(model.data), 2000)
+        self.assertEqual(model.n_frames, len(self.data))
+        np.testing.assert_allclose(model.weights.sum(), len(self.data), rtol=.1)
+        state = np.random.RandomState(5)
+        for _ in range(5):
+            centers = self.data[state.choice(len(self.data), size=10, replace=False)]
+            np.testing.assert_allclose(cost(model.data, centers, model.weights), cost(self.data, centers), rtol=.1)
+
+    def test_kmeans_on_coreset(self):
+        model = KmeansCoreset(n_clusters=10, coreset_size=2000, fixed_seed=7, chunksize=5000).fit(self.data)\
+            .fetch_model()
+        full = KmeansClustering(n_clusters=10, max_iter=100, fixed_seed=7).fit(self.data).fetch_model()
+        reduced = KmeansClustering(n_clusters=10, max_iter=100, fixed_seed=7)\
+            .fit(model.data, weights=model.weights).fetch_model()
+        self.assertLess(cost(self.data, reduced.cluster_centers), 1.1 * full.inertia)
+
+    def test_merge_and_reduce(self):
+        est = KmeansCoreset(n_clusters=5, coreset_size=500, fixed_seed=11)
+        for chunk in np.array_split(self.data, 20):
+            est.partial_fit(chunk)
+            self.assertLessEqual(sum(len(c[0]) for c in est._levels if c is not None),
+                                 len(est._levels) * est.coreset_size)
+        model = est.fetch_model()
+        self.assertLessEqual(len(model.data), 500)
+        np.testing.assert_allclose(model.weights.sum(), len(self.data), rtol=.1)
+        same = KmeansCoreset(n_clusters=5, coreset_size=500, fixed_seed=11)
+        for chunk in np.array_split(self.data, 20):
+            same.partial_fit(chunk)
+        np.testing.assert_array_equal(same.fetch_model().data, model.data)
+        np.testing.assert_array_equal(same.fetch_model().weights, model.weights)
+
+    def test_refit_is_reproducible(self):
+        est = KmeansCoreset(n_clusters=5, coreset_size=500, fixed_seed=7, chunksize=2000)
+        first = est.fit(self.data).fetch_model()
+        second = est.fit(self.data).fetch_model()
+        np.testing.assert_array_equal(second.data, first.data)
+        np.testing.assert_array_equal(second.weights, first.weights)
+        with self.assertWarns(UserWarning):
+            est.fixed_seed = -1
+
+    def test_small_data_is_kept(self):
+        data = self.data[:300]
+        weights = np.arange(300, dtype=np.float64)
+        model = KmeansCoreset(n_clusters=5, coreset_size=1000).fit(data, weights=weights).fetch_model()
+        np.testing.assert_array_equal(model.data, data[1:])
+        np.testing.assert_array_equal(model.weights, weights[1:])
+
+    def test_invalid_arguments(self):
+        with self.assertRaises(ValueError):
+            KmeansCoreset(n_clusters=10, coreset_size=5)
+        with self.assertRaises(ValueError):
+            KmeansCoreset(n_clusters=10).fit([self.data], weights=np.ones(len(self.data)))
+        with self.assertRaises(ValueError):
+            KmeansCoreset(n_clusters=10).partial_fit(self.data, weights=-np.ones(len(self.data)))
+
+
+if __name__ == '__main__':
+    unittest.main()
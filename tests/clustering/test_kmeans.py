@@ -6,7 +6,7 @@ import numpy as np
 from sklearn.datasets import make_blobs
 from sklearn.model_selection import ParameterGrid
 
-from sktime.clustering import KmeansClustering
+from sktime.clustering import KmeansClustering, HierarchicalKmeansClustering
 from sktime.clustering.cluster_model import ClusterModel
 
 
@@ -31,7 +31,7 @@ class TestKmeans(unittest.TestCase):
         X = np.atleast_2d(np.hstack(X)).T
         X = X.astype(np.float32)
         k = 50
-        grid = ParameterGrid({'init_strategy': ['uniform', 'kmeans++'], 'fixed_seed': [463498, True]})
+        grid = ParameterGrid({'init_strategy': ['uniform', 'kmeans++', 'kmeans||'], 'fixed_seed': [463498, True]})
         for param in grid:
             init_strategy = param['init_strategy']
             fixed_seed = param['fixed_seed']
@@ -50,6 +50,7 @@ class TestKmeans(unittest.TestCase):
             # check initial centers (after kmeans++, uniform init) are equal.
             np.testing.assert_equal(km1.initial_centers, km2.initial_centers, err_msg='not eq for {} and seed={}'
                                     .format(init_strategy, fixed_seed))
+            initial_centers = km1.initial_centers.copy()
 
             while not model1.converged:
                 km1.fit(data=X, initial_centers=model1.cluster_centers)
@@ -58,7 +59,7 @@ class TestKmeans(unittest.TestCase):
                 km2.fit(data=X, initial_centers=model2.cluster_centers)
                 model2 = km2.fetch_model()
 
-            assert np.linalg.norm(model1.cluster_centers - km1.initial_centers) > 0
+            assert np.linalg.norm(model1.cluster_centers - initial_centers) > 0
             np.testing.assert_array_almost_equal(model1.cluster_centers, model2.cluster_centers)
             np.testing.assert_allclose(model1.cluster_centers, model2.cluster_centers,
                                        err_msg="should yield same centers with fixed seed=%s for strategy %s, "
@@ -225,6 +226,262 @@ class TestKmeans(unittest.TestCase):
         assert init == 3
         assert iter == 2
 
+    def test_hamerly_same_centers_as_lloyd(self):
+        data = make_blobs(n_samples=2000, n_features=4, random_state=33, centers=10, cluster_std=2.)[0]
+        for dtype in (np.float32, np.float64):
+            X = data.astype(dtype)
+            lloyd = KmeansClustering(n_clusters=15, max_iter=500, tolerance=0, fixed_seed=17, n_jobs=1,
+                                     algorithm='lloyd')
+            hamerly = KmeansClustering(n_clusters=15, max_iter=500, fixed_seed=17, n_jobs=1, algorithm='hamerly')
+            model_lloyd = lloyd.fit(X).fetch_model()
+            model_hamerly = hamerly.fit(X).fetch_model()
+            assert model_hamerly.converged
+            np.testing.assert_equal(lloyd.initial_centers, hamerly.initial_centers)
+            np.testing.assert_allclose(model_hamerly.cluster_centers, model_lloyd.cluster_centers, rtol=1e-5)
+            np.testing.assert_equal(model_hamerly.transform(X), model_lloyd.transform(X))
+
+    def test_hamerly_same_centers_as_lloyd_many_clusters(self):
+        data = make_blobs(n_samples=10000, n_features=5, random_state=21, centers=50, cluster_std=1.5)[0]
+        for dtype in (np.float32, np.float64):
+            X = data.astype(dtype)
+            weights = (np.random.RandomState(4).rand(len(X)) + .1).astype(dtype)
+            iterations = []
+            models = []
+            for algorithm in ('lloyd', 'hamerly'):
+                est = KmeansClustering(n_clusters=250, max_iter=1000, tolerance=0, fixed_seed=17, n_jobs=2,
+                                       algorithm=algorithm)
+                iterations.append(0)
+
+                def callback_loop():
+                    iterations[-1] += 1
+                models.append(est.fit(X, weights=weights, callback_loop=callback_loop).fetch_model())
+            model_lloyd, model_hamerly = models
+            assert model_lloyd.converged and model_hamerly.converged
+            self.assertGreater(min(iterations), 10)
+            np.testing.assert_array_equal(model_hamerly.cluster_centers, model_lloyd.cluster_centers)
+            np.testing.assert_equal(model_hamerly.transform(X), model_lloyd.transform(X))
+            np.testing.assert_allclose(model_hamerly.inertia, model_lloyd.inertia, rtol=1e-6)
+
+    def test_bit_identical_for_any_n_jobs(self):
+        data = make_blobs(n_samples=20000, n_features=5, random_state=7, centers=30, cluster_std=3.)[0]
+        for dtype in (np.float32, np.float64):
+            X = data.astype(dtype)
+            for algorithm in ('lloyd', 'hamerly'):
+                models = []
+                for n_jobs in (0, 1, 2, 5):
+                    est = KmeansClustering(n_clusters=40, max_iter=10, fixed_seed=31, n_jobs=n_jobs,
+                                           algorithm=algorithm)
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('ignore')
+                        models.append(est.fit(X).fetch_model())
+                for model in models[1:]:
+                    np.testing.assert_array_equal(model.cluster_centers, models[0].cluster_centers)
+                    self.assertEqual(model.inertia, models[0].inertia)
+
+    def test_inertia_and_fit_transform(self):
+        data = make_blobs(n_samples=5000, n_features=3, random_state=3, centers=8)[0]
+        for algorithm in ('lloyd', 'hamerly'):
+            est = KmeansClustering(n_clusters=8, max_iter=50, fixed_seed=5, algorithm=algorithm)
+            dtraj = est.fit_transform(data)
+            model = est.fetch_model()
+            np.testing.assert_equal(dtraj, model.transform(data))
+            expected = np.sum((data - model.cluster_centers[dtraj]) ** 2)
+            np.testing.assert_allclose(model.inertia, expected)
+
+    def test_chunked_sources(self):
+        import os
+        import tempfile
+        data = make_blobs(n_samples=3000, n_features=2, random_state=11, centers=6)[0]
+        parts = np.array_split(data, 5)
+        initial_centers = data[:6].copy()
+        expected = KmeansClustering(n_clusters=6, max_iter=100, initial_centers=initial_centers).fit(data)\
+            .fetch_model()
+        with tempfile.TemporaryDirectory() as tmp:
+            paths = []
+            for i, part in enumerate(parts):
+                paths.append(os.path.join(tmp, '{}.npy'.format(i)))
+                np.save(paths[-1], part)
+            memmaps = [np.load(path, mmap_mode='r') for path in paths]
+            for source in (parts, paths, memmaps, lambda: iter(parts)):
+                for chunksize in (None, 77):
+                    est = KmeansClustering(n_clusters=6, max_iter=100, initial_centers=initial_centers,
+                                           chunksize=chunksize)
+                    model = est.fit(source).fetch_model()
+                    self.assertTrue(model.converged)
+                    np.testing.assert_allclose(model.cluster_centers, expected.cluster_centers)
+                    np.testing.assert_allclose(model.inertia, expected.inertia)
+            del memmaps
+
+    def test_chunked_source_reservoir_init(self):
+        data = make_blobs(n_samples=20000, n_features=3, random_state=2, centers=5)[0]
+        est = KmeansClustering(n_clusters=5, max_iter=50, fixed_seed=3, chunksize=1000)
+        model = est.fit(lambda: iter(np.array_split(data, 4))).fetch_model()
+        self.assertEqual(model.cluster_centers.shape, (5, 3))
+        np.testing.assert_allclose(model.inertia, np.sum(np.min(
+            ((data[:, None] - model.cluster_centers[None]) ** 2).sum(-1), axis=1)))
+        with self.assertRaises(ValueError):
+            est.fit_transform([data])
+
+    def test_kmeans_parallel_init(self):
+        data, _, blob_centers = make_blobs(n_samples=10000, n_features=3, random_state=5, centers=20,
+                                           cluster_std=.1, center_box=(-50, 50), return_centers=True)
+        init_count = 0
+
+        def callback():
+            nonlocal init_count
+            init_count += 1
+
+        centers = []
+        for n_jobs in (0, 3):
+            km, _ = cluster_kmeans(data, k=20, init_strategy='kmeans||', fixed_seed=11, n_jobs=n_jobs,
+                                   callback_init_centers=callback)
+            centers.append(km.initial_centers)
+            self.assertEqual(km.initial_centers.shape, (20, 3))
+            # each blob is hit by exactly one initial center
+            blobs = ClusterModel(20, blob_centers, km.metric).transform(km.initial_centers)
+            self.assertEqual(len(np.unique(blobs)), 20)
+        self.assertEqual(init_count, 40)
+        np.testing.assert_array_equal(centers[0], centers[1])
+
+    def test_n_init(self):
+        data = make_blobs(n_samples=3000, n_features=2, random_state=9, centers=12, cluster_std=.5)[0]
+        models = []
+        for n_jobs in (0, 1, 4):
+            est = KmeansClustering(n_clusters=12, max_iter=100, fixed_seed=3, n_jobs=n_jobs, n_init=5,
+                                   init_strategy='uniform')
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                models.append(est.fit(data).fetch_model())
+            self.assertEqual(len(models[-1].restart_inertias), 5)
+            self.assertEqual(models[-1].inertia, models[-1].restart_inertias.min())
+            single = KmeansClustering(n_clusters=12, max_iter=100, initial_centers=est.initial_centers).fit(data)
+            np.testing.assert_array_equal(single.fetch_model().cluster_centers, models[-1].cluster_centers)
+        for model in models[1:]:
+            np.testing.assert_array_equal(model.cluster_centers, models[0].cluster_centers)
+            np.testing.assert_array_equal(model.restart_inertias, models[0].restart_inertias)
+        # restarts do not draw from random_state, so its state does not matter
+        random_state = np.random.RandomState(5)
+        random_state.rand(10)
+        est = KmeansClustering(n_clusters=12, max_iter=100, fixed_seed=3, n_init=5, init_strategy='uniform',
+                               random_state=random_state)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            np.testing.assert_array_equal(est.fit(data).fetch_model().restart_inertias, models[0].restart_inertias)
+            # the picked centers are not reused, a refit restarts again
+            np.testing.assert_array_equal(est.fit(data).fetch_model().restart_inertias, models[0].restart_inertias)
+        # the first restart is the same as a single run
+        single = KmeansClustering(n_clusters=12, max_iter=100, fixed_seed=3, init_strategy='uniform').fit(data)
+        self.assertEqual(single.fetch_model().inertia, models[0].restart_inertias[0])
+        with self.assertRaises(ValueError):
+            KmeansClustering(n_clusters=3, n_init=0)
+
+    def test_invalid_algorithm(self):
+        with self.assertRaises(ValueError):
+            KmeansClustering(n_clusters=3, algorithm='elkan')
+
+    def test_weights(self):
+        from sktime.clustering._clustering_bindings import kmeans as _kmeans_ext
+        data = make_blobs(n_samples=500, n_features=3, random_state=4, centers=6)[0]
+        weights = np.random.RandomState(4).randint(0, 5, size=len(data))
+        repeated = np.repeat(data, weights, axis=0)
+        initial_centers = data[weights > 0][:6].copy()
+        for algorithm in ('lloyd', 'hamerly'):
+            expected = KmeansClustering(n_clusters=6, max_iter=100, tolerance=0, initial_centers=initial_centers,
+                                        algorithm=algorithm).fit(repeated).fetch_model()
+            est = KmeansClustering(n_clusters=6, max_iter=100, tolerance=0, initial_centers=initial_centers,
+                                   algorithm=algorithm)
+            dtraj = est.fit_transform(data, weights=weights)
+            model = est.fetch_model()
+            np.testing.assert_allclose(model.cluster_centers, expected.cluster_centers)
+            np.testing.assert_allclose(model.inertia, expected.inertia)
+            np.testing.assert_allclose(model.inertia, np.sum(weights * ((data - model.cluster_centers[dtraj]) ** 2)
+                                                             .sum(-1)))
+            np.testing.assert_allclose(_kmeans_ext.cost_function(data, model.cluster_centers, 1, None, weights
+                                                                 .astype(np.float64)), model.inertia)
+
+        # frames without weight are never picked as initial centers
+        for init_strategy in ('uniform', 'kmeans++', 'kmeans||'):
+            est = KmeansClustering(n_clusters=20, max_iter=1, fixed_seed=7, init_strategy=init_strategy)
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore')
+                est.fit(data, weights=weights)
+            picked = np.all(est.initial_centers[:, None] == data[None], axis=-1)
+            self.assertTrue(np.all(weights[np.argmax(picked, axis=1)] > 0))
+
+        with self.assertRaises(ValueError):
+            KmeansClustering(n_clusters=3).fit(data, weights=weights[1:])
+        with self.assertRaises(ValueError):
+            KmeansClustering(n_clusters=3).fit(data, weights=-np.ones(len(data)))
+        with self.assertRaises(ValueError):
+            KmeansClustering(n_clusters=3).fit(data, weights=np.zeros(len(data)))
+        with self.assertRaises(ValueError):
+            KmeansClustering(n_clusters=3).fit([data], weights=weights)
+
+
+class TestHierarchicalKmeans(unittest.TestCase):
+
+    def test_separated_blobs(self):
+        data, labels = make_blobs(n_samples=8000, n_features=3, centers=16, cluster_std=.2, center_box=(-50, 50),
+                                  random_state=17)
+        est = HierarchicalKmeansClustering(n_clusters=16, fixed_seed=5)
+        model = est.fit(data).fetch_model()
+        self.assertEqual(model.cluster_centers.shape, (16, 3))
+        self.assertEqual(model.n_clusters, 16)
+        dtraj = model.transform(data)
+        np.testing.assert_equal(dtraj, ClusterModel.transform(model, data))
+        # each blob ends up in a cluster of its own
+        self.assertEqual(len(np.unique(labels * 16 + dtraj)), 16)
+        np.testing.assert_allclose(model.inertia, np.sum((data - model.cluster_centers[dtraj]) ** 2))
+        flat = KmeansClustering(n_clusters=16, max_iter=100, fixed_seed=5).fit(data).fetch_model()
+        self.assertLessEqual(model.inertia, 1.05 * flat.inertia)
+
+    def test_many_clusters(self):
+        data = np.random.RandomState(3).uniform(size=(20000, 2))
+        models = [HierarchicalKmeansClustering(n_clusters=500, fixed_seed=9, n_jobs=n_jobs).fit(data).fetch_model()
+                  for n_jobs in (1, 4)]
+        for model in models:
+            self.assertEqual(model.cluster_centers.shape, (500, 2))
+            self.assertEqual(np.count_nonzero(model.leaf_labels >= 0), 500)
+            self.assertLess(model.depth, 30)
+            dtraj = model.transform(data, n_jobs=2)
+            self.assertEqual(len(np.unique(dtraj)), 500)
+        np.testing.assert_array_equal(models[0].node_centers, models[1].node_centers)
+        np.testing.assert_array_equal(models[0].children, models[1].children)
+        self.assertEqual(models[0].inertia, models[1].inertia)
+
+    def test_weights_and_duplicates(self):
+        data = np.repeat(np.array([[0., 0.], [1., 0.], [0., 5.]]), 10, axis=0)
+        with self.assertWarns(UserWarning):
+            model = HierarchicalKmeansClustering(n_clusters=5, fixed_seed=1).fit(data).fetch_model()
+        self.assertEqual(model.n_clusters, 3)
+        np.testing.assert_equal(np.sort(model.cluster_centers, axis=0), np.sort(np.unique(data, axis=0), axis=0))
+
+        weights = np.arange(len(data)) % 3
+        weighted = HierarchicalKmeansClustering(n_clusters=2, fixed_seed=1).fit(data, weights=weights)
+        expected = KmeansClustering(n_clusters=2, max_iter=50, fixed_seed=1).fit(np.repeat(data, weights, axis=0))
+        np.testing.assert_allclose(weighted.fetch_model().inertia, expected.fetch_model().inertia)
+
+    def test_fit_arguments(self):
+        data = make_blobs(n_samples=2000, n_features=2, centers=8, random_state=3)[0]
+        calls = {'init': 0, 'loop': 0}
+
+        def callback_init_centers():
+            calls['init'] += 1
+
+        def callback_loop():
+            calls['loop'] += 1
+
+        est = HierarchicalKmeansClustering(n_clusters=8, fixed_seed=2)
+        dtraj = est.fit_transform(data, callback_init_centers=callback_init_centers, callback_loop=callback_loop)
+        # two initial centers per split
+        self.assertEqual(calls['init'], 2 * 7)
+        self.assertGreater(calls['loop'], 0)
+        model = est.fetch_model()
+        np.testing.assert_allclose(np.sum((data - model.cluster_centers[dtraj]) ** 2), model.inertia)
+        np.testing.assert_array_equal(est.fit(data, n_jobs=2).fetch_model().node_centers, model.node_centers)
+        with self.assertRaises(ValueError):
+            est.fit(data, initial_centers=data[:8])
+
 
 class TestKmeansResume(unittest.TestCase):
 
@@ -61,6 +61,63 @@ class TestMiniBatchKmeans(TestCase):
         assert (np.any(cc > -1.0))
 
 
+class TestMiniBatchKmeansSculley(TestCase):
+
+    def test_per_sample_learning_rate(self):
+        from sktime.clustering._clustering_bindings import kmeans as _kmeans_ext
+        state = np.random.RandomState(1)
+        batch = state.randn(100, 3)
+        centers = state.randn(5, 3)
+        counts = state.randint(0, 10, size=5).astype(np.int64)
+
+        expected_centers, expected_counts = centers.copy(), counts.copy()
+        assignments = np.argmin(((batch[:, None] - centers[None]) ** 2).sum(-1), axis=1)
+        for x, c in zip(batch, assignments):
+            expected_counts[c] += 1
+            expected_centers[c] += (x - expected_centers[c]) / expected_counts[c]
+
+        new_centers, new_counts, inertia = _kmeans_ext.minibatch_step(batch, centers, counts, 1)
+        np.testing.assert_equal(new_counts, expected_counts)
+        np.testing.assert_allclose(new_centers, expected_centers)
+        np.testing.assert_allclose(inertia, ((batch - centers[assignments]) ** 2).sum())
+
+    def test_fit_memmap_close_to_batch_inertia(self):
+        import tempfile
+        import os
+        from sklearn.datasets import make_blobs
+        from sktime.clustering import KmeansClustering
+        data = make_blobs(n_samples=50000, n_features=4, centers=10, random_state=3)[0]
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'data.npy')
+            np.save(path, data)
+            memmap = np.load(path, mmap_mode='r')
+            est = MiniBatchKmeansClustering(n_clusters=10, max_iter=2, batch_size=500, fixed_seed=7)
+            model = est.fit(memmap).fetch_model()
+            del memmap
+        batch = KmeansClustering(n_clusters=10, max_iter=100, fixed_seed=7).fit(data).fetch_model()
+        mini_batch_inertia = np.sum(np.min(((data[:, None] - model.cluster_centers[None]) ** 2).sum(-1), axis=1))
+        self.assertLess(mini_batch_inertia, 1.05 * batch.inertia)
+
+    def test_weighted_learning_rate(self):
+        state = np.random.RandomState(2)
+        batch = state.randn(200, 2)
+        weights = state.randint(0, 4, size=len(batch))
+        centers = state.randn(4, 2)
+        unweighted = MiniBatchKmeansClustering(n_clusters=4, initial_centers=centers)
+        unweighted.partial_fit(np.repeat(batch, weights, axis=0))
+        weighted = MiniBatchKmeansClustering(n_clusters=4, initial_centers=centers)
+        weighted.partial_fit(batch, weights=weights)
+        np.testing.assert_allclose(weighted.fetch_model().cluster_centers, unweighted.fetch_model().cluster_centers)
+        np.testing.assert_allclose(weighted.fetch_model().inertia, unweighted.fetch_model().inertia)
+        np.testing.assert_allclose(weighted._center_counts, unweighted._center_counts)
+        with self.assertRaises(ValueError):
+            weighted.partial_fit(batch, weights=weights[:-1])
+
+    def test_invalid_batch_size(self):
+        with self.assertRaises(ValueError):
+            MiniBatchKmeansClustering(n_clusters=3, batch_size=0)
+
+
 class TestMiniBatchKmeansResume(unittest.TestCase):
 
     @classmethod
@@ -65,6 +65,50 @@ class TestRegSpaceClustering(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.clustering.metric = "non_existent_metric"
 
+    def test_min_rmsd(self):
+        state = np.random.RandomState(5)
+        conformations = state.randn(3, 10, 3) * 3
+        frames = []
+        for i in range(60):
+            rotation, _ = np.linalg.qr(state.randn(3, 3))
+            rotation *= np.sign(np.linalg.det(rotation))
+            moved = conformations[i % 3] @ rotation.T + state.randn(3) * 10
+            frames.append(moved + state.randn(10, 3) * 1e-3)
+        data = np.array(frames).reshape(60, 30)
+        clustering = RegularSpaceClustering(dmin=0.5, metric='minRMSD')
+        model = clustering.fit(data).fetch_model()
+        self.assertEqual(model.n_clusters, 3)
+        np.testing.assert_equal(model.transform(data), np.arange(60) % 3)
+
+    def test_min_rmsd_same_centers_as_reference(self):
+        def kabsch_rmsd(x, y):
+            x, y = x.reshape(-1, 3), y.reshape(-1, 3)
+            x, y = x - x.mean(axis=0), y - y.mean(axis=0)
+            u, s, vt = np.linalg.svd(x.T @ y)
+            s[-1] *= np.sign(np.linalg.det(u @ vt))
+            return np.sqrt(max(0., ((x ** 2).sum() + (y ** 2).sum() - 2 * s.sum()) / len(x)))
+
+        def reference(data, dmin):
+            centers = [data[0]]
+            for x in data[1:]:
+                if min(kabsch_rmsd(x, c) for c in centers) > dmin:
+                    centers.append(x)
+            return np.array(centers)
+
+        state = np.random.RandomState(29)
+        data = state.randn(400, 12)
+        expected = reference(data, 1.)
+        self.assertGreater(len(expected), 10)
+        for n_jobs in (1, 3):
+            model = RegularSpaceClustering(dmin=1., metric='minRMSD', n_jobs=n_jobs).fit(data).fetch_model()
+            np.testing.assert_equal(model.cluster_centers, expected)
+        model = RegularSpaceClustering(dmin=1., metric='minRMSD', algorithm='two_phase').fit(data).fetch_model()
+        self.assertEqual(len(np.unique(model.transform(data))), model.n_clusters)
+
+        for algorithm in ('sequential', 'two_phase'):
+            with self.assertRaises(ValueError):
+                RegularSpaceClustering(dmin=1., metric='minRMSD', algorithm=algorithm).fit(data[:, :4])
+
     def test_too_small_dmin_should_warn(self):
         self.clustering.dmin = 1e-8
         max_centers = 50
@@ -80,11 +124,88 @@ class TestRegSpaceClustering(unittest.TestCase):
             model = self.clustering.fetch_model()
             assert len(model.cluster_centers) == max_centers
 
+    def test_same_centers_as_reference(self):
+        def reference(data, dmin):
+            centers = [data[0]]
+            for x in data[1:]:
+                if np.min(np.linalg.norm(np.array(centers) - x, axis=1)) > dmin:
+                    centers.append(x)
+            return np.array(centers)
+
+        state = np.random.RandomState(17)
+        for dim in (1, 2, 3, 5):
+            for dtype in (np.float32, np.float64):
+                data = state.randn(2000, dim).astype(dtype)
+                model = RegularSpaceClustering(dmin=0.4, max_centers=2000).fit(data).fetch_model()
+                self.assertEqual(model.cluster_centers.shape[1], dim)
+                np.testing.assert_equal(model.cluster_centers, reference(data, 0.4))
+                self.assertEqual(len(np.unique(model.transform(data))), model.n_clusters)
+
+    def test_partial_fit(self):
+        data = np.random.RandomState(3).randn(3000, 2)
+        expected = RegularSpaceClustering(dmin=0.2).fit(data).fetch_model().cluster_centers
+        clustering = RegularSpaceClustering(dmin=0.2)
+        n_centers = []
+        for chunk in np.array_split(data, 7):
+            n_centers.append(clustering.partial_fit(chunk).fetch_model().n_clusters)
+        np.testing.assert_equal(clustering.fetch_model().cluster_centers, expected)
+        self.assertTrue(clustering.fetch_model().converged)
+        np.testing.assert_equal(np.diff(n_centers) >= 0, True)
+
+        # fit discards the centers of previous partial fits
+        np.testing.assert_equal(clustering.fit(data[:10]).fetch_model().cluster_centers,
+                                RegularSpaceClustering(dmin=0.2).fit(data[:10]).fetch_model().cluster_centers)
+
+    def test_partial_fit_max_centers(self):
+        clustering = RegularSpaceClustering(dmin=1e-8, max_centers=50)
+        import warnings
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            for chunk in np.array_split(self.src, 4):
+                clustering.partial_fit(chunk)
+            assert w
+        model = clustering.fetch_model()
+        self.assertEqual(model.n_clusters, 50)
+        self.assertFalse(model.converged)
+        np.testing.assert_equal(model.cluster_centers, self.src[:50])
+
     def test_regspace_nthreads(self):
         self.clustering.fit(self.src, n_jobs=1)
         cl2 = RegularSpaceClustering(dmin=self.dmin, n_jobs=2).fit(self.src).fetch_model()
         np.testing.assert_equal(self.clustering.fetch_model().cluster_centers, cl2.cluster_centers)
 
+    def test_two_phase(self):
+        state = np.random.RandomState(23)
+        for dim in (2, 5):
+            data = state.randn(20000, dim)
+            model = RegularSpaceClustering(dmin=0.8, max_centers=5000, algorithm='two_phase', n_jobs=4)\
+                .fit(data).fetch_model()
+            self.assertTrue(model.converged)
+            # same guarantees as the sequential algorithm
+            centers = model.cluster_centers
+            dists = np.linalg.norm(centers[:, None] - centers[None], axis=-1)
+            np.fill_diagonal(dists, np.inf)
+            self.assertGreater(dists.min(), 0.8)
+            covered = np.linalg.norm(data - centers[model.transform(data)], axis=1)
+            np.testing.assert_array_less(covered, 0.8 + 1e-12)
+            for n_jobs in (1, 3):
+                other = RegularSpaceClustering(dmin=0.8, max_centers=5000, algorithm='two_phase', n_jobs=n_jobs)\
+                    .fit(data).fetch_model()
+                np.testing.assert_equal(other.cluster_centers, centers)
+
+        with self.assertRaises(ValueError):
+            RegularSpaceClustering(dmin=1., algorithm='parallel')
+
+    def test_two_phase_max_centers(self):
+        import warnings
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter("always")
+            model = RegularSpaceClustering(dmin=1e-8, max_centers=50, algorithm='two_phase').fit(self.src)\
+                .fetch_model()
+            assert w
+        self.assertEqual(model.n_clusters, 50)
+        self.assertFalse(model.converged)
+
 
 if __name__ == "__main__":
     unittest.main()
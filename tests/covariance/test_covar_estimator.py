@@ -342,6 +342,40 @@ class TestCovarEstimator(unittest.TestCase):
         np.testing.assert_allclose(cc.cov_00, self.Mxx_c_sym_wobj[:, self.cols_2])
         np.testing.assert_allclose(cc.cov_0t, self.Mxy_c_sym_wobj[:, self.cols_2])
 
+    def test_n_jobs(self):
+        trajs = [state.rand(1000 + 100 * i, 3) for i in range(7)]
+        for kw in (dict(compute_c0t=True, remove_data_mean=True), dict(compute_c0t=True, reversible=True),
+                   dict(compute_c0t=True, compute_ctt=True, remove_data_mean=True), dict(remove_data_mean=True)):
+            serial = OnlineCovariance(lagtime=5, **kw).fit(trajs).fetch_model()
+            for n_jobs in (2, 3, 8):
+                parallel = OnlineCovariance(lagtime=5, **kw).fit(trajs, n_jobs=n_jobs).fetch_model()
+                for attr in ('cov_00', 'cov_0t', 'cov_tt', 'mean_0', 'mean_t'):
+                    if getattr(serial, attr) is None:
+                        self.assertIsNone(getattr(parallel, attr))
+                    else:
+                        np.testing.assert_allclose(getattr(parallel, attr), getattr(serial, attr))
+            single = OnlineCovariance(lagtime=5, **kw).fit(trajs[0]).fetch_model()
+            estimator = OnlineCovariance(lagtime=5, **kw).fit(trajs[0], n_jobs=3)
+            self.assertEqual(estimator._rc.n_threads, 1)
+            for attr in ('cov_00', 'cov_0t', 'cov_tt', 'mean_0', 'mean_t'):
+                if getattr(single, attr) is not None:
+                    np.testing.assert_array_equal(getattr(estimator.fetch_model(), attr), getattr(single, attr))
+
+    def test_scipy_sparse(self):
+        import scipy.sparse
+        trajs = [np.where(state.rand(1000, 10) < .1, state.rand(1000, 10), 0.) for _ in range(3)]
+        sparse = [scipy.sparse.csr_matrix(traj) for traj in trajs]
+        for kw in (dict(compute_c0t=True, remove_data_mean=True), dict(compute_c0t=True, reversible=True),
+                   dict(compute_c0t=True, compute_ctt=True)):
+            ref = OnlineCovariance(lagtime=3, **kw).fit(trajs).fetch_model()
+            res = OnlineCovariance(lagtime=3, **kw).fit(sparse, n_jobs=2).fetch_model()
+            for attr in ('cov_00', 'cov_0t', 'cov_tt', 'mean_0', 'mean_t'):
+                desired = getattr(ref, attr)
+                if desired is not None:
+                    actual = getattr(res, attr)
+                    actual = actual.toarray() if scipy.sparse.issparse(actual) else actual
+                    np.testing.assert_allclose(actual, desired, atol=1e-12)
+
 
 class TestCovarEstimatorWeightsList(unittest.TestCase):
 
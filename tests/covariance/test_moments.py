@@ -429,6 +429,75 @@ class TestMoments(unittest.TestCase):
         self._test_moments_block(self.X_100_sparseconst, self.Y_100_sparseconst, self.cols_100, remove_mean=True,
                                  sparse_mode='sparse', sparse_tol=self.sparse_tol)
 
+    def test_moments_fused(self):
+        weights = np.random.rand(10000)
+        for dtype in (np.float64, np.float32):
+            X, Y = self.X_100.astype(dtype), self.Y_100.astype(dtype)
+            rtol = 1e-8 if dtype == np.float64 else 1e-4
+            for remove_mean in (False, True):
+                for symmetrize in (False, True):
+                    for w in (None, weights):
+                        ref = moments.moments_XXXY(X, Y, remove_mean=remove_mean, symmetrize=symmetrize, weights=w,
+                                                   sparse_mode='dense')
+                        res = moments.moments_fused(X, Y, remove_mean=remove_mean, symmetrize=symmetrize, weights=w,
+                                                    compute_XY=True)
+                        np.testing.assert_allclose(res[0], ref[0], rtol=rtol)
+                        for actual, desired in zip((res[1], res[2], res[3], res[4]), ref[1:]):
+                            np.testing.assert_allclose(actual, desired, rtol=rtol, atol=rtol * np.abs(desired).max())
+            ref = moments.moments_block(X, Y, remove_mean=True, sparse_mode='dense')
+            res = moments.moments_fused(X, Y, remove_mean=True, compute_XY=True, compute_YY=True)
+            for actual, desired in ((res[3], ref[2][0][0]), (res[4], ref[2][0][1]), (res[5], ref[2][1][1])):
+                np.testing.assert_allclose(actual, desired, rtol=rtol, atol=rtol * np.abs(desired).max())
+
+    def test_moments_fused_float32(self):
+        # float32 data is read as it is and accumulated exactly like its conversion to float64
+        X, Y = self.X_100.astype(np.float32), self.Y_100.astype(np.float32)
+        weights = np.random.rand(10000)
+        for remove_mean in (False, True):
+            for w in (None, weights):
+                ref = moments.moments_fused(X.astype(np.float64), Y.astype(np.float64), remove_mean=remove_mean,
+                                            weights=w, compute_XY=True)
+                res = moments.moments_fused(X, Y, remove_mean=remove_mean, weights=w, compute_XY=True)
+                for actual, desired in zip(res[:5], ref[:5]):
+                    np.testing.assert_allclose(actual, desired, rtol=1e-14, atol=1e-14)
+
+    def test_moments_scipy_sparse(self):
+        import scipy.sparse
+        state = np.random.RandomState(7)
+        X = np.where(state.rand(2000, 30) < .05, state.rand(2000, 30), 0.)
+        Y = np.where(state.rand(2000, 30) < .05, state.rand(2000, 30), 0.)
+        Xs, Ys = scipy.sparse.csr_matrix(X), scipy.sparse.csr_matrix(Y)
+        weights = state.rand(2000)
+
+        def dense(M):
+            return M.toarray() if scipy.sparse.issparse(M) else M
+
+        for remove_mean in (False, True):
+            for kw in (dict(), dict(weights=weights), dict(column_selection=self.cols_10),
+                       dict(diag_only=True, sparse_mode='dense')):
+                ref = moments.moments_XX(X, remove_mean=remove_mean, **kw)
+                res = moments.moments_XX(Xs, remove_mean=remove_mean, **kw)
+                for actual, desired in zip(res, ref):
+                    np.testing.assert_allclose(dense(actual), desired, atol=1e-12)
+                for symmetrize in (False, True):
+                    ref = moments.moments_XXXY(X, Y, remove_mean=remove_mean, symmetrize=symmetrize, **kw)
+                    res = moments.moments_XXXY(Xs, Ys, remove_mean=remove_mean, symmetrize=symmetrize, **kw)
+                    for actual, desired in zip(res, ref):
+                        np.testing.assert_allclose(dense(actual), desired, atol=1e-12)
+            ref = moments.moments_block(X, Y, remove_mean=remove_mean)
+            res = moments.moments_block(Xs, Ys, remove_mean=remove_mean)
+            for actual, desired in zip(res[1] + res[2][0] + res[2][1], ref[1] + ref[2][0] + ref[2][1]):
+                np.testing.assert_allclose(dense(actual), desired, atol=1e-12)
+        # few nonzeros in the product stay sparse, the mean-free moments are dense
+        self.assertTrue(scipy.sparse.issparse(moments.moments_XX(Xs[:10])[2]))
+        self.assertIsInstance(moments.moments_XX(Xs[:10], remove_mean=True)[2], np.ndarray)
+
+    def test_moments_fused_threads(self):
+        one = moments.moments_fused(self.X_100, self.Y_100, remove_mean=True, compute_XY=True, n_threads=1)
+        many = moments.moments_fused(self.X_100, self.Y_100, remove_mean=True, compute_XY=True, n_threads=7)
+        for a, b in zip(one, many):
+            np.testing.assert_array_equal(a, b)
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,39 @@
+import unittest
+
+import numpy as np
+
+from sktime.data.util import iter_chunks, reservoir_sample
+
+
+class TestDataUtil(unittest.TestCase):
+
+    def test_iter_chunks(self):
+        data = [np.arange(10), np.arange(20).reshape(10, 2)]
+        chunks = list(iter_chunks(data, chunksize=4))
+        self.assertEqual([len(c) for c in chunks], [4, 4, 2, 4, 4, 2])
+        self.assertEqual(chunks[0].shape, (4, 1))
+        np.testing.assert_equal(np.concatenate(chunks[3:]), data[1])
+        self.assertEqual(len(list(iter_chunks(lambda: iter(data)))), 2)
+        with self.assertRaises(ValueError):
+            list(iter_chunks(data, chunksize=0))
+
+    def test_reservoir_sample(self):
+        data = np.arange(1000)[:, np.newaxis]
+        sample = reservoir_sample(iter_chunks(data, chunksize=33), 100, np.random.RandomState(5))
+        self.assertEqual(sample.shape, (100, 1))
+        self.assertEqual(len(np.unique(sample)), 100)
+        # frames are kept in stream order
+        np.testing.assert_equal(np.diff(sample[:, 0]) > 0, True)
+        np.testing.assert_equal(reservoir_sample(iter_chunks(data, chunksize=33), 2000), data)
+
+    def test_reservoir_sample_uniform(self):
+        state = np.random.RandomState(7)
+        counts = np.zeros(100)
+        for _ in range(500):
+            counts[reservoir_sample(iter_chunks(np.arange(100), chunksize=9), 10, state)[:, 0]] += 1
+        # each frame is expected to be drawn 50 times
+        self.assertLess(np.abs(counts - 50).max(), 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
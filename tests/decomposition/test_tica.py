@@ -69,6 +69,18 @@ class TestTICA(unittest.TestCase):
         except ZeroRankError:
             self.fail('ZeroRankError was raised unexpectedly.')
 
+    def test_scipy_sparse(self):
+        import scipy.sparse
+        state = np.random.RandomState(3)
+        data = np.where(state.rand(5000, 20) < .1, state.rand(5000, 20), 0.)
+        sparse = scipy.sparse.csr_matrix(data)
+        model_dense = TICA(lagtime=5, dim=0.9).fit(data).fetch_model()
+        model_sparse = TICA(lagtime=5, dim=0.9).fit(sparse).fetch_model()
+        np.testing.assert_allclose(model_sparse.mean_0, model_dense.mean_0)
+        np.testing.assert_allclose(model_sparse.cov_00, model_dense.cov_00, atol=1e-12)
+        np.testing.assert_allclose(model_sparse.cov_0t, model_dense.cov_0t, atol=1e-12)
+        np.testing.assert_allclose(model_sparse.transform(sparse), model_dense.transform(data), atol=1e-10)
+
 
 def generate_hmm_test_data():
     import msmtools.generation as msmgen